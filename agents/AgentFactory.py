@@ -1,4 +1,7 @@
+import os
+from agents.checkpoints.CheckpointStore import CheckpointStore
 from gui.AnalysisConfig import AnalysisConfig
+from hosts.HostInterface import HostInterface
 
 
 class AgentFactory:
@@ -25,3 +28,71 @@ class AgentFactory:
             AgentFactory.agents = conf.get_all_classes(conf.agents_directory + "impl/", "agents.impl.")
         agent_class = agent_json["class"]
         return AgentFactory.agents[agent_class](agent_json, n_actions, env)
+
+    @staticmethod
+    def load(checkpoint_file, env=None, map_location=None, lazy=True):
+        """
+        Rebuild the agent saved in a checkpoint for inference
+        :param checkpoint_file: the file containing the description of the checkpoint
+        :param env: the environment, only required by agents whose generative model is built from the environment
+        :param map_location: the device on which the agent must be loaded, e.g., "cpu", None to use a gpu if available
+        :param lazy: whether to delay the loading of each network's weights until its first forward pass (or its first
+            call to state_dict), note that parameters() returns the initial weights until the weights are loaded
+        :return: the agent
+        """
+        # Load the description of the checkpoint.
+        store = CheckpointStore(os.path.dirname(checkpoint_file))
+        checkpoint = store.load(checkpoint_file)
+        if "agent_json" not in checkpoint.keys():
+            raise Exception(f"The checkpoint '{checkpoint_file}' does not describe the agent and cannot be loaded.")
+
+        # Create the agent on the requested device, the device of the process is restored afterwards.
+        previous_device = HostInterface.device
+        try:
+            if map_location is not None:
+                HostInterface.set_device(map_location)
+            module = __import__(checkpoint["agent_module"], fromlist=[checkpoint["agent_class"]])
+            agent = getattr(module, checkpoint["agent_class"])(checkpoint["agent_json"], checkpoint["n_actions"], env)
+        finally:
+            HostInterface.device = previous_device
+
+        # Load the weights of each network.
+        for name in store.networks(checkpoint):
+            network = getattr(agent, name)
+            expected_class = checkpoint[f"{name}_net_class"]
+            network_class = network.__class__.__name__
+            if network_class != expected_class:
+                raise Exception(f"The {name} network should be a '{expected_class}' not a '{network_class}'.")
+            network.eval()
+            if lazy:
+                AgentFactory.load_weights_lazily(network, store, checkpoint, name)
+            else:
+                network.load_state_dict(store.load_state_dict(checkpoint, name))
+
+        # Load the state of the agent that is not stored in its networks.
+        agent.load_checkpoint(store, checkpoint)
+        return agent
+
+    @staticmethod
+    def load_weights_lazily(network, store, checkpoint, name):
+        """
+        Delay the loading of the network's weights until its first forward pass or its first call to state_dict, the
+        weights returned by parameters() are the initial weights until then
+        :param network: the network whose weights must be loaded
+        :param store: the store containing the weights
+        :param checkpoint: the description of the checkpoint
+        :param name: the name of the network in the checkpoint
+        """
+        def load_weights(*_):
+            if "state_dict" not in network.__dict__:
+                return
+            del network.state_dict
+            handle.remove()
+            network.load_state_dict(store.load_state_dict(checkpoint, name))
+
+        def state_dict(*args, **kwargs):
+            load_weights()
+            return network.state_dict(*args, **kwargs)
+
+        handle = network.register_forward_pre_hook(load_weights)
+        network.state_dict = state_dict
@@ -1,6 +1,7 @@
 import abc
 import os
 from pathlib import Path
+from hosts.HostInterface import HostInterface
 
 
 class AgentInterface(abc.ABC):
@@ -15,6 +16,11 @@ class AgentInterface(abc.ABC):
         """
         self.name = name
         self.image_shape = (1, 64, 64)
+        self.batch_size = 32
+
+        # The device on which the agent is created, which may differ from the device of the process when the agent
+        # is loaded with a map location.
+        self.device = HostInterface.get_device()
 
     @abc.abstractmethod
     def step(self, obs, steps_done):
@@ -63,6 +69,14 @@ class AgentInterface(abc.ABC):
         """
         pass
 
+    def load_checkpoint(self, store, checkpoint):
+        """
+        Restore the state of the agent that is not stored in its networks, e.g., the learned generative model
+        :param store: the store containing the tensors of the checkpoint
+        :param checkpoint: the description of the checkpoint
+        """
+        pass
+
     @abc.abstractmethod
     def learn(self, logging_file, buffer, steps_done):
         """
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+class CheckpointStore:
+    """
+    A class storing checkpoints whose tensors are content-addressed, i.e., each tensor is written once in the store
+    and shared by all the checkpoints containing it
+    """
+
+    def __init__(self, directory):
+        """
+        Constructor
+        :param directory: the directory in which the checkpoints are stored
+        """
+        self.directory = directory if directory.endswith("/") else directory + "/"
+        self.tensors_directory = self.directory + "tensors/"
+
+    def save(self, checkpoint_file, checkpoint):
+        """
+        Save a checkpoint, only the tensors that are not already in the store are written on the file system
+        :param checkpoint_file: the file in which the description of the checkpoint must be saved
+        :param checkpoint: a dictionary whose entries ending with "_state_dict" contain the weights of the networks,
+            all the other entries must be serializable in json
+        """
+        # Create the tensors directory, if it does not exist.
+        if not os.path.exists(self.tensors_directory):
+            os.makedirs(self.tensors_directory)
+
+        # Replace each tensor of the state dictionaries by its key in the store.
+        description = {}
+        for entry, value in checkpoint.items():
+            if entry.endswith("_state_dict"):
+                value = {name: self.save_tensor(tensor) for name, tensor in value.items()}
+            description[entry] = value
+
+        # Write the description of the checkpoint, the file is replaced atomically to avoid partial checkpoints.
+        with open(checkpoint_file + ".tmp", "w") as file:
+            json.dump(description, file, indent=2)
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+    def save_tensor(self, tensor):
+        """
+        Save a tensor in the store, if it is not already stored
+        :param tensor: the tensor to save
+        :return: the key of the tensor in the store
+        """
+        # Compute the key of the tensor from its content.
+        array = tensor.detach().cpu().contiguous().numpy()
+        key = hashlib.sha1(f"{array.dtype}{array.shape}".encode())
+        key.update(array.reshape(-1).view(np.uint8))
+        key = key.hexdigest()
+
+        # Write the tensor, only if it is not already stored.
+        tensor_file = self.tensor_file(key)
+        if not os.path.exists(tensor_file):
+            with open(tensor_file + ".tmp", "wb") as file:
+                np.save(file, array)
+            os.replace(tensor_file + ".tmp", tensor_file)
+        return key
+
+    def tensor_file(self, key):
+        """
+        Getter
+        :param key: the key of a tensor in the store
+        :return: the file containing the tensor
+        """
+        return self.tensors_directory + f"{key}.npy"
+
+    @staticmethod
+    def load(checkpoint_file):
+        """
+        Load the description of a checkpoint, no tensor is loaded
+        :param checkpoint_file: the file containing the description of the checkpoint
+        :return: the description of the checkpoint
+        """
+        with open(checkpoint_file, "r") as file:
+            return json.load(file)
+
+    @staticmethod
+    def networks(checkpoint):
+        """
+        Getter
+        :param checkpoint: the description of the checkpoint
+        :return: the names of the networks whose weights are stored in the checkpoint
+        """
+        return [entry[:-len("_net_state_dict")] for entry in checkpoint.keys() if entry.endswith("_net_state_dict")]
+
+    def load_state_dict(self, checkpoint, network, map_location=None):
+        """
+        Load the weights of a single network, the tensors are memory-mapped unless they are sent to another device
+        :param checkpoint: the file containing the description of the checkpoint, or the description itself
+        :param network: the network name, e.g., "encoder"
+        :param map_location: the device on which the tensors must be loaded, None to keep them memory-mapped
+        :return: the state dictionary of the network
+        """
+        return self.load_tensors(checkpoint, f"{network}_net_state_dict", map_location)
+
+    def load_tensors(self, checkpoint, entry, map_location=None):
+        """
+        Load the tensors of an entry of a checkpoint, the tensors are memory-mapped unless they are sent to another
+        device
+        :param checkpoint: the file containing the description of the checkpoint, or the description itself
+        :param entry: the name of an entry ending with "_state_dict", e.g., "encoder_net_state_dict"
+        :param map_location: the device on which the tensors must be loaded, None to keep them memory-mapped
+        :return: the dictionary of tensors
+        """
+        if isinstance(checkpoint, str):
+            checkpoint = self.load(checkpoint)
+        tensors = OrderedDict()
+        for name, key in checkpoint[entry].items():
+            tensor = torch.from_numpy(np.load(self.tensor_file(key), mmap_mode="c"))
+            tensors[name] = tensor if map_location is None else tensor.to(map_location)
+        return tensors
+
+    def collect_garbage(self):
+        """
+        Remove the tensors that are not used by any checkpoint of the store
+        """
+        # Collect the keys of all the tensors used by at least one checkpoint.
+        used_keys = set()
+        for file in os.listdir(self.directory):
+            if file.startswith("checkpoint-") and file.endswith(".json"):
+                checkpoint = self.load(self.directory + file)
+                for entry, value in checkpoint.items():
+                    if entry.endswith("_state_dict"):
+                        used_keys |= set(value.values())
+
+        # Remove the unused tensors.
+        for file in os.listdir(self.tensors_directory):
+            if file.endswith(".npy") and file[:-len(".npy")] not in used_keys:
+                os.remove(self.tensors_directory + file)
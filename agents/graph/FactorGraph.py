@@ -1,3 +1,4 @@
+import torch
 from agents.graph.VariableNode import VariableNode
 from agents.graph.FactorNode import FactorNode
 
@@ -13,6 +14,11 @@ class FactorGraph:
         """
         self.nodes = {}
 
+        # The compiled schedule of belief propagation, i.e., a list of (source node, target node) pairs, which is None
+        # if the factor graph contains loops. The schedule must be recompiled when the graph structure changes.
+        self.schedule = None
+        self.compiled = False
+
     def __getitem__(self, index):
         """
         Get the node corresponding to the index.
@@ -28,6 +34,7 @@ class FactorGraph:
         :return: nothing.
         """
         self.nodes[var_name] = VariableNode(var_name)
+        self.compiled = False
 
     def add_factor(self, factor_name, neighbours, params):
         """
@@ -40,6 +47,7 @@ class FactorGraph:
         self.nodes[factor_name] = FactorNode(factor_name, neighbours, params)
         for neighbour in neighbours:
             self.nodes[neighbour].add_neighbours([factor_name])
+        self.compiled = False
 
     def add_evidence_placeholder(self, obs_name):
         """
@@ -61,8 +69,47 @@ class FactorGraph:
             print("Warning: e_{} is not in the factor graph's nodes.".format(obs_name))
             return
 
-        # Set the evidence.
-        self.nodes["e_" + obs_name].params = evidence
+        # Set the evidence, as a tensor of the same type as the messages.
+        self.nodes["e_" + obs_name].params = torch.as_tensor(evidence, dtype=torch.float32)
+
+    def compile_schedule(self):
+        """
+        Compile the schedule of belief propagation, i.e., in each connected component, the messages are sent from the
+        leaves to a root (first pass) and then from the root to the leaves (second pass).
+        :return: the schedule, i.e., a list of (source node, target node) pairs, or None if the factor graph contains
+            loops and belief propagation cannot be used.
+        """
+        self.compiled = True
+        self.schedule = None
+        upward_pass = []
+        downward_pass = []
+        visited = set()
+        for root in self.nodes.values():
+            if root.name in visited:
+                continue
+
+            # Order the nodes of the connected component such that each node appears after its parent.
+            visited.add(root.name)
+            order = []
+            stack = [(root, None)]
+            while len(stack) != 0:
+                node, parent = stack.pop()
+                order.append((node, parent))
+                for neighbour in node.neighbours:
+                    if parent is not None and neighbour == parent.name:
+                        continue
+                    if neighbour in visited:
+                        return None
+                    visited.add(neighbour)
+                    stack.append((self.nodes[neighbour], node))
+
+            # Each node sends its message to its parent after receiving the messages of its children, then each node
+            # sends its messages to its children after receiving the message of its parent.
+            upward_pass += [(node, parent) for node, parent in reversed(order) if parent is not None]
+            downward_pass += [(parent, node) for node, parent in order if parent is not None]
+
+        self.schedule = upward_pass + downward_pass
+        return self.schedule
 
     def reset_messages(self):
         """
@@ -1,7 +1,6 @@
 from agents.graph.Node import Node
-from agents.inference.Operators import Operators
+from agents.inference.Contraction import Contraction
 import torch
-import numpy as np
 
 
 class FactorNode(Node):
@@ -21,34 +20,37 @@ class FactorNode(Node):
 
     def compute_message(self, dest_name, use_default_val=False):
         """
-        Compute the message toward the destination node
+        Compute the message toward the destination node, in log space. The incoming messages may have a leading batch
+        dimension, in which case the output message is batched too
         :param dest_name: the name of the destination node
-        :param use_default_val: whether to replace None values by ones
-        :return: the message to the destination node
+        :param use_default_val: whether to replace None values by uniform messages
+        :return: the message to the destination node, or None if an incoming message is missing
         """
-        out_msg = self.params
-        if out_msg is None:
+        if self.params is None:
             raise Exception("In FactorNode::compute_message, {}.param is None.".format(self.name))
 
-        for name in reversed(self.neighbours):
+        # Collect the incoming messages.
+        operands = []
+        batch_size = None
+        for i, name in enumerate(self.neighbours):
             if dest_name == name:
                 continue
-            i = self.neighbours.index(name)
-
-            # Get message value
-            if type(self.in_messages[name]) == np.ndarray:
-                self.in_messages[name] = torch.from_numpy(self.in_messages[name])
             message = self.in_messages[name]
-            if use_default_val and message is None:
-                self.in_messages[name] = torch.ones(out_msg.shape[i])
-                message = self.in_messages[name]
+            if message is None:
+                if not use_default_val:
+                    return None
+                message = torch.zeros(self.params.shape[i])
+                self.in_messages[name] = message
+            if message.dim() == 2:
+                batch_size = message.shape[0]
+            operands.append((message, [i]))
 
-            # Average the output message across the i-th dimension
-            out_msg = Operators.average(out_msg, message, [i])
-        max_elem = out_msg.max()
-        if out_msg is None:
-            return None
-        elif max_elem == 0:
-            return out_msg
+        # Average the parameters across the dimensions of all the incoming messages, in a single contraction.
+        if len(operands) == 0:
+            out_msg = self.params.log()
+        elif batch_size is None:
+            out_msg = Contraction.log_contract(self.params, operands)
         else:
-            return out_msg / out_msg.max()
+            operands = [(msg.expand(batch_size, -1) if msg.dim() == 1 else msg, ml) for msg, ml in operands]
+            out_msg = Contraction.log_contract(self.params, operands, batch=True)
+        return self.normalise(out_msg)
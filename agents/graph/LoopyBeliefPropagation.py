@@ -0,0 +1,171 @@
+import math
+import time
+import torch
+from agents.graph.FactorNode import FactorNode
+from agents.graph.Node import Node
+from agents.graph.VariableNode import VariableNode
+
+
+class LoopyBeliefPropagation:
+    """
+    Class implementing loopy belief propagation over a factor graph, using damped messages and threshold sweeps.
+    The messages are sent in sweeps, where the variables send their messages and then the factors send theirs. In each
+    half of a sweep, only the nodes that received a new message are recomputed (once per node, rather than once per
+    message received), the residuals of all the messages are computed in one operation per message shape, and only the
+    messages whose residual is above the tolerance are sent. The messages are not ordered by residual, i.e., all the
+    messages above the tolerance are sent in the same sweep.
+    """
+
+    def __init__(self, tolerance=1e-4, damping=0.0, max_iterations=50):
+        """
+        Construct the loopy belief propagation engine.
+        :param tolerance: the largest change of a message for which the messages are considered converged.
+        :param damping: the weight of the previous message in the damped message, zero means no damping. Damping is
+            only useful on factor graphs with loops, on a tree it only delays convergence.
+        :param max_iterations: the maximum number of iterations, where an iteration is a sweep in which each message
+            is recomputed at most once.
+        """
+        self.tolerance = tolerance
+        self.damping = damping
+        self.max_iterations = max_iterations
+
+        # The statistics of the last run, i.e., the number of iterations and message updates, and the execution time,
+        # as well as the number of runs that failed because of a NaN message since the engine was created.
+        self.stats = {"iterations": 0, "n_updates": 0, "time": 0, "converged": False, "n_failures": 0}
+
+    def run(self, fg):
+        """
+        Compute the messages of the factor graph until convergence, or until the maximum number of iterations is
+        reached. The evidence must be set before calling this function. A RuntimeError is raised if a message is NaN, in
+        which case the failure is counted in the statistics.
+        :param fg: the factor graph.
+        :return: the statistics of the run.
+        """
+        start_time = time.perf_counter()
+
+        # Initialise all the messages to uniform messages (in log space), the factors without parameters (e.g., evidence
+        # placeholders of unobserved variables) keep sending uniform messages.
+        sizes = self.variables_size(fg)
+        for node in fg.nodes.values():
+            for neighbour in node.neighbours:
+                variable = neighbour if isinstance(node, FactorNode) else node.name
+                fg[neighbour].in_messages[node.name] = torch.zeros(sizes[variable])
+
+        # Send the messages in sweeps, until no message changes by more than the tolerance.
+        dirty = set(node.name for node in fg.nodes.values() if self.can_send_messages(node))
+        n_updates = 0
+        n_iterations = 0
+        try:
+            while len(dirty) != 0 and n_iterations < self.max_iterations:
+                n_iterations += 1
+                for node_type in [VariableNode, FactorNode]:
+                    sources = [name for name in dirty if isinstance(fg[name], node_type)]
+                    dirty.difference_update(sources)
+                    n_updates += self.send_messages(fg, sources, dirty)
+        except RuntimeError:
+            # Count the failure, and let the caller handle the error.
+            self.stats["converged"] = False
+            self.stats["n_failures"] += 1
+            raise
+
+        # Save the statistics of the run.
+        self.stats = {
+            "iterations": n_iterations,
+            "n_updates": n_updates,
+            "time": time.perf_counter() - start_time,
+            "converged": len(dirty) == 0,
+            "n_failures": self.stats["n_failures"]
+        }
+        return self.stats
+
+    def send_messages(self, fg, sources, dirty):
+        """
+        Compute the messages sent by some nodes, and send the messages whose residual is above the tolerance.
+        :param fg: the factor graph.
+        :param sources: the names of the nodes whose messages must be computed.
+        :param dirty: the names of the nodes that must recompute their messages in the next half sweep, the nodes
+            receiving a new message are added to it.
+        :return: the number of messages sent.
+        """
+        # Compute the messages of all the sources.
+        edges = []
+        messages = []
+        for source in sources:
+            for target, message in fg[source].compute_messages(fg[source].neighbours).items():
+                edges.append((source, target))
+                messages.append(message)
+
+        # Send the messages whose residual is above the tolerance, the damping is performed in probability space.
+        old_messages = [fg[target].in_messages[source] for source, target in edges]
+        residuals = self.residuals(edges, messages, old_messages)
+        n_updates = 0
+        for (source, target), message, old_message, residual in zip(edges, messages, old_messages, residuals):
+            if residual < self.tolerance:
+                continue
+            if self.damping > 0:
+                message = torch.logaddexp(
+                    math.log(self.damping) + old_message, math.log(1 - self.damping) + message
+                )
+                message = Node.normalise(message)
+
+                # The damped message has not reached its (undamped) value yet, so it must be sent again.
+                dirty.add(source)
+            fg[target].in_messages[source] = message
+            n_updates += 1
+
+            # The messages sent by the target must be recomputed, because one of their inputs changed.
+            if self.can_send_messages(fg[target]):
+                dirty.add(target)
+        return n_updates
+
+    @staticmethod
+    def residuals(edges, log_messages, old_log_messages):
+        """
+        Compute the residuals of a list of messages, i.e., the largest absolute difference between each message and the
+        message previously sent along the same edge (in probability space). The messages of the same shape are stacked,
+        so that their residuals are computed in one operation.
+        :param edges: the pairs (source, target) describing the messages.
+        :param log_messages: the new messages in log space.
+        :param old_log_messages: the previous messages in log space.
+        :return: the list of residuals.
+        """
+        groups = {}
+        for i, (message, old_message) in enumerate(zip(log_messages, old_log_messages)):
+            groups.setdefault((message.shape, old_message.shape), []).append(i)
+        residuals = [0.0] * len(log_messages)
+        for indices in groups.values():
+            messages = torch.stack([log_messages[i] for i in indices])
+            if messages.isnan().any():
+                source, target = edges[indices[int(messages.flatten(1).isnan().any(dim=1).nonzero()[0])]]
+                raise RuntimeError(f"Loopy belief propagation produced a NaN message from {source} to {target}.")
+            old_messages = torch.stack([old_log_messages[i].expand_as(log_messages[i]) for i in indices])
+            group_residuals = (messages.exp() - old_messages.exp()).abs().flatten(1).max(dim=1).values
+            for i, residual in zip(indices, group_residuals.tolist()):
+                residuals[i] = residual
+        return residuals
+
+    @staticmethod
+    def can_send_messages(node):
+        """
+        Check whether a node can send messages, i.e., whether it is not a factor without parameters.
+        :param node: the node.
+        :return: True if the node can send messages, False otherwise.
+        """
+        return not isinstance(node, FactorNode) or node.params is not None
+
+    @staticmethod
+    def variables_size(fg):
+        """
+        Getter.
+        :param fg: the factor graph.
+        :return: a mapping from the name of each variable to the number of values it can take.
+        """
+        sizes = {}
+        for factor in fg.factor_nodes():
+            if factor.params is None:
+                continue
+            # The parameters of an evidence factor may have a leading batch dimension.
+            shift = factor.params.dim() - len(factor.neighbours)
+            for i, name in enumerate(factor.neighbours):
+                sizes[name] = factor.params.shape[i + shift]
+        return sizes
@@ -1,3 +1,6 @@
+import torch
+
+
 class Node:
     """
     Class representing an abstract node in the factor graph.
@@ -15,13 +18,33 @@ class Node:
 
     def compute_message(self, dest_name, use_default_val=False):
         """
-        Compute the message toward the destination node
+        Compute the message toward the destination node, in log space
         :param dest_name: the name of the destination node
-        :param use_default_val: whether to replace None values by ones
+        :param use_default_val: whether to replace None values by uniform messages
         :return: the message to the destination node
         """
         raise Exception("Node::compute_message is not implemented")
 
+    def compute_messages(self, dest_names):
+        """
+        Compute the messages toward several destination nodes, in log space
+        :param dest_names: the names of the destination nodes
+        :return: a mapping from the name of each destination node to its message
+        """
+        return {dest_name: self.compute_message(dest_name) for dest_name in dest_names}
+
+    @staticmethod
+    def normalise(log_msg):
+        """
+        Normalise a message in log space such that its largest value is zero, i.e., one in probability space
+        :param log_msg: the message to normalise, which may have a leading batch dimension
+        :return: the normalised message, or None if the message is None
+        """
+        if log_msg is None:
+            return None
+        shift = log_msg.max(dim=-1, keepdim=True).values
+        return log_msg - torch.where(torch.isfinite(shift), shift, torch.zeros_like(shift))
+
     def add_neighbours(self, neighbours):
         """
         Add neighbours to the node.
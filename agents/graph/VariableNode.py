@@ -1,4 +1,5 @@
 from agents.graph.Node import Node
+import torch
 
 
 class VariableNode(Node):
@@ -15,20 +16,40 @@ class VariableNode(Node):
 
     def compute_message(self, dest_name, use_default_val=True):
         """
-        Compute the message toward the destination node
+        Compute the message toward the destination node, in log space. The incoming messages may have a leading batch
+        dimension, in which case the output message is batched too
         :param dest_name: the name of the destination node
-        :param use_default_val: whether to replace None values by ones
-        :return: the message to the destination node
+        :param use_default_val: whether to replace None values by uniform messages
+        :return: the message to the destination node, or None if no incoming message is available
         """
         out_msg = None
         for name, message in self.in_messages.items():
             if dest_name == name:
                 continue
-            out_msg = message if out_msg is None else out_msg * message
-        max_elem = out_msg.max()
-        if out_msg is None:
-            return None
-        elif max_elem == 0:
-            return out_msg
-        else:
-            return out_msg / out_msg.max()
+            if message is None:
+                if not use_default_val:
+                    return None
+                continue
+            out_msg = message if out_msg is None else out_msg + message
+        return self.normalise(out_msg)
+
+    def compute_messages(self, dest_names):
+        """
+        Compute the messages toward several destination nodes, in log space. When all the incoming messages are
+        available, the message toward each neighbour is the sum of all the incoming messages except its own, which is
+        computed for all the neighbours at once from the prefix and suffix sums of the incoming messages
+        :param dest_names: the names of the destination nodes
+        :return: a mapping from the name of each destination node to its message
+        """
+        names = list(self.in_messages.keys())
+        messages = list(self.in_messages.values())
+        if len(names) < 3 or any(message is None for message in messages):
+            return super().compute_messages(dest_names)
+
+        # The sum of the messages before and after each neighbour, which never adds +inf to -inf.
+        messages = torch.stack(torch.broadcast_tensors(*messages))
+        zeros = torch.zeros_like(messages[:1])
+        prefix = torch.cat([zeros, messages[:-1].cumsum(dim=0)])
+        suffix = torch.cat([messages[1:].flip(0).cumsum(dim=0).flip(0), zeros])
+        out_msgs = self.normalise(prefix + suffix)
+        return {dest_name: out_msgs[names.index(dest_name)] for dest_name in dest_names}
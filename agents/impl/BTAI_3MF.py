@@ -3,9 +3,15 @@ import numpy
 from PIL import Image
 import os
 from agents.AgentInterface import AgentInterface
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from agents.inference.AmortizedInference import AmortizedInference
+from agents.inference.DirichletLearning import DirichletLearning
 from agents.inference.TemporalSliceBuilder import TemporalSliceBuilder
+from agents.planning.ArrayMCTS import ArrayMCTS
 from agents.planning.MCTS import MCTS
+from gui.AnalysisConfig import AnalysisConfig
 import torch
+from torch.nn.functional import one_hot
 
 
 class BTAI_3MF(AgentInterface):
@@ -13,6 +19,10 @@ class BTAI_3MF(AgentInterface):
     The class implementing the Branching Time Active Inference algorithm with Multi-Modalities and Multi-Factors
     """
 
+    # The version of the generative model created by create_temporal_slice_builder, it must be increased whenever the
+    # generated model changes so that the models cached on the file system are regenerated.
+    MODEL_VERSION = 1
+
     def __init__(self, agent_json, n_actions, env):
         """
         Construct the BTAI_3MF agent
@@ -27,10 +37,50 @@ class BTAI_3MF(AgentInterface):
         self.n_actions = n_actions
         self.agent_json = agent_json
         self.env = env
+        self.batch_size = int(agent_json.get("batch_size", 32))
+        self.vfe_lr = float(agent_json.get("vfe_lr", 0.001))
+        self.learn_mappings = agent_json.get("learn_mappings", "False") == "True"
+        self.dirichlet_concentration = float(agent_json.get("dirichlet_concentration", 100))
+        self.flush_interval = int(agent_json.get("flush_interval", 10))
+        self.structured_noise = agent_json.get("structured_noise", "False") == "True"
+        self.lbp_tolerance = float(agent_json.get("lbp_tolerance", 1e-4))
+        self.lbp_damping = float(agent_json.get("lbp_damping", 0))
+        self.lbp_max_iterations = int(agent_json.get("lbp_max_iterations", 50))
+        if self.structured_noise and self.learn_mappings:
+            print("[WARNING] Mappings stored as structured noise cannot be learned, dense tensors will be used.")
+            self.structured_noise = False
         self.ts = self.create_temporal_slide()
-        self.mcts = MCTS(self.exp_const, n_samples=self.n_samples)
+        self.mcts_tree = agent_json.get("mcts_tree", "Temporal slices")
+        self.reuse_subtree = agent_json.get("reuse_subtree", "False") == "True"
+        self.reuse_tolerance = float(agent_json.get("reuse_tolerance", 0.5))
+        self.n_parallel_leaves = int(agent_json.get("n_parallel_leaves", 1))
+        self.transposition_table_size = int(agent_json.get("transposition_table_size", 0))
+        self.transposition_table_precision = float(agent_json.get("transposition_table_precision", 0.01))
+        if self.mcts_tree == "Arrays":
+            capacity = (1 + self.max_planning_steps) * n_actions
+            self.mcts = ArrayMCTS(
+                self.exp_const, self.n_samples, capacity, self.reuse_subtree, self.n_parallel_leaves,
+                self.transposition_table_size, self.reuse_tolerance, self.transposition_table_precision
+            )
+        else:
+            self.mcts = MCTS(
+                self.exp_const, self.n_samples, self.transposition_table_size, self.transposition_table_precision
+            )
         self.last_action = None
-        self.inference_type = InfAlgo.BACKPROPAGATION  # TODO this could be added to the json
+        self.inference_name = agent_json.get("inference_type", "Backpropagation")
+        self.inference_type = {
+            "Belief propagation": InfAlgo.BELIEF_PROPAGATION,
+            "Loopy belief propagation": InfAlgo.LOOPY_BELIEF_PROPAGATION,
+            "Backpropagation": InfAlgo.BACKPROPAGATION,
+        }[self.inference_name]
+        if self.inference_type == InfAlgo.BELIEF_PROPAGATION and self.ts.fg.schedule is None:
+            print(
+                "[WARNING] The generative model contains loops, so belief propagation cannot be used. Loopy belief "
+                "propagation will be run instead."
+            )
+        self.dirichlet_learning = None if not self.learn_mappings else DirichletLearning(
+            self.ts, self.dirichlet_concentration, self.flush_interval, self.inference_type
+        )
 
     def a(self, noise=0.01):
         """
@@ -39,20 +89,18 @@ class BTAI_3MF(AgentInterface):
         :return: the likelihood mappings for each observation.
         """
         env = self.env.unwrapped
-        likelihoods = {}
-        for x in range(env.width):
-            for y in range(env.height):
-                likelihood = torch.full([3, env.width, env.height, 2], noise / 2)
-                for c in range(2):
-                    for xi in range(env.width):
-                        for yi in range(env.height):
-                            for ci in range(2):
-                                if xi == x and yi == y and ci == c:
-                                    likelihood[ci][xi][yi][c] = 1 - noise
-                                if xi != x or yi != y:
-                                    likelihood[2][xi][yi][c] = 1 - noise
-                likelihoods[f"O_{x}_{y}"] = likelihood
-        return likelihoods
+
+        # The likelihood of the pixel (x, y) is stored in likelihoods[x, y], by default the pixel is empty.
+        likelihoods = torch.full([env.width, env.height, 3, env.width, env.height, 2], noise / 2)
+        likelihoods[:, :, 2] = 1 - noise
+
+        # When the shape is on the pixel (x, y), the pixel takes the color of the shape.
+        xs = torch.arange(env.width).view(-1, 1, 1)
+        ys = torch.arange(env.height).view(1, -1, 1)
+        colors = torch.arange(2).view(1, 1, -1)
+        likelihoods[xs, ys, 2, xs, ys, colors] = noise / 2
+        likelihoods[xs, ys, colors, xs, ys, colors] = 1 - noise
+        return {f"O_{x}_{y}": likelihoods[x, y] for x in range(env.width) for y in range(env.height)}
 
     def b(self, noise=0.01):
         """
@@ -65,22 +113,16 @@ class BTAI_3MF(AgentInterface):
 
         # Generate the transition matrix of S_color for which action has no effect.
         transition = torch.full([env.s_sizes[2], env.s_sizes[2]], noise / (env.s_sizes[2] - 1))
-        for j in range(env.s_sizes[2]):
-            transition[j][j] = 1 - noise
+        transition.fill_diagonal_(1 - noise)
         transitions[env.state_names[2]] = transition
 
         # Generate transitions for which action has an effect.
         for i in range(2):
             transition = torch.full([env.s_sizes[i], env.s_sizes[i], self.n_actions], noise / (env.s_sizes[i] - 1))
-            for j in range(env.s_sizes[i]):
-                cur_state = torch.zeros([len(env.s_sizes)])
-                cur_state[i] = j
-                for k in range(self.n_actions):
-                    env.x, env.y, env.reward_on_the_right = cur_state[0], cur_state[1], bool(cur_state[2])
-                    env.step(k)
-                    dest_state = torch.tensor([env.x, env.y, int(env.reward_on_the_right)])
-                    dest_id = int(dest_state[i].item())
-                    transition[dest_id][j][k] = 1 - noise
+            dest_states = torch.from_numpy(env.transitions(i))
+            states = torch.arange(env.s_sizes[i]).view(-1, 1)
+            actions = torch.arange(self.n_actions).view(1, -1)
+            transition[dest_states, states, actions] = 1 - noise
             transitions[env.state_names[i]] = transition
         return transitions
 
@@ -122,14 +164,48 @@ class BTAI_3MF(AgentInterface):
 
     def create_temporal_slide(self):
         """
-        Create a temporal slice for the mini dSprites environment
+        Create a temporal slice for the mini dSprites environment, the generative model is generated once per
+        environment configuration and cached on the file system
         :return: the temporal slide built
         """
+        # Load the generative model from the cache, or generate it and add it to the cache
+        model_directory = self.model_directory()
+        generator_parameters = self.generator_parameters()
+        if model_directory is not None and TemporalSliceBuilder.exists(model_directory, generator_parameters):
+            ts_builder = TemporalSliceBuilder.load(model_directory)
+        else:
+            ts_builder = self.create_temporal_slice_builder()
+            if model_directory is not None:
+                ts_builder.save(model_directory, generator_parameters)
+
+        # Build the temporal slice, the near-deterministic mappings are stored as structured noise if requested
+        if self.structured_noise:
+            ts_builder.use_structured_noise()
+        ts_builder.set_loopy_belief_propagation(self.lbp_tolerance, self.lbp_damping, self.lbp_max_iterations)
+        ts = ts_builder.build()
+        ts.amortized_inference = AmortizedInference(learning_rate=self.vfe_lr, batch_size=self.batch_size)
+        ts.amortized_inference.build(ts)
+        return ts
+
+    @property
+    def encoder(self):
+        """
+        Getter
+        :return: the encoder used by the I-step based on backpropagation, which is shared by all the temporal slices
+        """
+        return self.ts.amortized_inference.encoder
+
+    def create_temporal_slice_builder(self):
+        """
+        Create the builder of the temporal slice, i.e., the generative model of the mini dSprites environment
+        :return: the builder of the temporal slide
+        """
         env = self.env.unwrapped
-        a = self.a()
-        b = self.b()
-        c = self.c()
-        d = self.d(uniform=True)
+        parameters = self.generator_parameters()
+        a = self.a(parameters["likelihood_noise"])
+        b = self.b(parameters["transition_noise"])
+        c = self.c(parameters["preference_noise"])
+        d = self.d(uniform=parameters["uniform_prior"])
         ts_builder = TemporalSliceBuilder("A_0", self.n_actions) \
             .add_state("S_x", d["S_x"]) \
             .add_state("S_y", d["S_y"]) \
@@ -137,12 +213,43 @@ class BTAI_3MF(AgentInterface):
             .add_transition("S_x", b["S_x"], ["S_x", "A_0"]) \
             .add_transition("S_y", b["S_y"], ["S_y", "A_0"]) \
             .add_transition("S_color", b["S_color"], ["S_color"])
-        for i in range(env.width):
-            for j in range(env.height):
-                ts_builder.add_observation(f"O_{i}_{j}", a[f"O_{i}_{j}"], ["S_x", "S_y", "S_color"])
+        obs_names = [f"O_{i}_{j}" for i in range(env.width) for j in range(env.height)]
+        obs_likelihood = torch.stack([a[obs_name] for obs_name in obs_names])
+        ts_builder.add_observation_group("O_pixels", obs_names, obs_likelihood, ["S_x", "S_y", "S_color"])
         ts_builder.add_preference([f"O_{0}_{env.height - 1}"], c["O_bottom_left"])
         ts_builder.add_preference([f"O_{env.width - 1}_{env.height - 1}"], c["O_bottom_right"])
-        return ts_builder.build()
+        return ts_builder
+
+    def generator_parameters(self):
+        """
+        Getter
+        :return: the parameters used by create_temporal_slice_builder to generate the model, which identify the models
+            cached on the file system
+        """
+        env = self.env.unwrapped
+        return {
+            "model_version": BTAI_3MF.MODEL_VERSION,
+            "environment": "MiniSprites",
+            "width": env.width,
+            "height": env.height,
+            "n_actions": self.n_actions,
+            "likelihood_noise": 0.01,
+            "transition_noise": 0.01,
+            "preference_noise": 0.01,
+            "uniform_prior": True,
+        }
+
+    def model_directory(self):
+        """
+        Getter
+        :return: the directory caching the generative model of the current environment configuration, or None if the
+            data directory is unknown
+        """
+        if AnalysisConfig.instance is None:
+            return None
+        env = self.env.unwrapped
+        model_name = f"MiniSprites-{env.width}x{env.height}-{self.n_actions}"
+        return AnalysisConfig.instance.models_directory + f"BTAI_3MF/{model_name}/"
 
     def step(self, obs, steps_done):
         """
@@ -154,6 +261,15 @@ class BTAI_3MF(AgentInterface):
         self.ts.reset()
         obs = self.pre_process(obs)
         self.ts.i_step(obs, self.inference_type)
+
+        # Plan using a tree stored in arrays, if requested by the user
+        if self.mcts_tree == "Arrays":
+            child = self.mcts.plan(self.ts, self.max_planning_steps)
+            self.ts.states_posterior = self.mcts.get_states_posterior(child)
+            self.ts.use_posteriors_as_empirical_priors()
+            return int(self.mcts.actions[child])
+
+        # Otherwise, plan using a tree of temporal slices
         for i in range(0, self.max_planning_steps):
             node = self.mcts.select_node(self.ts)
             e_nodes = self.mcts.expansion(node)
@@ -166,22 +282,28 @@ class BTAI_3MF(AgentInterface):
 
     def pre_process(self, obs):
         """
-        Pre-process observation to form a dictionary of variable name to evidence (one-hot) vector
-        :param obs: observation
+        Pre-process observation to form a dictionary mapping the group of pixels to the evidence (one-hot) vectors of
+        all the pixels, the pixels are ordered x-major
+        :param obs: observation, or a stack of observations
         :return: the dictionary
         """
-        # Do not pre-process the input data, if backpropagation will be used
-        if self.inference_type == InfAlgo.BACKPROPAGATION:
-            return obs
-
-        # Otherwise, pre-process the input data
-        res = {}
-        for y in range(obs.shape[0]):
-            for x in range(obs.shape[1]):
-                res[f"O_{x}_{y}"] = obs[y][x] / 255
-                if obs[y][x].max() == 0:
-                    res[f"O_{x}_{y}"][2] = 1
-        return res
+        # The structured observations of the environment are already the evidence of the pixels
+        if self.env.unwrapped.structured_observations:
+            return {"O_pixels": torch.as_tensor(obs, dtype=torch.float32)}
+
+        # Otherwise, the images are converted into evidence, where the empty pixels are observed as empty
+        evidence = torch.as_tensor(obs, dtype=torch.float32).transpose(-3, -2) / 255
+        evidence = evidence.reshape(*evidence.shape[:-3], -1, 3)
+        evidence[..., 2][evidence.amax(dim=-1) == 0] = 1
+        return {"O_pixels": evidence}
+
+    def pre_process_batch(self, observations):
+        """
+        Pre-process a sequence of observations, the first dimension of the evidence indexes the observations
+        :param observations: the observations
+        :return: the dictionary
+        """
+        return self.pre_process(numpy.stack(observations))
 
     def save(self, directory, steps_done, env):
         """
@@ -201,56 +323,81 @@ class BTAI_3MF(AgentInterface):
             policy_file = image_directory + f"real-obs-{i}.png"
             Image.fromarray(obs.astype(numpy.uint8)).save(policy_file)
 
-        # Save reconstructed images
-        for i, obs in enumerate(observations):
+        # Save reconstructed images, all the frames are reconstructed at once (the observations are saved as images,
+        # even if the environment produces structured observations)
+        reconstructed_observations = self.create_reconstructed_images(observations)
+        for i, (obs, reconstructed_obs) in enumerate(zip(real_observations, reconstructed_observations)):
             policy_file = image_directory + f"obs-{i}.png"
             Image.fromarray(obs.astype(numpy.uint8)).save(policy_file)
-            obs = self.create_reconstructed_image(obs)
             policy_file = image_directory + f"reconstructed-obs-{i}.png"
-            Image.fromarray(obs.astype(numpy.uint8)).save(policy_file)
-
-        # Create directories and files if they do not exist.
-        checkpoint_file = directory + f"/checkpoint-{steps_done}.pt"
-        self.create_dir_and_file(checkpoint_file)
+            Image.fromarray(reconstructed_obs.astype(numpy.uint8)).save(policy_file)
 
-        # Save the model.
-        torch.save({
+        # Save the model, only the tensors that changed since the previous checkpoints are written.
+        checkpoint_file = directory + f"/checkpoint-{steps_done}.json"
+        checkpoint = {}
+        if self.dirichlet_learning is not None:
+            checkpoint["mappings_state_dict"], checkpoint["dirichlet_counts_state_dict"] = \
+                self.dirichlet_learning.state_dicts()
+        store = CheckpointStore(directory)
+        store.save(checkpoint_file, {
+            **checkpoint,
             "agent_module": str(self.__module__),
             "agent_class": str(self.__class__.__name__),
+            "agent_json": self.agent_json,
             "max_planning_steps": self.max_planning_steps,
             "exp_const": self.exp_const,
+            "mcts_tree": self.mcts_tree,
+            "reuse_subtree": self.reuse_subtree,
+            "reuse_tolerance": self.reuse_tolerance,
+            "n_parallel_leaves": self.n_parallel_leaves,
+            "batch_size": self.batch_size,
+            "vfe_lr": self.vfe_lr,
+            "learn_mappings": self.learn_mappings,
+            "dirichlet_concentration": self.dirichlet_concentration,
+            "flush_interval": self.flush_interval,
+            "structured_noise": self.structured_noise,
+            "transposition_table_size": self.transposition_table_size,
+            "transposition_table_precision": self.transposition_table_precision,
+            "inference_type": self.inference_name,
+            "lbp_tolerance": self.lbp_tolerance,
+            "lbp_damping": self.lbp_damping,
+            "lbp_max_iterations": self.lbp_max_iterations,
             "n_actions": self.n_actions,
-        }, checkpoint_file)
+            "encoder_net_state_dict": self.encoder.state_dict(),
+            "encoder_net_module": str(self.encoder.__module__),
+            "encoder_net_class": str(self.encoder.__class__.__name__),
+        })
+
+        # Remove the tensors that are no longer used by any checkpoint, e.g., the tensors of a replaced checkpoint.
+        store.collect_garbage()
 
     def create_reconstructed_image(self, obs):
         """
-        Create the reconstructed image:
-         - perform I-step to get (states) posterior using input image
-         - perform P-step to get (observations) posterior using (states) posterior
-         - the observation with the highest probability to create the reconstructed image
+        Create the reconstructed image
         :param obs: the (input) image
         :return: the reconstructed image
         """
-        # Compute the posterior distribution over latent state using available observations
-        res = numpy.zeros_like(obs)
-        self.ts.reset()
-        obs = self.pre_process(obs)
-        self.ts.i_step(obs, self.inference_type)
+        return self.create_reconstructed_images([obs])[0]
 
-        # Predict observation from posterior distribution over latent states
-        for obs_name in self.ts.obs_posterior.keys():
-            self.ts.obs_posterior[obs_name] = self.ts.forward_prediction(
-                self.ts.obs_likelihood[obs_name], 0,
-                self.ts.obs_parents[obs_name], self.ts.states_posterior
-            )
-
-        # Reconstruct image from posterior distribution over observations
-        for y in range(res.shape[0]):
-            for x in range(res.shape[1]):
-                max_obs = self.ts.obs_posterior[f"O_{x}_{y}"].argmax()
-                if max_obs <= 1:
-                    res[y][x][max_obs] = 255
+    def create_reconstructed_images(self, observations):
+        """
+        Create the reconstructed images of a sequence of observations:
+         - perform a batched I-step to get (states) posteriors using all the input observations
+         - perform a batched P-step to get (observations) posteriors using (states) posteriors
+         - the observations with the highest probability to create the reconstructed images
+        :param observations: the (input) observations
+        :return: the reconstructed images, the first dimension indexes the images
+        """
+        # Compute the posterior distributions over latent states and observations, for all images at once
+        env = self.env.unwrapped
+        self.ts.reset()
+        obs = self.pre_process_batch(observations)
+        _, _, obs_group_posterior = self.ts.i_step_batch(obs, self.inference_type)
 
+        # Reconstruct images from the posterior distributions over observations, the pixels are ordered x-major
+        max_obs = obs_group_posterior["O_pixels"].argmax(dim=2).view(-1, env.width, env.height).transpose(1, 2)
+        res = numpy.zeros([len(observations), env.height, env.width, 3])
+        res[..., 0:2] = one_hot(max_obs, 3)[..., 0:2].numpy() * 255
         return res
 
     def learn(self, logging_file, buffer, steps_done):
@@ -260,11 +407,37 @@ class BTAI_3MF(AgentInterface):
         :param buffer: the replay buffer
         :param steps_done: the number of training steps done
         """
+        # Accumulate a batch of experiences to learn the likelihood and transition mappings, if requested by the user.
+        if self.dirichlet_learning is not None:
+            obs, actions, _, done, next_obs = buffer.sample(self.batch_size)
+            obs, next_obs = self.pre_process(obs), self.pre_process(next_obs)
+            if self.dirichlet_learning.accumulate(obs, actions, done, next_obs):
+                # Only remove the planning results that depend on the updated columns of the mappings.
+                self.mcts.invalidate(self.dirichlet_learning.affects, self.ts.model_version())
+
+        # Train the encoder used by the I-step on a mini-batch of the observations made while acting, the replay
+        # buffer is not used because the encoder learns from the pre-processed observations.
+        if self.inference_type != InfAlgo.BACKPROPAGATION:
+            return
+        vfe = self.ts.amortized_inference.train(self.ts)
+
         # Display debug information, if needed.
-        # TODO if steps_done % 10 == 0:
-        # TODO     logging_file.write(str(vfe_loss.item()))
-        # TODO     logging_file.flush()
-        pass  # This agent does not learn from data
+        if vfe is not None and steps_done % 10 == 0:
+            logging_file.write(str(vfe.item()))
+            logging_file.flush()
+
+    def load_checkpoint(self, store, checkpoint):
+        """
+        Restore the learned likelihood and transition mappings, and their Dirichlet counts
+        :param store: the store containing the tensors of the checkpoint
+        :param checkpoint: the description of the checkpoint
+        """
+        if self.dirichlet_learning is None or "mappings_state_dict" not in checkpoint.keys():
+            return
+        self.dirichlet_learning.load_state_dicts(
+            store.load_tensors(checkpoint, "mappings_state_dict"),
+            store.load_tensors(checkpoint, "dirichlet_counts_state_dict")
+        )
 
     def is_model_based(self):
         """
@@ -6,8 +6,10 @@ import agents.math.functions as math_fc
 import torch
 from torch import unsqueeze, nn
 from agents.AgentInterface import AgentInterface
-from agents.learning import Optimizers
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from agents.learning import Optimizers, GradientAccumulation, Distributed
 from agents.networks.NetworkFactory import NetworkFactory
+from agents.planning.CEM import CEM
 from agents.strategies.StrategyFactory import StrategyFactory
 from hosts.HostInterface import HostInterface
 
@@ -26,11 +28,18 @@ class CHMM(AgentInterface):
         :param kwargs: the remaining (keyword) parameters
         """
         super().__init__("CHMM")
+        self.json_agent = json_agent
         self.n_states = int(json_agent["n_states"])
         self.beta = float(json_agent["beta"])
         self.vfe_lr = float(json_agent["vfe_lr"])
         self.critic_lr = float(json_agent["critic_lr"])
         self.queue_capacity = int(json_agent["queue_capacity"])
+        self.batch_size = int(json_agent.get("batch_size", 32))
+        self.micro_batch_size = int(json_agent.get("micro_batch_size", self.batch_size))
+        self.lr_scaling = json_agent.get("lr_scaling", "None")
+        self.n_threads = int(json_agent.get("n_threads", 0))
+        self.n_interop_threads = int(json_agent.get("n_interop_threads", 0))
+        HostInterface.set_n_threads(self.n_threads, self.n_interop_threads)
         self.n_actions = n_actions
         self.discount_factor = float(json_agent["discount_factor"])
         self.n_steps_between_synchro = int(json_agent["n_steps_between_synchro"])
@@ -54,9 +63,30 @@ class CHMM(AgentInterface):
         self.target = deepcopy(self.critic)
         self.target.eval()
         self.strategy = StrategyFactory.create(json_agent["strategy"])
-        HostInterface.to_device([self.encoder, self.decoder, self.transition])
-        self.vfe_optimizer = Optimizers.get_adam([self.encoder, self.decoder, self.transition], self.vfe_lr)
-        self.efe_optimizer = Optimizers.get_adam([self.critic], self.critic_lr)
+        self.planning = json_agent.get("planning", "None")
+        self.planning_horizon = int(json_agent.get("planning_horizon", 5))
+        self.n_candidates = int(json_agent.get("n_candidates", 256))
+        self.n_elites = int(json_agent.get("n_elites", 32))
+        self.n_planning_iterations = int(json_agent.get("n_planning_iterations", 3))
+        self.planner = None if self.planning != "CEM" else CEM(
+            self.n_actions, self.planning_horizon, self.n_candidates, self.n_elites,
+            self.n_planning_iterations, self.discount_factor, self.g_value
+        )
+
+        # The reward network predicts the reward of each action, it is only required to score the planned rollouts.
+        self.reward = None if self.planner is None else NetworkFactory.create(
+            json_agent.get("reward", json_agent["critic"]) | {
+                "n_states": self.n_states,
+                "n_actions": self.n_actions
+            }
+        )
+        self.model = [self.encoder, self.decoder, self.transition] + ([] if self.reward is None else [self.reward])
+        HostInterface.to_device(self.model + [self.critic, self.target], self.device)
+        global_batch_size = self.batch_size * Distributed.world_size()
+        vfe_lr = Optimizers.scale_lr(self.vfe_lr, global_batch_size, self.lr_scaling)
+        critic_lr = Optimizers.scale_lr(self.critic_lr, global_batch_size, self.lr_scaling)
+        self.vfe_optimizer = Optimizers.get_adam(self.model, vfe_lr)
+        self.efe_optimizer = Optimizers.get_adam([self.critic], critic_lr)
 
     def step(self, obs, steps_done):
         """
@@ -66,11 +96,16 @@ class CHMM(AgentInterface):
         :return: the action to take
         """
         # Extract the current state from the current observation.
-        obs = torch.unsqueeze(obs, dim=0)
-        state, _ = self.encoder(obs)
+        obs = torch.unsqueeze(obs, dim=0).to(self.device)
+        state, log_var = self.encoder(obs)
+
+        # Select an action using the critic only, if planning is disabled.
+        if self.planner is None:
+            return self.strategy.select(self.critic(state)[:, :self.n_actions], steps_done)
 
-        # Select an action.
-        return self.strategy.select(self.critic(state)[:, :self.n_actions], steps_done)
+        # Otherwise, select an action by planning in the latent space.
+        quality = self.planner.plan(state, log_var, self.encoder, self.decoder, self.transition, self.reward, self.critic)
+        return self.strategy.select(quality, steps_done)
 
     def save(self, directory, steps_done, env):
         """
@@ -91,23 +126,21 @@ class CHMM(AgentInterface):
             Image.fromarray(obs).save(policy_file)
 
         # Save reconstructed images
-        for i, obs in enumerate(observations):
+        reconstructed_observations = self.reconstruct(torch.stack(observations))
+        for i, (obs, reconstructed_obs) in enumerate(zip(observations, reconstructed_observations)):
             policy_file = image_directory + f"obs-{i}.png"
             save_image(obs, policy_file)
-            mean, log_var = self.encoder(obs.unsqueeze(axis=0))
-            obs = self.decoder(math_fc.re_parameterize(mean, log_var))
             policy_file = image_directory + f"reconstructed-obs-{i}.png"
-            save_image(obs, policy_file)
+            save_image(reconstructed_obs, policy_file)
             # TODO sequence of actions
 
-        # Create directories and files if they do not exist.
-        checkpoint_file = directory + f"/checkpoint-{steps_done}.pt"
-        self.create_dir_and_file(checkpoint_file)
-
-        # Save the model.
-        torch.save({
+        # Save the model, only the tensors that changed since the previous checkpoints are written.
+        checkpoint_file = directory + f"/checkpoint-{steps_done}.json"
+        store = CheckpointStore(directory)
+        store.save(checkpoint_file, {
             "agent_module": str(self.__module__),
             "agent_class": str(self.__class__.__name__),
+            "agent_json": self.json_agent,
             "images_shape": self.image_shape,
             "n_states": self.n_states,
             "n_actions": self.n_actions,
@@ -123,6 +156,14 @@ class CHMM(AgentInterface):
             "critic_net_state_dict": self.critic.state_dict(),
             "critic_net_module": str(self.critic.__module__),
             "critic_net_class": str(self.critic.__class__.__name__),
+            "target_net_state_dict": self.target.state_dict(),
+            "target_net_module": str(self.target.__module__),
+            "target_net_class": str(self.target.__class__.__name__),
+            **({} if self.reward is None else {
+                "reward_net_state_dict": self.reward.state_dict(),
+                "reward_net_module": str(self.reward.__module__),
+                "reward_net_class": str(self.reward.__class__.__name__),
+            }),
             "beta": self.beta,
             "g_value": self.g_value,
             "vfe_lr": self.vfe_lr,
@@ -131,7 +172,28 @@ class CHMM(AgentInterface):
             "queue_capacity": self.queue_capacity,
             "n_steps_between_synchro": self.n_steps_between_synchro,
             "action_selection": dict(self.strategy),
-        }, checkpoint_file)
+            "batch_size": self.batch_size,
+            "micro_batch_size": self.micro_batch_size,
+            "lr_scaling": self.lr_scaling,
+            "planning": self.planning,
+            "planning_horizon": self.planning_horizon,
+            "n_candidates": self.n_candidates,
+            "n_elites": self.n_elites,
+            "n_planning_iterations": self.n_planning_iterations,
+        })
+
+        # Remove the tensors that are no longer used by any checkpoint, e.g., the tensors of a replaced checkpoint.
+        store.collect_garbage()
+
+    def reconstruct(self, obs):
+        """
+        Reconstruct a batch of observations
+        :param obs: the observations to reconstruct
+        :return: the reconstructed observations
+        """
+        with torch.no_grad():
+            mean, log_var = self.encoder(obs)
+            return self.decoder(math_fc.re_parameterize(mean, log_var))
 
     def learn(self, logging_file, buffer, steps_done):
         """
@@ -146,24 +208,39 @@ class CHMM(AgentInterface):
             self.target.eval()
 
         # Sample the replay buffer.
-        obs, actions, rewards, done, next_obs = buffer.sample()
-
-        # Compute the expected free energy loss.
-        efe_loss = self.compute_efe_loss(obs, actions, next_obs, done, rewards)
+        batch = buffer.sample(self.batch_size)
 
-        # Perform one step of gradient descent on the critic network.
+        # Accumulate the gradients of the expected free energy loss over the micro-batches.
         self.efe_optimizer.zero_grad()
-        efe_loss.backward()
-        self.efe_optimizer.step()
+        for (obs, actions, rewards, done, next_obs), weight in \
+                GradientAccumulation.micro_batches(batch, self.micro_batch_size):
+            efe_loss = weight * self.compute_efe_loss(obs, actions, next_obs, done, rewards)
+            efe_loss.backward()
 
-        # Compute the variational free energy.
-        vfe_loss = self.compute_vfe(logging_file, obs, actions, next_obs, steps_done)
+        # Average the gradients across processes, and perform one step of gradient descent on the critic network.
+        Distributed.all_reduce_gradients([self.critic])
+        self.efe_optimizer.step()
 
-        # Perform one step of gradient descent on the other networks.
+        # Accumulate the gradients of the variational free energy over the micro-batches.
         self.vfe_optimizer.zero_grad()
-        vfe_loss.backward()
+        vfe = 0
+        for (obs, actions, rewards, _, next_obs), weight in \
+                GradientAccumulation.micro_batches(batch, self.micro_batch_size):
+            vfe_loss = weight * self.compute_vfe(obs, actions, next_obs)
+            vfe += vfe_loss.detach()
+            if self.reward is not None:
+                vfe_loss = vfe_loss + weight * self.compute_reward_loss(obs, actions, rewards)
+            vfe_loss.backward()
+
+        # Average the gradients across processes, and perform one step of gradient descent on the other networks.
+        Distributed.all_reduce_gradients(self.model)
         self.vfe_optimizer.step()
 
+        # Display debug information, if needed.
+        if steps_done % 10 == 0:
+            logging_file.write(str(vfe.item()))
+            logging_file.flush()
+
     def compute_efe_loss(self, obs, actions, next_obs, done, rewards):
         """
         Compute the expected free energy loss
@@ -184,11 +261,11 @@ class CHMM(AgentInterface):
         critic_prediction = critic_prediction.gather(dim=1, index=unsqueeze(actions.to(torch.int64), dim=1))
 
         # For each batch entry where the simulation did not stop, compute the value of the next states.
-        future_g_value = torch.zeros(critic_prediction.shape[0], device=HostInterface.get_device())
+        future_g_value = torch.zeros(critic_prediction.shape[0], device=self.device)
         future_g_value[torch.logical_not(done)] = self.target(mean_hat[torch.logical_not(done)]).max(1)[0]
 
         # Compute the immediate G-value.
-        immediate_g_value = rewards
+        immediate_g_value = rewards.clone()
 
         # Add information gain to the immediate g-value (if needed).
         immediate_g_value -= math_fc.compute_info_gain(self.g_value, mean_hat, log_var_hat, mean, log_var)
@@ -203,14 +280,12 @@ class CHMM(AgentInterface):
         loss = loss(critic_prediction, g_value.unsqueeze(dim=1))
         return loss
 
-    def compute_vfe(self, logging_file, obs, actions, next_obs, steps_done):
+    def compute_vfe(self, obs, actions, next_obs):
         """
         Compute the variational free energy
-        :param logging_file: the file in which metrics should be saved
         :param obs: the observations at time t
         :param actions: the actions at time t
         :param next_obs: the observations at time t + 1
-        :param steps_done: the number of training steps done
         :return: the variational free energy
         """
         # Compute required vectors.
@@ -224,13 +299,24 @@ class CHMM(AgentInterface):
         # Compute the variational free energy.
         kl_div_hs = math_fc.kl_div_gaussian(mean_hat, log_var_hat, mean, log_var)
         log_likelihood = math_fc.log_bernoulli_with_logits(next_obs, alpha)
-        vfe_loss = self.beta * kl_div_hs - log_likelihood
+        return self.beta * kl_div_hs - log_likelihood
 
-        # Display debug information, if needed.
-        if steps_done % 10 == 0:
-            logging_file.write(str(vfe_loss.item()))
-            logging_file.flush()
-        return vfe_loss
+    def compute_reward_loss(self, obs, actions, rewards):
+        """
+        Compute the loss of the reward network
+        :param obs: the observations at time t
+        :param actions: the actions at time t
+        :param rewards: the rewards at time t + 1
+        :return: the loss of the reward network
+        """
+        # Predict the reward of the actions performed in the states inferred from the observations.
+        states, _ = self.encoder(obs)
+        reward_prediction = self.reward(states.detach())
+        reward_prediction = reward_prediction.gather(dim=1, index=unsqueeze(actions.to(torch.int64), dim=1))
+
+        # Compute the loss function.
+        loss = nn.SmoothL1Loss()
+        return loss(reward_prediction, rewards.to(torch.float32).unsqueeze(dim=1))
 
     def is_model_based(self):
         """
@@ -4,7 +4,8 @@ from copy import deepcopy
 import torch
 from torch import unsqueeze, nn
 from agents.AgentInterface import AgentInterface
-from agents.learning import Optimizers
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from agents.learning import Optimizers, Distributed
 from agents.networks.NetworkFactory import NetworkFactory
 from agents.strategies.StrategyFactory import StrategyFactory
 from hosts.HostInterface import HostInterface
@@ -24,6 +25,7 @@ class DQN(AgentInterface):
         :param kwargs: the remaining (keyword) parameters
         """
         super().__init__("DQN")
+        self.json_agent = json_agent
         self.n_actions = n_actions
         self.queue_capacity = int(json_agent["queue_capacity"])
         self.n_steps_between_synchro = int(json_agent["n_steps_between_synchro"])
@@ -36,7 +38,7 @@ class DQN(AgentInterface):
         self.target = deepcopy(self.policy)
         self.target.eval()
         self.strategy = StrategyFactory.create(json_agent["strategy"])
-        HostInterface.to_device([self.policy])
+        HostInterface.to_device([self.policy, self.target], self.device)
         self.optimizer = Optimizers.get_adam([self.policy], self.q_network_lr)
 
     def step(self, obs, steps_done):
@@ -47,7 +49,7 @@ class DQN(AgentInterface):
         :return: the action to take
         """
         # Create a 4D tensor from a 3D tensor by adding a dimension of size one.
-        obs = torch.unsqueeze(obs, dim=0)
+        obs = torch.unsqueeze(obs, dim=0).to(self.device)
 
         # Select an action to perform in the environment.
         return self.strategy.select(self.policy(obs), steps_done)
@@ -70,26 +72,31 @@ class DQN(AgentInterface):
             policy_file = image_directory + f"real-obs-{i}.png"
             Image.fromarray(obs).save(policy_file)
 
-        # Create directories and files if they do not exist.
-        checkpoint_file = directory + f"/checkpoint-{steps_done}.pt"
-        self.create_dir_and_file(checkpoint_file)
-
-        # Save the model.
-        torch.save({
+        # Save the model, only the tensors that changed since the previous checkpoints are written.
+        checkpoint_file = directory + f"/checkpoint-{steps_done}.json"
+        store = CheckpointStore(directory)
+        store.save(checkpoint_file, {
             "agent_module": str(self.__module__),
             "agent_class": str(self.__class__.__name__),
+            "agent_json": self.json_agent,
             "images_shape": self.image_shape,
             "n_actions": self.n_actions,
             "policy_net_state_dict": self.policy.state_dict(),
             "policy_net_module": str(self.policy.__module__),
             "policy_net_class": str(self.policy.__class__.__name__),
+            "target_net_state_dict": self.target.state_dict(),
+            "target_net_module": str(self.target.__module__),
+            "target_net_class": str(self.target.__class__.__name__),
             "steps_done": steps_done,
             "lr": self.q_network_lr,
             "queue_capacity": self.queue_capacity,
             "discount_factor": self.discount_factor,
             "n_steps_between_synchro": self.n_steps_between_synchro,
             "action_selection": dict(self.strategy)
-        }, checkpoint_file)
+        })
+
+        # Remove the tensors that are no longer used by any checkpoint, e.g., the tensors of a replaced checkpoint.
+        store.collect_garbage()
 
     def learn(self, logging_file, buffer, steps_done):
         """
@@ -109,9 +116,10 @@ class DQN(AgentInterface):
         # Compute the policy network's loss function.
         loss = self.compute_loss(logging_file, obs, actions, rewards, done, next_obs, steps_done)
 
-        # Perform one step of gradient descent on the other networks.
+        # Average the gradients across processes, and perform one step of gradient descent on the other networks.
         self.optimizer.zero_grad()
         loss.backward()
+        Distributed.all_reduce_gradients([self.policy])
         self.optimizer.step()
 
     def compute_loss(self, logging_file, obs, actions, rewards, done, next_obs, steps_done):
@@ -131,7 +139,7 @@ class DQN(AgentInterface):
 
         # For each batch entry where the simulation did not stop, compute the value of the next states, i.e. V(s_{t+1}).
         # Those values are computed using the target network.
-        future_values = torch.zeros(policy_prediction.shape[0]).to(HostInterface.get_device())
+        future_values = torch.zeros(policy_prediction.shape[0]).to(self.device)
         future_values[torch.logical_not(done)] = self.target(next_obs[torch.logical_not(done)]).max(1)[0]
         future_values = future_values.detach()
 
@@ -4,7 +4,8 @@ import os
 import agents.math.functions as math_fc
 import torch
 from agents.AgentInterface import AgentInterface
-from agents.learning import Optimizers
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from agents.learning import Optimizers, GradientAccumulation, Distributed
 from agents.networks.NetworkFactory import NetworkFactory
 from agents.strategies.StrategyFactory import StrategyFactory
 from hosts.HostInterface import HostInterface
@@ -24,10 +25,17 @@ class HMM(AgentInterface):
         :param kwargs: the remaining (keyword) parameters
         """
         super().__init__("HMM")
+        self.json_agent = json_agent
         self.n_states = int(json_agent["n_states"])
         self.beta = float(json_agent["beta"])
         self.vfe_lr = float(json_agent["vfe_lr"])
         self.queue_capacity = int(json_agent["queue_capacity"])
+        self.batch_size = int(json_agent.get("batch_size", 32))
+        self.micro_batch_size = int(json_agent.get("micro_batch_size", self.batch_size))
+        self.lr_scaling = json_agent.get("lr_scaling", "None")
+        self.n_threads = int(json_agent.get("n_threads", 0))
+        self.n_interop_threads = int(json_agent.get("n_interop_threads", 0))
+        HostInterface.set_n_threads(self.n_threads, self.n_interop_threads)
         self.n_actions = n_actions
         self.encoder = NetworkFactory.create(json_agent["encoder"] | {
             "n_states": self.n_states,
@@ -42,8 +50,10 @@ class HMM(AgentInterface):
             "n_actions": self.n_actions
         })
         self.strategy = StrategyFactory.create(json_agent["strategy"])
-        HostInterface.to_device([self.encoder, self.decoder, self.transition])
-        self.optimizer = Optimizers.get_adam([self.encoder, self.decoder, self.transition], self.vfe_lr)
+        HostInterface.to_device([self.encoder, self.decoder, self.transition], self.device)
+        global_batch_size = self.batch_size * Distributed.world_size()
+        vfe_lr = Optimizers.scale_lr(self.vfe_lr, global_batch_size, self.lr_scaling)
+        self.optimizer = Optimizers.get_adam([self.encoder, self.decoder, self.transition], vfe_lr)
 
     def step(self, obs, steps_done):
         """
@@ -52,7 +62,7 @@ class HMM(AgentInterface):
         :param steps_done: the number of training steps done
         :return: the action to take
         """
-        quality = torch.zeros([1, self.n_actions]).to(HostInterface.get_device())
+        quality = torch.zeros([1, self.n_actions]).to(self.device)
         return self.strategy.select(quality, steps_done)
 
     def save(self, directory, steps_done, env):
@@ -74,23 +84,21 @@ class HMM(AgentInterface):
             Image.fromarray(obs).save(policy_file)
 
         # Save reconstructed images
-        for i, obs in enumerate(observations):
+        reconstructed_observations = self.reconstruct(torch.stack(observations))
+        for i, (obs, reconstructed_obs) in enumerate(zip(observations, reconstructed_observations)):
             policy_file = image_directory + f"obs-{i}.png"
             save_image(obs, policy_file)
-            mean, log_var = self.encoder(obs.unsqueeze(axis=0))
-            obs = self.decoder(math_fc.re_parameterize(mean, log_var))
             policy_file = image_directory + f"reconstructed-obs-{i}.png"
-            save_image(obs, policy_file)
+            save_image(reconstructed_obs, policy_file)
             # TODO sequence of actions
 
-        # Create directories and files if they do not exist.
-        checkpoint_file = directory + f"/checkpoint-{steps_done}.pt"
-        self.create_dir_and_file(checkpoint_file)
-
-        # Save the model.
-        torch.save({
+        # Save the model, only the tensors that changed since the previous checkpoints are written.
+        checkpoint_file = directory + f"/checkpoint-{steps_done}.json"
+        store = CheckpointStore(directory)
+        store.save(checkpoint_file, {
             "agent_module": str(self.__module__),
             "agent_class": str(self.__class__.__name__),
+            "agent_json": self.json_agent,
             "images_shape": self.image_shape,
             "n_states": self.n_states,
             "n_actions": self.n_actions,
@@ -107,7 +115,23 @@ class HMM(AgentInterface):
             "lr": self.vfe_lr,
             "beta": self.beta,
             "queue_capacity": self.queue_capacity,
-        }, checkpoint_file)
+            "batch_size": self.batch_size,
+            "micro_batch_size": self.micro_batch_size,
+            "lr_scaling": self.lr_scaling,
+        })
+
+        # Remove the tensors that are no longer used by any checkpoint, e.g., the tensors of a replaced checkpoint.
+        store.collect_garbage()
+
+    def reconstruct(self, obs):
+        """
+        Reconstruct a batch of observations
+        :param obs: the observations to reconstruct
+        :return: the reconstructed observations
+        """
+        with torch.no_grad():
+            mean, log_var = self.encoder(obs)
+            return self.decoder(math_fc.re_parameterize(mean, log_var))
 
     def learn(self, logging_file, buffer, steps_done):
         """
@@ -117,24 +141,32 @@ class HMM(AgentInterface):
         :param steps_done: the number of training steps done
         """
         # Sample the replay buffer.
-        obs, action, _, _, next_obs = buffer.sample()
+        obs, actions, _, _, next_obs = buffer.sample(self.batch_size)
 
-        # Compute the variational free energy.
-        vfe_loss = self.compute_vfe(logging_file, obs, action, next_obs, steps_done)
-
-        # Perform one step of gradient descent on the other networks.
+        # Accumulate the gradients of the variational free energy over the micro-batches.
         self.optimizer.zero_grad()
-        vfe_loss.backward()
+        vfe = 0
+        batch = [obs, actions, next_obs]
+        for (obs, actions, next_obs), weight in GradientAccumulation.micro_batches(batch, self.micro_batch_size):
+            vfe_loss = weight * self.compute_vfe(obs, actions, next_obs)
+            vfe_loss.backward()
+            vfe += vfe_loss.detach()
+
+        # Average the gradients across processes, and perform one step of gradient descent on the other networks.
+        Distributed.all_reduce_gradients([self.encoder, self.decoder, self.transition])
         self.optimizer.step()
 
-    def compute_vfe(self, logging_file, obs, actions, next_obs, steps_done):
+        # Display debug information, if needed.
+        if steps_done % 10 == 0:
+            logging_file.write(str(vfe.item()))
+            logging_file.flush()
+
+    def compute_vfe(self, obs, actions, next_obs):
         """
         Compute the variational free energy
-        :param logging_file: the file in which metrics should be saved
         :param obs: the observations at time t
         :param actions: the actions at time t
         :param next_obs: the observations at time t + 1
-        :param steps_done: the number of training steps done
         :return: the variational free energy
         """
         # Compute required vectors.
@@ -148,13 +180,7 @@ class HMM(AgentInterface):
         # Compute the variational free energy.
         kl_div_hs = math_fc.kl_div_gaussian(mean, log_var, mean_hat, log_var_hat)
         log_likelihood = math_fc.log_bernoulli_with_logits(next_obs, alpha)
-        vfe_loss = self.beta * kl_div_hs - log_likelihood
-
-        # Display debug information, if needed.
-        if steps_done % 10 == 0:
-            logging_file.write(str(vfe_loss.item()))
-            logging_file.flush()
-        return vfe_loss
+        return self.beta * kl_div_hs - log_likelihood
 
     def is_model_based(self):
         """
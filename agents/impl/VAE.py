@@ -4,7 +4,8 @@ import os
 import torch
 from torch import zeros_like
 from agents.AgentInterface import AgentInterface
-from agents.learning import Optimizers
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from agents.learning import Optimizers, GradientAccumulation, Distributed
 from agents.networks.NetworkFactory import NetworkFactory
 from agents.strategies.StrategyFactory import StrategyFactory
 import agents.math.functions as math_fc
@@ -25,6 +26,7 @@ class VAE(AgentInterface):
         :param kwargs: the remaining (keyword) parameters
         """
         super().__init__("VAE")
+        self.json_agent = json_agent
         self.n_states = int(json_agent["n_states"])
         self.encoder = NetworkFactory.create(json_agent["encoder"] | {
             "n_states": self.n_states,
@@ -38,8 +40,16 @@ class VAE(AgentInterface):
         self.queue_capacity = int(json_agent["queue_capacity"])
         self.beta = float(json_agent["beta"])
         self.vfe_lr = float(json_agent["vfe_lr"])
-        HostInterface.to_device([self.encoder, self.decoder])
-        self.optimizer = Optimizers.get_adam([self.encoder, self.decoder], self.vfe_lr)
+        self.batch_size = int(json_agent.get("batch_size", 32))
+        self.micro_batch_size = int(json_agent.get("micro_batch_size", self.batch_size))
+        self.lr_scaling = json_agent.get("lr_scaling", "None")
+        self.n_threads = int(json_agent.get("n_threads", 0))
+        self.n_interop_threads = int(json_agent.get("n_interop_threads", 0))
+        HostInterface.set_n_threads(self.n_threads, self.n_interop_threads)
+        HostInterface.to_device([self.encoder, self.decoder], self.device)
+        global_batch_size = self.batch_size * Distributed.world_size()
+        vfe_lr = Optimizers.scale_lr(self.vfe_lr, global_batch_size, self.lr_scaling)
+        self.optimizer = Optimizers.get_adam([self.encoder, self.decoder], vfe_lr)
         self.n_actions = n_actions
 
     def step(self, obs, steps_done):
@@ -49,7 +59,7 @@ class VAE(AgentInterface):
         :param steps_done: the number of training steps done
         :return: the action to take
         """
-        quality = torch.zeros([1, self.n_actions]).to(HostInterface.get_device())
+        quality = torch.zeros([1, self.n_actions]).to(self.device)
         return self.strategy.select(quality, steps_done)
 
     def save(self, directory, steps_done, env):
@@ -71,24 +81,23 @@ class VAE(AgentInterface):
             Image.fromarray(obs).save(policy_file)
 
         # Save reconstructed images
-        for i, obs in enumerate(observations):
+        reconstructed_observations = self.reconstruct(torch.stack(observations))
+        for i, (obs, reconstructed_obs) in enumerate(zip(observations, reconstructed_observations)):
             policy_file = image_directory + f"obs-{i}.png"
             save_image(obs, policy_file)
-            mean, log_var = self.encoder(obs.unsqueeze(axis=0))
-            obs = self.decoder(math_fc.re_parameterize(mean, log_var))
             policy_file = image_directory + f"reconstructed-obs-{i}.png"
-            save_image(obs, policy_file)
-
-        # Create directories and files if they do not exist.
-        checkpoint_file = directory + f"/checkpoint-{steps_done}.pt"
-        self.create_dir_and_file(checkpoint_file)
+            save_image(reconstructed_obs, policy_file)
 
-        # Save the model.
-        torch.save({
+        # Save the model, only the tensors that changed since the previous checkpoints are written.
+        checkpoint_file = directory + f"/checkpoint-{steps_done}.json"
+        store = CheckpointStore(directory)
+        store.save(checkpoint_file, {
             "agent_module": str(self.__module__),
             "agent_class": str(self.__class__.__name__),
+            "agent_json": self.json_agent,
             "images_shape": self.image_shape,
             "n_states": self.n_states,
+            "n_actions": self.n_actions,
             "decoder_net_state_dict": self.decoder.state_dict(),
             "decoder_net_module": str(self.decoder.__module__),
             "decoder_net_class": str(self.decoder.__class__.__name__),
@@ -99,7 +108,23 @@ class VAE(AgentInterface):
             "lr": self.vfe_lr,
             "beta": self.beta,
             "queue_capacity": self.queue_capacity,
-        }, checkpoint_file)
+            "batch_size": self.batch_size,
+            "micro_batch_size": self.micro_batch_size,
+            "lr_scaling": self.lr_scaling,
+        })
+
+        # Remove the tensors that are no longer used by any checkpoint, e.g., the tensors of a replaced checkpoint.
+        store.collect_garbage()
+
+    def reconstruct(self, obs):
+        """
+        Reconstruct a batch of observations
+        :param obs: the observations to reconstruct
+        :return: the reconstructed observations
+        """
+        with torch.no_grad():
+            mean, log_var = self.encoder(obs)
+            return self.decoder(math_fc.re_parameterize(mean, log_var))
 
     def learn(self, logging_file, buffer, steps_done):
         """
@@ -109,22 +134,29 @@ class VAE(AgentInterface):
         :param steps_done: the number of training steps done
         """
         # Sample the replay buffer.
-        _, _, _, _, next_obs = buffer.sample()
+        _, _, _, _, next_obs = buffer.sample(self.batch_size)
 
-        # Compute the variational free energy.
-        vfe_loss = self.compute_vfe(logging_file, next_obs, steps_done)
-
-        # Perform one step of gradient descent on the other networks.
+        # Accumulate the gradients of the variational free energy over the micro-batches.
         self.optimizer.zero_grad()
-        vfe_loss.backward()
+        vfe = 0
+        for (next_obs,), weight in GradientAccumulation.micro_batches([next_obs], self.micro_batch_size):
+            vfe_loss = weight * self.compute_vfe(next_obs)
+            vfe_loss.backward()
+            vfe += vfe_loss.detach()
+
+        # Average the gradients across processes, and perform one step of gradient descent on the other networks.
+        Distributed.all_reduce_gradients([self.encoder, self.decoder])
         self.optimizer.step()
 
-    def compute_vfe(self, logging_file, next_obs, steps_done):
+        # Display debug information, if needed.
+        if steps_done % 10 == 0:
+            logging_file.write(str(vfe.item()))
+            logging_file.flush()
+
+    def compute_vfe(self, next_obs):
         """
         Compute the variational free energy
-        :param logging_file: the file in which metrics should be saved
         :param next_obs: the observations at time t + 1
-        :param steps_done: the number of training steps done
         :return: the variational free energy
         """
         # Compute required vectors.
@@ -137,13 +169,7 @@ class VAE(AgentInterface):
         # Compute the variational free energy.
         kl_div_hs = math_fc.kl_div_gaussian(mean_hat, log_var_hat, mean, log_var)
         log_likelihood = math_fc.log_bernoulli_with_logits(next_obs, alpha)
-        vfe_loss = self.beta * kl_div_hs - log_likelihood
-
-        # Display debug information, if needed.
-        if steps_done % 10 == 0:
-            logging_file.write(str(vfe_loss.item()))
-            logging_file.flush()
-        return vfe_loss
+        return self.beta * kl_div_hs - log_likelihood
 
     def is_model_based(self):
         """
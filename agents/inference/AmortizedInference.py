@@ -0,0 +1,163 @@
+import collections
+import random
+import torch
+from torch import nn
+from agents.inference.Contraction import Contraction
+from agents.learning import Distributed
+from agents.learning import Optimizers
+
+
+class AmortizedInference:
+    """
+    A class implementing amortized inference, i.e., an encoder network predicting the posterior beliefs over the
+    states from the evidence of the observations. At acting time, the I-step is a single forward pass of the encoder,
+    while the observations are stored in a buffer. The encoder is then trained in the background on mini-batches
+    sampled from the buffer, by minimising the variational free energy of the temporal slice.
+    """
+
+    def __init__(self, learning_rate=0.001, capacity=10000, batch_size=32, n_hidden=256):
+        """
+        Construct the amortized inference, the encoder is created by build or the first time it is used.
+        :param learning_rate: the learning rate of the encoder.
+        :param capacity: the number of observations the buffer can store.
+        :param batch_size: the size of the mini-batches used to train the encoder.
+        :param n_hidden: the number of neurons of each hidden layer of the encoder.
+        """
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.n_hidden = n_hidden
+        self.encoder = None
+        self.optimizer = None
+
+        # The buffer of observations, i.e., pairs (evidence, prior beliefs over the states).
+        self.buffer = collections.deque(maxlen=capacity)
+
+    def infer(self, ts, obs, learn=True):
+        """
+        Compute the posterior beliefs over the states with a single forward pass of the encoder.
+        :param ts: the temporal slice whose posteriors must be computed.
+        :param obs: a mapping from the name of an observation (or observation group) to its evidence, whose first
+            dimension may index a batch of observations.
+        :param learn: whether to store the observations in the buffer, so that the encoder learns from them.
+        """
+        # Compute the variational posteriors.
+        inputs = self.inputs(ts, obs)
+        with torch.no_grad():
+            log_posteriors = self.log_posteriors(ts, inputs)
+        batched = inputs.dim() == 2
+        for state_name, log_posterior in log_posteriors.items():
+            posterior = log_posterior.exp()
+            ts.states_posterior[state_name] = posterior if batched else posterior[0]
+
+        # Store the observations in the buffer, if needed.
+        if learn and not batched:
+            evidence = {name: torch.as_tensor(e, dtype=torch.float32) for name, e in obs.items()}
+            priors = {state_name: prior.detach().clone() for state_name, prior in ts.states_priors().items()}
+            self.buffer.append((evidence, priors))
+
+    def train(self, ts):
+        """
+        Perform one step of gradient descent on the variational free energy of a mini-batch of observations.
+        :param ts: the temporal slice providing the generative model.
+        :return: the variational free energy of the mini-batch, or None if the buffer does not contain enough data.
+        """
+        if len(self.buffer) < self.batch_size:
+            return None
+
+        # Sample a mini-batch of observations from the buffer.
+        batch = random.sample(self.buffer, self.batch_size)
+        obs = {name: torch.stack([evidence[name] for evidence, _ in batch]) for name in batch[0][0].keys()}
+        priors = {name: torch.stack([prior[name] for _, prior in batch]) for name in batch[0][1].keys()}
+        log_posteriors = self.log_posteriors(ts, self.inputs(ts, obs))
+        posteriors = {state_name: log_posterior.exp() for state_name, log_posterior in log_posteriors.items()}
+
+        # Compute the complexity, i.e., the KL-divergence between the posterior and prior beliefs over the states, the
+        # log-probabilities are used directly so that a saturated encoder does not produce 0 * log(0).
+        complexity = sum([
+            (posteriors[state_name] * (log_posterior - priors[state_name].clamp(min=1e-16).log())).sum(dim=1)
+            for state_name, log_posterior in log_posteriors.items()
+        ])
+
+        # Compute the accuracy, i.e., the expected log-likelihood of the observations.
+        accuracy = 0
+        for name, evidence in obs.items():
+            if name in ts.obs_groups.keys():
+                _, params, parents = ts.obs_groups[name]
+                operands = [(evidence, [0, 1])]
+                parents_dim = 2
+            else:
+                params, parents = ts.obs_likelihood[name], ts.obs_parents[name]
+                operands = [(evidence, [0])]
+                parents_dim = 1
+            operands += [(posteriors[parent], [i + parents_dim]) for i, parent in enumerate(parents)]
+            accuracy = accuracy + Contraction.contract_batch(params.clamp(min=1e-16).log(), operands)
+
+        # Perform one step of gradient descent on the variational free energy.
+        vfe = (complexity - accuracy).mean()
+        self.optimizer.zero_grad()
+        vfe.backward()
+        Distributed.all_reduce_gradients([self.encoder])
+        self.optimizer.step()
+        return vfe.detach()
+
+    def build(self, ts, n_inputs=None):
+        """
+        Create the encoder and its optimizer, if they do not exist.
+        :param ts: the temporal slice whose posteriors must be computed.
+        :param n_inputs: the number of inputs of the encoder, None to use all the observations of the temporal slice.
+        """
+        if self.encoder is not None:
+            return
+        if n_inputs is None:
+            n_inputs = sum([params.shape[0] for params in ts.obs_likelihood.values()])
+            n_inputs += sum([params.shape[0] * params.shape[1] for _, params, _ in ts.obs_groups.values()])
+        n_outputs = sum([prior.shape[-1] for prior in ts.states_prior.values()])
+        self.encoder = self.create_encoder(n_inputs, n_outputs, self.n_hidden)
+        self.optimizer = Optimizers.get_adam([self.encoder], self.learning_rate)
+
+    def log_posteriors(self, ts, inputs):
+        """
+        Compute the logarithm of the posterior beliefs over the states from the inputs of the encoder.
+        :param ts: the temporal slice whose posteriors must be computed.
+        :param inputs: the inputs of the encoder, the first dimension indexes the batch.
+        :return: a mapping from the name of each state to the batch of log-posteriors over this state.
+        """
+        # Create the encoder and its optimizer, if they do not exist.
+        inputs = inputs if inputs.dim() == 2 else inputs.unsqueeze(dim=0)
+        self.build(ts, inputs.shape[1])
+
+        # Normalise the outputs of the encoder corresponding to each state.
+        sizes = [prior.shape[-1] for prior in ts.states_prior.values()]
+        logits = self.encoder(inputs).split(sizes, dim=1)
+        return {state_name: torch.log_softmax(x, dim=1) for state_name, x in zip(ts.states_prior.keys(), logits)}
+
+    @staticmethod
+    def inputs(ts, obs):
+        """
+        Getter.
+        :param ts: the temporal slice.
+        :param obs: a mapping from the name of an observation (or observation group) to its evidence.
+        :return: the inputs of the encoder, i.e., the concatenation of the (flattened) evidence of all observations.
+        """
+        inputs = []
+        for name in sorted(obs.keys()):
+            evidence = torch.as_tensor(obs[name], dtype=torch.float32)
+            inputs.append(evidence.flatten(start_dim=-2) if name in ts.obs_groups.keys() else evidence)
+        return torch.cat(inputs, dim=-1)
+
+    @staticmethod
+    def create_encoder(n_inputs, n_outputs, n_hidden=256):
+        """
+        Create the encoder network
+        :param n_inputs: the number of input neurons
+        :param n_outputs: the number of output neurons, i.e., the logits of all the states
+        :param n_hidden: the number of neurons of each hidden layer
+        :return: the encoder network
+        """
+        return nn.Sequential(
+            nn.Linear(n_inputs, n_hidden),
+            nn.ReLU(),
+            nn.Linear(n_hidden, n_hidden),
+            nn.ReLU(),
+            nn.Linear(n_hidden, n_outputs),
+        )
@@ -0,0 +1,122 @@
+import torch
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
+
+
+class Contraction:
+    """
+    A contraction engine performing the product of a tensor with several (smaller) tensors followed by the summation
+    over some of its dimensions, in a single call to torch.einsum without materializing any intermediate tensor. The
+    contractions of structured noise tensors are delegated to the tensors, which only visit the peak of each column.
+    """
+
+    # The letters used to name the dimensions of the tensors in the einsum subscripts.
+    letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+    # The cache of einsum subscripts, i.e., a mapping from a contraction pattern to its subscripts.
+    subscripts = {}
+
+    @staticmethod
+    def contract(x1, operands, el=None):
+        """
+        Multiply the first tensor with each operand element-wise and sum over all the dimensions matched by the
+        operands, except the dimensions of the elimination list.
+        :param x1: the first tensor.
+        :param operands: a list of pairs (tensor, matching list), each matching list describes how the dimensions of
+            its tensor are matched to the dimensions of the first tensor.
+        :param el: the elimination list describing which dimension should not be reduced.
+        :return: the result of the contraction.
+        """
+        if isinstance(x1, StructuredNoiseTensor):
+            return x1.contract(operands, el)
+        subscripts = Contraction.get_subscripts(x1.dim(), [ml for _, ml in operands], el)
+        return torch.einsum(subscripts, x1, *[x2 for x2, _ in operands])
+
+    @staticmethod
+    def contract_batch(x1, operands, el=None):
+        """
+        Perform a batch of contractions sharing the same first tensor, i.e., the first dimension of each operand
+        indexes the batch and the output has a leading batch dimension.
+        :param x1: the first tensor, shared by all the contractions of the batch.
+        :param operands: a list of pairs (tensor, matching list), each matching list describes how the dimensions of
+            its tensor (except the batch dimension) are matched to the dimensions of the first tensor.
+        :param el: the elimination list describing which dimension should not be reduced.
+        :return: the result of the contractions.
+        """
+        if isinstance(x1, StructuredNoiseTensor):
+            return x1.contract_batch(operands, el)
+        subscripts = Contraction.get_subscripts(x1.dim(), [ml for _, ml in operands], el, batch=True)
+        return torch.einsum(subscripts, x1, *[x2 for x2, _ in operands])
+
+    @staticmethod
+    def log_contract(x1, log_operands, batch=False):
+        """
+        Perform a contraction in log space, i.e., compute the logarithm of the contraction of the first tensor with the
+        exponential of the operands. Each operand is shifted by its maximum (for each element of the batch) before
+        the exponentiation, so that the contraction cannot underflow.
+        :param x1: the first tensor, in probability space.
+        :param log_operands: a list of pairs (tensor in log space, matching list).
+        :param batch: whether the operands have a leading batch dimension.
+        :return: the logarithm of the contraction, with a leading batch dimension if the operands are batched.
+        """
+        # Shift each operand by its maximum.
+        shift = 0
+        operands = []
+        for x2, ml in log_operands:
+            x2_shift = Contraction.log_shift(x2, batch)
+            operands.append((torch.exp(x2 - x2_shift), ml))
+            shift = shift + x2_shift.view(-1) if batch else shift + x2_shift
+
+        # Perform the contraction, and remove the shift.
+        if batch:
+            result = Contraction.contract_batch(x1, operands).log()
+            return result + shift.view([-1] + [1] * (result.dim() - 1))
+        return Contraction.contract(x1, operands).log() + shift
+
+    @staticmethod
+    def log_shift(x, batch=False):
+        """
+        Getter.
+        :param x: a tensor in log space.
+        :param batch: whether the tensor has a leading batch dimension.
+        :return: the maximum of the tensor (for each element of the batch), where infinite values are replaced by zero.
+        """
+        if batch:
+            shift = x.view(x.shape[0], -1).max(dim=1).values.view([-1] + [1] * (x.dim() - 1))
+        else:
+            shift = x.max()
+        return torch.where(torch.isfinite(shift), shift, torch.zeros_like(shift))
+
+    @staticmethod
+    def get_subscripts(n_dims, mls, el=None, reduce=True, batch=False):
+        """
+        Getter.
+        :param n_dims: the number of dimensions of the first tensor.
+        :param mls: the matching lists of the operands.
+        :param el: the elimination list describing which dimension should not be reduced.
+        :param reduce: whether the matched dimensions must be reduced.
+        :param batch: whether the operands have a leading batch dimension.
+        :return: the einsum subscripts of the contraction, which are cached for subsequent calls.
+        """
+        # Check whether the subscripts are in the cache.
+        el = () if el is None else tuple(el)
+        key = (n_dims, tuple(tuple(ml) for ml in mls), el, reduce, batch)
+        if key in Contraction.subscripts.keys():
+            return Contraction.subscripts[key]
+
+        # Create the subscripts of the inputs, the batch dimension uses the first letter not used by the first tensor.
+        if n_dims + int(batch) > len(Contraction.letters):
+            max_dims = len(Contraction.letters) - int(batch)
+            raise Exception(f"In Contraction::get_subscripts, tensors cannot have more than {max_dims} dimensions.")
+        batch_letter = Contraction.letters[n_dims] if batch else ""
+        inputs = [Contraction.letters[0:n_dims]] + [
+            batch_letter + "".join(Contraction.letters[i] for i in ml) for ml in mls
+        ]
+
+        # Create the subscripts of the output, i.e., the non-reduced dimensions of the first tensor.
+        reduced = set(i for ml in mls for i in ml if i not in el) if reduce else set()
+        output = batch_letter + "".join(Contraction.letters[i] for i in range(n_dims) if i not in reduced)
+
+        # Add the subscripts to the cache.
+        subscripts = ",".join(inputs) + "->" + output
+        Contraction.subscripts[key] = subscripts
+        return subscripts
@@ -0,0 +1,242 @@
+import torch
+from torch.nn.functional import one_hot
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
+from agents.inference.enum.InferenceAlgorithms import InferenceAlgorithms as InfAlgo
+
+
+class DirichletLearning:
+    """
+    A class learning the likelihood and transition mappings of a temporal slice through Dirichlet count updates. The
+    experiences are accumulated, and every few steps the counts are incremented by the outer products between the
+    evidence (or the posteriors over the next states) and the posteriors over the parents. The evidence is one-hot and
+    the posteriors are nearly one-hot, so each outer product is restricted to the top-k values of each posterior and
+    scattered into the counts, i.e., only the columns of the mappings receiving some counts are touched. These columns
+    are then normalised in-place, and the entropies cached for the ambiguity term are only recomputed for them.
+    """
+
+    def __init__(
+            self, ts, concentration=100, flush_interval=10, inf_type=InfAlgo.LOOPY_BELIEF_PROPAGATION, top_k=2,
+            tolerance=1e-3
+    ):
+        """
+        Construct the Dirichlet learning of the mappings of a temporal slice.
+        :param ts: the temporal slice whose mappings are learned.
+        :param concentration: the number of pseudo-counts of the initial mappings, i.e., the strength of the prior.
+        :param flush_interval: the number of accumulated batches after which the counts and mappings are updated.
+        :param inf_type: the type of inference used to compute the posteriors over the states.
+        :param top_k: the number of values of each posterior over the states used by the outer products.
+        :param tolerance: the probability mass that the posteriors of a node must put on the updated columns of the
+            mappings, for the expected free energy of the node's children to be recomputed.
+        """
+        mappings = list(ts.obs_likelihood.values()) + list(ts.states_transition.values()) + \
+            [params for _, params, _ in ts.obs_groups.values()]
+        if any(isinstance(params, StructuredNoiseTensor) for params in mappings):
+            raise Exception("In DirichletLearning::__init__, the learned mappings must be dense tensors.")
+        self.ts = ts
+        self.flush_interval = flush_interval
+        self.inf_type = inf_type
+        self.top_k = top_k
+        self.tolerance = tolerance
+
+        # The counts of the Dirichlet distributions over the likelihood and transition mappings.
+        self.obs_counts = {name: params * concentration for name, params in ts.obs_likelihood.items()}
+        self.group_counts = {name: params * concentration for name, (_, params, _) in ts.obs_groups.items()}
+        self.states_counts = {name: params * concentration for name, params in ts.states_transition.items()}
+
+        # The batches of experiences accumulated since the last update of the counts.
+        self.pending = []
+
+        # The columns of the likelihood and transition mappings updated by the last flush, i.e., lists of pairs
+        # (parents, values of the parents indexing the columns).
+        self.touched_likelihoods = []
+        self.touched_transitions = []
+
+    def accumulate(self, obs, actions, done, next_obs):
+        """
+        Accumulate a batch of experiences, the counts are updated once enough batches have been accumulated.
+        :param obs: the evidence of the observations at time t, i.e., a mapping from observation (or group) name to a
+            batch of evidence.
+        :param actions: the actions performed at time t.
+        :param done: whether the episode ended after performing each action.
+        :param next_obs: the evidence of the observations at time t + 1.
+        :return: True if the mappings have been updated, False otherwise.
+        """
+        self.pending.append((obs, actions.long(), done.bool(), next_obs))
+        if len(self.pending) < self.flush_interval:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """
+        Update the counts using all the accumulated experiences, and normalise the columns of the mappings that changed.
+        """
+        self.touched_likelihoods = []
+        self.touched_transitions = []
+        if len(self.pending) == 0:
+            return
+
+        # Concatenate the accumulated batches.
+        obs = {name: torch.cat([b[0][name] for b in self.pending]) for name in self.pending[0][0].keys()}
+        actions = torch.cat([b[1] for b in self.pending])
+        done = torch.cat([b[2] for b in self.pending])
+        next_obs = {name: torch.cat([b[3][name] for b in self.pending]) for name in self.pending[0][3].keys()}
+        self.pending = []
+
+        # Compute the posteriors over the states at time t and t + 1, for all experiences at once.
+        states_posterior = self.ts.i_step_batch(obs, self.inf_type)[0]
+        next_states_posterior = self.ts.i_step_batch(next_obs, self.inf_type)[0]
+        states_posterior[self.ts.action_name] = one_hot(actions, self.ts.n_actions).float()
+
+        # Update the likelihood mappings, i.e., the counts of each observation given its parents.
+        for name, counts in self.obs_counts.items():
+            parents = self.ts.obs_parents[name]
+            posteriors = [obs[name]] + [states_posterior[parent] for parent in parents]
+            indices, weights = self.outer_top_k(posteriors, [0] + self.actions_positions(parents, 1))
+            columns = self.scatter(counts, indices, weights)[:, 1:].unique(dim=0)
+            self.normalise(self.ts.obs_likelihood[name], counts, 0, columns)
+            self.touched_likelihoods.append((parents, columns))
+        for name, counts in self.group_counts.items():
+            _, params, parents = self.ts.obs_groups[name]
+            posteriors = [states_posterior[parent] for parent in parents]
+            indices, weights = self.outer_top_k(posteriors, self.actions_positions(parents, 0))
+
+            # Each observation of the group receives the counts of its own evidence, i.e., the first two indices are
+            # the index of the observation in the group and its value.
+            evidence = obs[name].argmax(dim=2)
+            batch_size, n_obs = evidence.shape
+            n_combinations = weights.shape[1]
+            indices = [
+                torch.arange(n_obs).view(1, n_obs, 1).expand(batch_size, n_obs, n_combinations),
+                evidence.unsqueeze(dim=2).expand(batch_size, n_obs, n_combinations)
+            ] + [index.unsqueeze(dim=1).expand(batch_size, n_obs, n_combinations) for index in indices]
+            weights = weights.unsqueeze(dim=1).expand(batch_size, n_obs, n_combinations)
+            columns = self.scatter(counts, indices, weights)
+            columns = torch.cat([columns[:, :1], columns[:, 2:]], dim=1).unique(dim=0)
+            self.normalise(params, counts, 1, columns)
+            self.touched_likelihoods.append((parents, columns[:, 1:].unique(dim=0)))
+
+        # Update the transition mappings, the transitions ending an episode are ignored.
+        if done.all():
+            return
+        states_posterior = {name: posterior[~done] for name, posterior in states_posterior.items()}
+        for name, counts in self.states_counts.items():
+            parents = self.ts.states_parents[name]
+            posteriors = [next_states_posterior[name][~done]] + [states_posterior[parent] for parent in parents]
+            indices, weights = self.outer_top_k(posteriors, self.actions_positions(parents, 1))
+            columns = self.scatter(counts, indices, weights)[:, 1:].unique(dim=0)
+            self.normalise(self.ts.states_transition[name], counts, 0, columns)
+            self.touched_transitions.append((parents, columns))
+
+    def actions_positions(self, parents, offset):
+        """
+        Getter.
+        :param parents: the parents of a random variable.
+        :param offset: the position of the first parent in the list of posteriors.
+        :return: the positions of the action in the list of posteriors, whose posterior is one-hot.
+        """
+        return [i + offset for i, parent in enumerate(parents) if parent == self.ts.action_name]
+
+    def outer_top_k(self, posteriors, one_hots=None):
+        """
+        Compute the sparse outer products of a batch of posteriors, restricted to the top-k values of each posterior.
+        :param posteriors: the posteriors, the first dimension of each tensor indexes the batch.
+        :param one_hots: the positions of the posteriors that are one-hot, for which only the top value is used.
+        :return: the indices of the outer products (one tensor of shape [batch_size, n_combinations] per posterior),
+            and their weights, i.e., a tensor of shape [batch_size, n_combinations].
+        """
+        one_hots = [] if one_hots is None else one_hots
+        indices, weights = [], None
+        for i, posterior in enumerate(posteriors):
+            k = 1 if i in one_hots else min(self.top_k, posterior.shape[1])
+            values, index = posterior.topk(k, dim=1)
+            if weights is None:
+                indices, weights = [index], values
+                continue
+            n_combinations = weights.shape[1]
+            indices = [x.repeat_interleave(k, dim=1) for x in indices] + [index.repeat(1, n_combinations)]
+            weights = (weights.unsqueeze(dim=2) * values.unsqueeze(dim=1)).flatten(start_dim=1)
+        return indices, weights
+
+    @staticmethod
+    def scatter(counts, indices, weights):
+        """
+        Add the weights of the sparse outer products to the counts.
+        :param counts: the counts of a mapping.
+        :param indices: the indices of the outer products, one tensor per dimension of the counts.
+        :param weights: the weights of the outer products.
+        :return: the indices receiving a non-zero weight, i.e., a tensor of shape [n_indices, n_dims].
+        """
+        indices = torch.stack([index.reshape(-1) for index in indices], dim=1)
+        weights = weights.reshape(-1)
+        indices = indices[weights > 0]
+        counts.index_put_(tuple(indices.t()), weights[weights > 0], accumulate=True)
+        return indices
+
+    def normalise(self, params, counts, dim, columns):
+        """
+        Set some columns of a mapping to the expectation of its Dirichlet distribution, the parameters are modified
+        in-place so that all the references to the mapping (e.g., in the factor graph) are updated, and the cached
+        entropies of the columns are updated.
+        :param params: the parameters of the mapping.
+        :param counts: the counts of the Dirichlet distribution.
+        :param dim: the dimension of the mapping indexing the values of the random variable.
+        :param columns: the columns to normalise, i.e., the indices of all the other dimensions.
+        """
+        previous_version = params._version
+        columns = tuple(columns.t())
+        column_counts = counts.movedim(dim, -1)[columns]
+        params.movedim(dim, -1)[columns] = column_counts / column_counts.sum(dim=1, keepdim=True)
+        self.ts.entropy_cache.update(params, dim, columns, previous_version)
+
+    def affects(self, states_posterior, children_states_posterior):
+        """
+        Check whether the last update of the mappings changed the expansion or evaluation of a node.
+        :param states_posterior: the posteriors over the states of the node.
+        :param children_states_posterior: the posteriors over the states of the node's children, the first dimension
+            indexes the children.
+        :return: True if the posteriors of the node or of its children put some mass on the updated columns.
+        """
+        # The posteriors of the children depend on the columns of the transition mappings, all the actions being
+        # expanded.
+        for parents, columns in self.touched_transitions:
+            mass = torch.ones(columns.shape[0])
+            for i, parent in enumerate(parents):
+                if parent != self.ts.action_name:
+                    mass = mass * states_posterior[parent][columns[:, i]]
+            if mass.sum() > self.tolerance:
+                return True
+
+        # The expected free energy of the children depends on the columns of the likelihood mappings.
+        for parents, columns in self.touched_likelihoods:
+            mass = 1
+            for i, parent in enumerate(parents):
+                mass = mass * children_states_posterior[parent][:, columns[:, i]]
+            if mass.sum(dim=1).max() > self.tolerance:
+                return True
+        return False
+
+    def state_dicts(self):
+        """
+        Getter.
+        :return: the learned mappings and their counts, i.e., two dictionaries from mapping names to tensors.
+        """
+        mappings, counts = {}, {}
+        for name, params in self.ts.obs_likelihood.items():
+            mappings[f"obs-{name}"], counts[f"obs-{name}"] = params, self.obs_counts[name]
+        for name, (_, params, _) in self.ts.obs_groups.items():
+            mappings[f"group-{name}"], counts[f"group-{name}"] = params, self.group_counts[name]
+        for name, params in self.ts.states_transition.items():
+            mappings[f"transition-{name}"], counts[f"transition-{name}"] = params, self.states_counts[name]
+        return mappings, counts
+
+    def load_state_dicts(self, mappings, counts):
+        """
+        Restore the learned mappings and their counts, the mappings are modified in-place.
+        :param mappings: the learned mappings, as returned by state_dicts.
+        :param counts: the counts of the mappings, as returned by state_dicts.
+        """
+        current_mappings, current_counts = self.state_dicts()
+        for name, params in current_mappings.items():
+            params.copy_(mappings[name])
+            current_counts[name].copy_(counts[name])
@@ -0,0 +1,57 @@
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
+
+
+class EntropyCache:
+    """
+    A cache storing the entropy of likelihood mappings, i.e., H[A] = - sum_o A[o, ...] log A[o, ...], which is needed
+    to compute the ambiguity term of the expected free energy. An entry is recomputed automatically if its likelihood
+    mapping is modified in-place (e.g., when the likelihood is learned) or replaced by another tensor, unless the
+    modified columns are explicitly updated.
+    """
+
+    def __init__(self):
+        """
+        Construct an empty cache.
+        """
+        self.entries = {}
+
+    def get(self, params, dim=0):
+        """
+        Getter.
+        :param params: the parameters of the likelihood mapping.
+        :param dim: the dimension of the parameters indexing the observations.
+        :return: the entropy of the likelihood mapping for each value of its parents.
+        """
+        key = (id(params), dim)
+        entry = self.entries.get(key, None)
+        if entry is None or entry[0] is not params or entry[1] != params._version:
+            if isinstance(params, StructuredNoiseTensor):
+                entropy = params.entropy(dim=dim)
+            else:
+                entropy = - (params * params.log()).sum(dim=dim)
+            entry = (params, params._version, entropy)
+            self.entries[key] = entry
+        return entry[2]
+
+    def update(self, params, dim, columns, previous_version):
+        """
+        Recompute the entropy of some columns of a likelihood mapping modified in-place, the entry is only updated if
+        it was up-to-date before the modification (otherwise it is fully recomputed by the next call to get).
+        :param params: the parameters of the likelihood mapping.
+        :param dim: the dimension of the parameters indexing the observations.
+        :param columns: the modified columns, i.e., a tuple of index tensors over all the other dimensions.
+        :param previous_version: the version of the parameters before the modification.
+        """
+        key = (id(params), dim)
+        entry = self.entries.get(key, None)
+        if entry is None or entry[0] is not params or entry[1] != previous_version:
+            return
+        column_params = params.movedim(dim, -1)[columns]
+        entry[2][columns] = - (column_params * column_params.log()).sum(dim=-1)
+        self.entries[key] = (params, params._version, entry[2])
+
+    def clear(self):
+        """
+        Remove all the entries of the cache.
+        """
+        self.entries = {}
@@ -1,4 +1,5 @@
 import torch
+from agents.inference.Contraction import Contraction
 
 
 class Operators:
@@ -26,28 +27,8 @@ class Operators:
         :param ml: a list describing how the dimensions of the x1 matches the dimesions of x2.
         :return: the result of the element-wise multiplication.
         """
-        # Create the list on non-matching dimensions
-        not_ml = []
-        for i in range(x1.dim()):
-            if i not in ml:
-                not_ml.append(i)
-
-        # Sequence of expansions
-        x2_tmp = x2
-        for i in not_ml:
-            x2_tmp = Operators.expansion(x2_tmp, x1.shape[i], x2_tmp.dim())
-
-        # Permutation
-        pl = [0] * x1.ndim
-        for i in range(x1.ndim):
-            try:
-                pl[i] = ml.index(i)
-            except ValueError:
-                pl[i] = len(ml) + not_ml.index(i)
-        x2_tmp = x2_tmp.permute(pl)
-
-        # Element-wise multiplication
-        return x2_tmp * x1
+        subscripts = Contraction.get_subscripts(x1.dim(), [ml], reduce=False)
+        return torch.einsum(subscripts, x1, x2)
 
     @staticmethod
     def average(x1, x2, ml, el=None):
@@ -58,23 +39,6 @@ class Operators:
         :param ml: the maching list describing how the dimensions of the second tensor are
             matched to the dimensions of the first tensor.
         :param el: the elimination list describing which dimension should not be reduced.
+        :return: the result of the average.
         """
-        # Create an empty elimination list, if it is None.
-        if el is None:
-            el = []
-
-        # Perform the element-wise multiplication
-        result = Operators.multiplication(x1, x2, ml)
-
-        # Create the reduction list, i.e. rl = ml \ el where "\" = set minus
-        rl = ml
-        for elem in el:
-            rl.remove(elem)
-
-        # Sort the reduction list in decreasing order
-        rl.sort(reverse=True)
-
-        # Reduction of the tensor (using a summation) along the dimension of the reduction list
-        for i in rl:
-            result = result.sum(i)
-        return result
+        return Contraction.contract(x1, [(x2, ml)], el)
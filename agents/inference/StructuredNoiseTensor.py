@@ -0,0 +1,312 @@
+import math
+import torch
+
+
+class StructuredNoiseTensor:
+    """
+    A tensor storing distributions along one of its dimensions, where each distribution (i.e., each column of the
+    tensor) is a uniform floor except for a single peak, e.g., a near-deterministic likelihood or transition mapping.
+    Only the position of the peak of each column is stored (using the smallest integer type that can index the
+    distributions), as well as the value of the peaks (a single scalar when all the peaks are equal). The logarithm and
+    the entropy are computed from the peaks, i.e., they visit each column once instead of each element of the tensor.
+    The contractions only visit the columns whose peak differs from the most frequent peak of the columns sharing the
+    same output element, which are found once per contraction pattern.
+    """
+
+    def __init__(self, shape, floor, dim, peaks, deltas):
+        """
+        Construct the structured noise tensor.
+        :param shape: the shape of the tensor.
+        :param floor: the value of all the elements that are not peaks.
+        :param dim: the dimension of the tensor indexing the values of the distributions.
+        :param peaks: the position of the peak of each column along dim, i.e., a tensor whose shape is the shape of the
+            tensor without dim.
+        :param deltas: the value of each peak minus the floor, i.e., a tensor with the same shape as the peaks or a
+            scalar tensor shared by all the peaks.
+        """
+        self.shape = torch.Size(shape)
+        self.floor = float(floor)
+        self.dist_dim = dim
+        self.peaks = peaks
+        self.deltas = deltas
+
+        # The version of the tensor, used by the caches storing quantities derived from the tensor.
+        self._version = 0
+
+        # The columns whose peak differs from the mode of their kept coordinates, for each contraction pattern.
+        self._exceptions = {}
+
+    @staticmethod
+    def from_dense(tensor, dim=0, floor=None):
+        """
+        Create a structured noise tensor from a dense tensor.
+        :param tensor: the dense tensor, each column of which must contain at most one element above the floor.
+        :param dim: the dimension of the tensor indexing the values of the distributions.
+        :param floor: the uniform floor, by default the smallest element of the tensor.
+        :return: the structured noise tensor.
+        """
+        floor = tensor.min().item() if floor is None else floor
+        above_floor = ~torch.isclose(tensor, torch.full_like(tensor, floor))
+        if (above_floor.sum(dim=dim) > 1).any():
+            raise Exception("In StructuredNoiseTensor::from_dense, each column must contain a single peak.")
+        values, peaks = tensor.max(dim=dim)
+        deltas = values - floor
+        if (deltas == deltas.reshape(-1)[0]).all():
+            deltas = deltas.reshape(-1)[0].clone()
+        peaks = peaks.to(StructuredNoiseTensor.index_type(tensor.shape[dim]))
+        return StructuredNoiseTensor(tensor.shape, floor, dim, peaks, deltas)
+
+    @staticmethod
+    def index_type(size):
+        """
+        Getter.
+        :param size: the number of values of the distributions.
+        :return: the smallest integer type that can index the values.
+        """
+        if size <= 256:
+            return torch.uint8
+        if size <= 32768:
+            return torch.int16
+        return torch.long
+
+    def to_dense(self):
+        """
+        Getter.
+        :return: the dense tensor.
+        """
+        tensor = torch.full(self.shape, self.floor)
+        peaks = self.peaks.long().unsqueeze(self.dist_dim)
+        deltas = self.deltas.expand(self.peaks.shape).unsqueeze(self.dist_dim)
+        return tensor.scatter_add_(self.dist_dim, peaks, deltas.contiguous())
+
+    def dim(self):
+        """
+        Getter.
+        :return: the number of dimensions of the tensor.
+        """
+        return len(self.shape)
+
+    def column_dims(self):
+        """
+        Getter.
+        :return: the dimensions of the tensor indexing the columns, i.e., all the dimensions except the one indexing
+            the values of the distributions.
+        """
+        return [i for i in range(self.dim()) if i != self.dist_dim]
+
+    def nbytes(self):
+        """
+        Getter.
+        :return: the number of bytes used to store the tensor.
+        """
+        return self.peaks.numel() * self.peaks.element_size() + self.deltas.numel() * self.deltas.element_size()
+
+    def __getitem__(self, index):
+        """
+        Getter.
+        :param index: the index of an element along the first dimension, or any index supported by dense tensors.
+        :return: the structured noise tensor corresponding to the index along the first dimension (which is a view of
+            the peaks if the first dimension indexes the columns), or the dense tensor corresponding to any other index
+            (which requires the tensor to be materialized).
+        """
+        if not isinstance(index, int) or self.dist_dim == 0:
+            return self.to_dense()[index]
+        deltas = self.deltas[index] if self.deltas.dim() > 0 else self.deltas
+        return StructuredNoiseTensor(self.shape[1:], self.floor, self.dist_dim - 1, self.peaks[index], deltas)
+
+    def unsqueeze(self, dim):
+        """
+        Insert a dimension of size one.
+        :param dim: the index of the new dimension.
+        :return: the structured noise tensor with the new dimension.
+        """
+        shape = list(self.shape)
+        shape.insert(dim, 1)
+        dist_dim = self.dist_dim + 1 if dim <= self.dist_dim else self.dist_dim
+        column = dim if dim <= self.dist_dim else dim - 1
+        deltas = self.deltas.unsqueeze(column) if self.deltas.dim() > 0 else self.deltas
+        return StructuredNoiseTensor(shape, self.floor, dist_dim, self.peaks.unsqueeze(column), deltas)
+
+    def clamp(self, min):
+        """
+        Clamp the elements of the tensor.
+        :param min: the lower bound of the elements.
+        :return: the clamped structured noise tensor.
+        """
+        floor = max(self.floor, min)
+        deltas = (self.floor + self.deltas).clamp(min=min) - floor
+        return StructuredNoiseTensor(self.shape, floor, self.dist_dim, self.peaks, deltas)
+
+    def log(self):
+        """
+        Compute the logarithm of the tensor, which is also a structured noise tensor.
+        :return: the logarithm of the tensor.
+        """
+        floor = math.log(self.floor) if self.floor > 0 else - math.inf
+        deltas = (self.floor + self.deltas).log() - floor
+        return StructuredNoiseTensor(self.shape, floor, self.dist_dim, self.peaks, deltas)
+
+    def entropy(self, dim=0):
+        """
+        Compute the entropy of the distributions stored along a dimension, i.e., - sum_x T[x, ...] log T[x, ...].
+        :param dim: the dimension indexing the values of the random variable.
+        :return: the dense tensor of entropies.
+        """
+        if dim != self.dist_dim:
+            tensor = self.to_dense()
+            return - (tensor * tensor.log()).sum(dim=dim)
+
+        # The entropy of each column is the entropy of its floor elements plus the entropy of its peak.
+        floor_term = self.floor * math.log(self.floor) if self.floor > 0 else 0
+        probs = self.floor + self.deltas
+        peak_term = torch.where(probs > 0, probs * probs.log(), torch.zeros_like(probs))
+        entropies = - (self.shape[dim] - 1) * floor_term - peak_term
+        return entropies.expand(self.peaks.shape)
+
+    def contract(self, operands, el=None):
+        """
+        Multiply the tensor with each operand element-wise and sum over all the dimensions matched by the operands.
+        :param operands: a list of pairs (tensor, matching list).
+        :param el: the elimination list, which is not supported by structured noise tensors.
+        :return: the result of the contraction.
+        """
+        operands = [(x2.unsqueeze(dim=0), ml) for x2, ml in operands]
+        return self.contract_batch(operands, el)[0]
+
+    def contract_batch(self, operands, el=None):
+        """
+        Perform a batch of contractions, i.e., the first dimension of each operand indexes the batch and the output
+        has a leading batch dimension. The result is the contribution of the uniform floor, which is the same for all
+        the elements of the output, plus the contribution of the peaks. The columns sharing the same kept coordinates
+        mostly share the same peak (their mode), so the contribution of the peaks is the weight of all those columns
+        added at the mode, corrected by the few columns whose peak differs from the mode.
+        :param operands: a list of pairs (tensor, matching list), each dimension of the tensor can be matched at most
+            once, and the dimension indexing the values of the distributions must be matched alone.
+        :param el: the elimination list, which is not supported by structured noise tensors.
+        :return: the result of the contractions.
+        """
+        matched = [i for _, ml in operands for i in ml]
+        supported = all(self.dist_dim not in ml or len(ml) == 1 for _, ml in operands)
+        if el is not None or len(matched) != len(set(matched)) or not supported:
+            raise Exception("In StructuredNoiseTensor::contract_batch, the contraction pattern is not supported.")
+        batch_size = operands[0][0].shape[0]
+        kept_columns = [i for i in self.column_dims() if i not in matched]
+        modes, columns, added, removed, deltas = self.exceptions(tuple(kept_columns), self.dist_dim not in matched)
+        n_kept = modes.shape[0]
+
+        # The contribution of the uniform floor, i.e., the floor times the sum of each operand.
+        floor = torch.full([batch_size], self.floor)
+        for x2, _ in operands:
+            floor = floor * x2.reshape(batch_size, -1).sum(dim=1)
+
+        # The weight of each matched column, i.e., the product of the operands that do not match the values of the
+        # distributions, and the sum of the weights of the columns sharing the same kept coordinates.
+        weights = self.column_weights(operands, [i for i in self.column_dims() if i in matched], batch_size)
+        if self.deltas.dim() == 0:
+            mode_weights = (self.deltas * weights.sum(dim=1)).unsqueeze(dim=1).expand(batch_size, n_kept)
+        else:
+            mode_weights = weights @ self.kept_matched_view(self.deltas.expand(self.peaks.shape), kept_columns).T
+        weights = deltas * weights[:, columns]
+
+        # When the values of the distributions are kept, the weights are added to the element of the output containing
+        # the peak of their columns.
+        if self.dist_dim not in matched:
+            n_values = self.shape[self.dist_dim]
+            result = torch.zeros([batch_size, n_kept * n_values])
+            result[:, torch.arange(n_kept) * n_values + modes] = mode_weights
+            result.index_add_(1, added, weights)
+            result.index_add_(1, removed, - weights)
+            result = result.view([batch_size] + [self.shape[i] for i in kept_columns] + [n_values])
+            result = result.movedim(-1, 1 + sum(i < self.dist_dim for i in kept_columns))
+            return result + floor.view([batch_size] + [1] * (result.dim() - 1))
+
+        # Otherwise, the weights are multiplied by the element of the operand matching the peak of their columns.
+        x_dist = next(x2 for x2, ml in operands if ml[0] == self.dist_dim)
+        result = mode_weights * x_dist[:, modes]
+        result.index_add_(1, removed, weights * (x_dist[:, added] - x_dist[:, modes[removed]]))
+        result = result + floor.view(batch_size, 1)
+        return result.view([batch_size] + [self.shape[i] for i in kept_columns])
+
+    def exceptions(self, kept_columns, keep_values):
+        """
+        Getter.
+        :param kept_columns: the dimensions indexing the columns that are kept by a contraction.
+        :param keep_values: whether the contraction keeps the dimension indexing the values of the distributions.
+        :return: a tuple containing the mode of the peaks of the columns sharing the same kept coordinates, and for
+            each column whose peak differs from the mode: the index of its matched coordinates, the position of its peak
+            and of the mode in the flattened output (or, if the values are matched, the value of its peak and the index
+            of its kept coordinates), and the value of its peak minus the floor. The exceptions are computed once per
+            contraction pattern.
+        """
+        key = (kept_columns, keep_values)
+        if key in self._exceptions.keys():
+            return self._exceptions[key]
+
+        # Find the columns whose peak differs from the mode of the columns sharing the same kept coordinates.
+        peaks = self.kept_matched_view(self.peaks.long(), kept_columns)
+        modes = peaks.mode(dim=1).values
+        kept, columns = (peaks != modes.unsqueeze(dim=1)).nonzero(as_tuple=True)
+        values = peaks[kept, columns]
+        deltas = self.deltas if self.deltas.dim() == 0 else \
+            self.kept_matched_view(self.deltas.expand(self.peaks.shape), kept_columns)[kept, columns]
+
+        # Compute the position of their peak and of the mode in the output, if the values of the distributions are kept.
+        if keep_values:
+            n_values = self.shape[self.dist_dim]
+            self._exceptions[key] = (modes, columns, kept * n_values + values, kept * n_values + modes[kept], deltas)
+        else:
+            self._exceptions[key] = (modes, columns, values, kept, deltas)
+        return self._exceptions[key]
+
+    def kept_matched_view(self, columns, kept_columns):
+        """
+        Getter.
+        :param columns: a tensor with one element per column of the tensor, i.e., whose shape is the shape of the peaks.
+        :param kept_columns: the dimensions indexing the columns that are kept by a contraction.
+        :return: the tensor as a matrix, whose rows index the kept coordinates and whose columns index the matched
+            coordinates of the columns (in the order of the dimensions of the tensor).
+        """
+        column_dims = self.column_dims()
+        kept = [column_dims.index(i) for i in kept_columns]
+        matched = [j for j in range(len(column_dims)) if j not in kept]
+        n_kept = math.prod(self.shape[i] for i in kept_columns)
+        return columns.permute(kept + matched).reshape(n_kept, -1)
+
+    def column_weights(self, operands, matched_columns, batch_size):
+        """
+        Getter.
+        :param operands: the batch of operands of a contraction.
+        :param matched_columns: the dimensions indexing the columns that are matched by the operands.
+        :param batch_size: the size of the batch.
+        :return: the product of the operands that do not match the values of the distributions, i.e., a matrix whose
+            rows index the batch and whose columns index the matched coordinates of the columns.
+        """
+        weights = torch.ones([batch_size] + [1] * len(matched_columns))
+        for x2, ml in operands:
+            if ml[0] == self.dist_dim:
+                continue
+            order = sorted(range(len(ml)), key=lambda j: ml[j])
+            x2 = x2.permute([0] + [j + 1 for j in order])
+            weights = weights * x2.reshape([batch_size] + [self.shape[i] if i in ml else 1 for i in matched_columns])
+        return weights.reshape(batch_size, -1)
+
+    def gather_trailing(self, indices):
+        """
+        Select elements along the last dimensions of the tensor, i.e., the equivalent of T[..., indices[0], ...,
+        indices[-1]] for dense tensors, where only the requested columns are materialized.
+        :param indices: the index tensors of the last dimensions, which must all have the same shape.
+        :return: the dense tensor whose shape is the shape of the leading dimensions followed by the shape of the
+            index tensors.
+        """
+        n_leading = self.dim() - len(indices)
+        if self.dist_dim >= n_leading:
+            return self.to_dense()[(slice(None),) * n_leading + tuple(indices)]
+
+        # Select the peaks of the requested columns, and add them to the uniform floor.
+        index = (slice(None),) * (n_leading - 1) + tuple(indices)
+        peaks = self.peaks[index].long()
+        deltas = self.deltas[index] if self.deltas.dim() > 0 else self.deltas.expand(peaks.shape)
+        result = torch.full(list(self.shape[:n_leading]) + list(indices[0].shape), self.floor)
+        return result.scatter_add_(
+            self.dist_dim, peaks.unsqueeze(self.dist_dim), deltas.unsqueeze(self.dist_dim).contiguous()
+        )
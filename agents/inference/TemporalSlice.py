@@ -1,17 +1,12 @@
-import copy
-
-from torch import nn
-from PIL import Image
-from agents.math.functions import kl_div_categorical
 import math
-import queue
 import torch
-import random
-import numpy as np
 from torch.nn.functional import one_hot
-from agents.inference.Operators import Operators
+from agents.graph.LoopyBeliefPropagation import LoopyBeliefPropagation
+from agents.inference.AmortizedInference import AmortizedInference
+from agents.inference.Contraction import Contraction
+from agents.inference.EntropyCache import EntropyCache
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
 from agents.inference.enum.InferenceAlgorithms import InferenceAlgorithms as InfAlgo
-from agents.learning import Optimizers
 
 
 class TemporalSlice:
@@ -22,7 +17,8 @@ class TemporalSlice:
 
     def __init__(
             self, fg, n_actions, action_name, obs_prior_pref, obs_likelihood,
-            states_prior, states_transition, states_parents, obs_parents
+            states_prior, states_transition, states_parents, obs_parents, obs_groups=None, entropy_cache=None,
+            amortized_inference=None, lbp=None
     ):
         """
         Create a temporal slice.
@@ -35,6 +31,12 @@ class TemporalSlice:
         :param states_transition: the transition mappings of hidden states.
         :param states_parents: the parents of each state.
         :param obs_parents: the parents of each observation.
+        :param obs_groups: the groups of observations sharing the same parents, i.e., a mapping from the group name to
+            the names of the observations in the group, their stacked likelihood tensors, and their parents.
+        :param entropy_cache: the cache of the likelihood entropies, shared by all the temporal slices of a tree.
+        :param amortized_inference: the encoder used by the I-step based on backpropagation, shared by all the temporal
+            slices of a tree.
+        :param lbp: the loopy belief propagation engine used by the I-step, shared by all the temporal slices of a tree.
         """
         self.n_actions = n_actions
         self.action_name = action_name
@@ -47,14 +49,23 @@ class TemporalSlice:
         self.states_transition = states_transition
         self.states_parents = states_parents
         self.states_posterior = {k: torch.ones_like(v) for k, v in states_prior.items()}
-        self.obs_posterior = {k: torch.ones_like(v) for k, v in obs_likelihood.items()}
+        self.obs_posterior = {k: torch.ones(v.shape[0]) for k, v in obs_likelihood.items()}
+        self.obs_groups = {} if obs_groups is None else obs_groups
+        self.obs_group_posterior = {k: torch.ones(params.shape[0:2]) for k, (_, params, _) in self.obs_groups.items()}
+        self.entropy_cache = EntropyCache() if entropy_cache is None else entropy_cache
+        self.obs_group_index = {
+            rv_name: (group_name, i)
+            for group_name, (rv_names, _, _) in self.obs_groups.items() for i, rv_name in enumerate(rv_names)
+        }
         self.action = -1
         self.cost = 0
         self.visits = 1
         self.parent = None
         self.children = []
-        self.encoder = None
-        self.optimizer = None if self.encoder is None else Optimizers.get_adam([self.encoder], 0.001)
+        self.children_posteriors = None
+        self.efe_values = {}
+        self.lbp = LoopyBeliefPropagation() if lbp is None else lbp
+        self.amortized_inference = AmortizedInference() if amortized_inference is None else amortized_inference
         self.to_i_step = {
             InfAlgo.BELIEF_PROPAGATION: self.i_step_bp,
             InfAlgo.LOOPY_BELIEF_PROPAGATION: self.i_step_lbp,
@@ -72,6 +83,8 @@ class TemporalSlice:
         self.visits = 1
         self.parent = None
         self.children = []
+        self.children_posteriors = None
+        self.efe_values = {}
 
     def uct(self, exp_const):
         """
@@ -96,6 +109,7 @@ class TemporalSlice:
         :param inf_type: the type of inference to use
         :return: nothing
         """
+        self.efe_values = {}
         try:
             self.to_i_step[inf_type](obs)
         except RuntimeError:
@@ -107,30 +121,103 @@ class TemporalSlice:
                 )
                 self.to_i_step[InfAlgo.LOOPY_BELIEF_PROPAGATION](obs)
             else:
-                print("[ERROR] The requested inference algorithm failed to compute the posterior distributions.")
+                # The posteriors over the states fall back to their priors, rather than keeping the posteriors of
+                # the previous I-step, the failure is counted in the statistics of loopy belief propagation.
+                print(
+                    "[ERROR] The requested inference algorithm failed to compute the posterior distributions. The "
+                    "posteriors over the states are reset to their priors."
+                )
+                self.states_posterior = {k: v.clone() for k, v in self.states_priors().items()}
+
+    def states_priors(self):
+        """
+        Getter.
+        :return: the priors over the states, i.e., the empirical priors set by use_posteriors_as_empirical_priors if
+            any, and the parameters of the prior factors of the factor graph otherwise
+        """
+        priors = {}
+        for state in self.states_posterior.keys():
+            empirical_prior = getattr(self.fg[state], "params", None)
+            priors[state] = self.fg["f_" + state].params if empirical_prior is None else empirical_prior
+        return priors
+
+    def i_step_batch(self, obs, inf_type=InfAlgo.LOOPY_BELIEF_PROPAGATION):
+        """
+        Perform the I-step for a batch of observations in a single call, e.g., to evaluate the model offline. The
+        messages of (loopy) belief propagation are batched, so the graph is traversed once for the whole batch. The
+        posteriors and evidence of the temporal slice are left unchanged
+        :param obs: the batch of observations, i.e., a mapping from observation (or group) name to a batch of evidence
+            whose first dimension indexes the batch
+        :param inf_type: the type of inference to use
+        :return: a tuple containing the batched posteriors over the states, the observations and the observations of
+            each group, where the first dimension of each posterior indexes the batch
+        """
+        # Save the posteriors and evidence of the temporal slice.
+        states_posterior = self.states_posterior
+        evidence = {node.name: node.params for node in self.fg.factor_nodes() if node.name.startswith("e_")}
+        self.states_posterior = dict(states_posterior)
+
+        with torch.no_grad():
+            # Compute the batch of posteriors over the states, the encoder does not learn from offline data.
+            if inf_type == InfAlgo.BACKPROPAGATION:
+                self.i_step_backpropagation(obs, learn=False)
+            else:
+                self.i_step(obs, inf_type)
+            batch_states_posterior = self.states_posterior
+
+            # Predict the batch of posteriors over the observations, one contraction per observation and group.
+            batch_obs_posterior = {
+                obs_name: self.batched_forward_prediction(
+                    self.obs_likelihood[obs_name], self.obs_parents[obs_name], batch_states_posterior
+                ) for obs_name in self.obs_likelihood.keys()
+            }
+            batch_obs_group_posterior = {
+                group_name: self.batched_forward_prediction(params, parents, batch_states_posterior, parents_dim=2)
+                for group_name, (_, params, parents) in self.obs_groups.items()
+            }
+
+        # Restore the posteriors and evidence of the temporal slice.
+        self.states_posterior = states_posterior
+        for name, params in evidence.items():
+            self.fg[name].params = params
+        self.fg.reset_messages()
+        return batch_states_posterior, batch_obs_posterior, batch_obs_group_posterior
+
+    def set_evidence(self, obs):
+        """
+        Set the evidence of the observations in the factor graph
+        :param obs: a mapping from the name of an observation to its evidence, the evidence of all the observations of
+            a group can be provided at once using the group name, i.e., the evidence of the i-th observation of the
+            group is then indexed by i along the second to last dimension
+        """
+        for name, evidence in obs.items():
+            if name not in self.obs_groups.keys():
+                self.fg.set_evidence(name, evidence)
+                continue
+            evidence = torch.as_tensor(evidence, dtype=torch.float32)
+            for rv_name, rv_evidence in zip(self.obs_groups[name][0], evidence.unbind(dim=-2)):
+                self.fg.set_evidence(rv_name, rv_evidence)
 
     def i_step_bp(self, obs):
         """
-        Perform the I-step, i.e., compute the posterior beliefs using beliefs propagation
+        Perform the I-step, i.e., compute the posterior beliefs using beliefs propagation, or using loopy belief
+        propagation if the factor graph contains loops (which is detected when the message schedule is compiled)
         :param obs: the observations made by the agent
         :return: nothing
         """
-        # Set the evidence of each observation.
-        for name, evidence in obs.items():
-            self.fg.set_evidence(name, evidence)
+        # Compile the message schedule, if the structure of the factor graph changed.
+        if not self.fg.compiled:
+            self.fg.compile_schedule()
+        if self.fg.schedule is None:
+            self.i_step_lbp(obs)
+            return
 
-        # Create a queue containing all the leaf nodes.
-        q = queue.Queue()
-        for node in self.fg.leaf_nodes():
-            q.put(node)
+        # Set the evidence of each observation.
+        self.set_evidence(obs)
 
-        # Perform the belief propagation algorithm.
-        while not q.empty():
-            node = q.get()
-            for t_node in self.get_target_nodes(node):
-                t_node.in_messages[node.name] = node.compute_message(t_node.name)
-                if self.count_none_messages(t_node) <= 1:
-                    q.put(t_node)
+        # Perform the belief propagation algorithm, by replaying the compiled schedule.
+        for node, t_node in self.fg.schedule:
+            t_node.in_messages[node.name] = node.compute_message(t_node.name)
 
         # Compute the posterior over all latent states.
         self.compute_posterior_distributions()
@@ -142,25 +229,10 @@ class TemporalSlice:
         :return: nothing.
         """
         # Set the evidence of each observation.
-        for name, evidence in obs.items():
-            self.fg.set_evidence(name, evidence)
+        self.set_evidence(obs)
 
         # Perform the loopy belief propagation algorithm.
-        nodes = list(self.fg.factor_nodes()) + list(self.fg.variable_nodes())
-        max_error = 1
-        while max_error >= 1:
-            max_error = 0
-            for node in nodes:
-                for t_node in node.neighbours:
-                    msg = node.compute_message(t_node, use_default_val=True)
-                    t_node_msg = self.fg[t_node].in_messages[node.name]
-                    max_error = max(1 if t_node_msg is None else np.abs(t_node_msg - msg).max(), max_error)
-                    if isinstance(msg, np.ndarray):
-                        msg = torch.from_numpy(msg)
-                    if msg.isnan().any():
-                        exit(42)
-                    t_node = self.fg[t_node]
-                    t_node.in_messages[node.name] = msg
+        self.lbp.run(self.fg)
 
         # Compute the posterior over all latent states.
         self.compute_posterior_distributions()
@@ -169,120 +241,28 @@ class TemporalSlice:
         """
         Perform the I-step, i.e., compute the posterior beliefs using an encoder network trained using backpropagation
         :param obs: the observations made by the agent
-        :param learn: whether to learn the encoder weights
+        :param learn: whether to store the observations, so that the encoder learns from them
         :return: nothing.
         """
-        # Pre-process images
-        init_obs = copy.deepcopy(obs)
-        obs = Image.fromarray(obs.astype(np.uint8))
-        obs = obs.resize((20, 20), Image.ANTIALIAS)
-        obs = torch.from_numpy(np.array(obs)).unsqueeze(dim=0).permute(0, 3, 1, 2).type(torch.float32)
-
-        # Create encoder if it does not exist
-        if self.encoder is None:
-            n_outputs = sum([v.shape[0] for v in self.states_posterior.values()])
-            self.encoder = self.create_encoder(n_outputs)
-
-        # Compute the variational posteriors
-        shift = 0
-        posteriors = self.encoder(obs)
-        for k, posterior in self.states_posterior.items():
-            size = posterior.shape[0]
-            self.states_posterior[k] = posteriors[0, shift:shift + size]
-            shift += size
-
-        # Check whether learning must be performed
-        if not learn:
-            return
-
-        # Compute the complexity.
-        kl_div = sum([
-            kl_div_categorical(posterior, prior)
-            for prior, posterior in zip(self.states_prior.values(), self.states_posterior.values())
-        ])
-
-        # Compute the accuracy.
-        accuracies = {}
-        for obs_name in self.obs_posterior.keys():
-            accuracies[obs_name] = self.forward_prediction(
-                self.obs_likelihood[obs_name], 0, self.obs_parents[obs_name], self.states_posterior
-            )
-        print(obs.shape)
-        print(init_obs.shape)
-        print(init_obs.max())
-        print(init_obs.min())
-        print()
-        accuracy = None  # TODO get observation probability and sum them
-
-        # Compute the variational free energy
-        vfe = kl_div + accuracy
-
-        # Perform backpropagation
-        self.optimizer.zero_grad()
-        vfe.backward()
-        self.optimizer.step()
+        self.amortized_inference.infer(self, obs, learn)
 
     def compute_posterior_distributions(self):
         """
         Compute the (marginal) posterior distributions from pre-computed messages
         """
-        # Compute the posterior over all latent states.
+        # Compute the posterior over all latent states, the messages are in log space and may be batched.
         for node in self.fg.state_nodes():
-            self.states_posterior[node.name] = torch.ones_like(self.states_posterior[node.name])
+            log_posterior = 0
             for _, message in node.in_messages.items():
                 if message is None:
                     raise RuntimeError(
                         "Could not perform belief propagation: one of the message is None, which suggest that the "
                         "generative model is not a poly-tree."
                     )
-                self.states_posterior[node.name] *= message
-            normalisation = self.states_posterior[node.name].sum()
-            if normalisation == 0:
-                self.states_posterior[node.name] += 1
-            self.states_posterior[node.name] /= self.states_posterior[node.name].sum()
-
-    def get_target_nodes(self, node):
-        """
-        Get the neighbours of the input node that still requires a message
-        from the input node.
-        :param node: the input node whose neighbours must be returned.
-        :return: the neighbours that still requires a message from the input node.
-        """
-        t_nodes = []
-        for neighbour in node.in_messages.keys():
-            if not self.received_message(node.name, neighbour) and self.can_compute_message(node.name, neighbour):
-                t_nodes.append(self.fg[neighbour])
-        return t_nodes
-
-    def received_message(self, from_node, to_node):
-        """
-        Check if a message has been sent from a node to another.
-        :param from_node: the node from which the message originates.
-        :param to_node: the node that receives the message.
-        :return: True if a message has been received by "to_node" from "from_node", False otherwise.
-        """
-        return self.fg[to_node].in_messages[from_node] is not None
-
-    def can_compute_message(self, to_node, from_node):
-        """
-        Check if a message can be computed from one node to another.
-        :param from_node: the node from which the message originates.
-        :param to_node: the node that receives the message.
-        :return: True if the message from "from_node" to "to_node" can be computed, False otherwise.
-        """
-        for neighbour, message in self.fg[to_node].in_messages.items():
-            if neighbour != from_node and message is None:
-                return False
-        return True
-
-    @staticmethod
-    def count_none_messages(node):
-        """
-        Count the number of messages not received by the input node yet.
-        :param node: the input node.
-        :return: the number of messages not received yet.
-        """
-        return sum(map(lambda value: value is None, node.in_messages.values()))
+                log_posterior = log_posterior + message
+            impossible = torch.isneginf(log_posterior).all(dim=-1, keepdim=True)
+            log_posterior = torch.where(impossible, torch.zeros_like(log_posterior), log_posterior)
+            self.states_posterior[node.name] = torch.softmax(log_posterior, dim=-1)
 
     def p_step(self, action):
         """
@@ -294,14 +274,15 @@ class TemporalSlice:
         next_ts = TemporalSlice(
             self.fg, self.n_actions, self.action_name, self.obs_prior_pref,
             self.obs_likelihood, self.states_prior, self.states_transition,
-            self.states_parents, self.obs_parents
+            self.states_parents, self.obs_parents, self.obs_groups, self.entropy_cache,
+            self.amortized_inference, self.lbp
         )
         next_ts.action = action
         next_ts.parent = self
         self.children.append(next_ts)
 
         # Create a one hot encoding of the action.
-        action = torch.squeeze(one_hot(torch.tensor([action]), self.n_actions))
+        action = torch.squeeze(one_hot(torch.tensor([action]), self.n_actions)).float()
 
         # Compute the posterior over the future states.
         for state_name in self.states_posterior.keys():
@@ -317,9 +298,104 @@ class TemporalSlice:
                 self.obs_parents[obs_name], next_ts.states_posterior
             )
 
+        # Compute the posterior over the future observations of each group, in one operation per group.
+        for group_name, (_, params, parents) in self.obs_groups.items():
+            next_ts.obs_group_posterior[group_name] = self.forward_prediction(
+                params, action, parents, next_ts.states_posterior, parents_dim=2
+            )
+
         return next_ts
 
-    def forward_prediction(self, params, action, parents, posteriors):
+    def expand(self, children_posteriors=None):
+        """
+        Perform the P-step for all actions at once, i.e., the action axis of the mappings is batched so that each
+        random variable is predicted by a single contraction for all the children of the temporal slice.
+        :param children_posteriors: the batched posteriors of the children returned by predict_all_actions, if they
+            are already known (e.g., from a transposition table), None if they must be computed.
+        :return: the children created.
+        """
+        # Create one new temporal slice per action.
+        children = []
+        for action in range(self.n_actions):
+            child = TemporalSlice(
+                self.fg, self.n_actions, self.action_name, self.obs_prior_pref,
+                self.obs_likelihood, self.states_prior, self.states_transition,
+                self.states_parents, self.obs_parents, self.obs_groups, self.entropy_cache,
+                self.amortized_inference, self.lbp
+            )
+            child.action = action
+            child.parent = self
+            children.append(child)
+        self.children += children
+
+        # Compute the posteriors of all the children at once, unless they are already known.
+        if children_posteriors is None:
+            children_posteriors = self.predict_all_actions(self.states_posterior)
+        states_posterior, obs_posterior, obs_group_posterior = children_posteriors
+
+        # Give each child a view of its posteriors, the batched posteriors are kept to evaluate the children at once.
+        for action, child in enumerate(children):
+            child.states_posterior = {k: v[action] for k, v in states_posterior.items() if k != self.action_name}
+            child.obs_posterior = {k: v[action] for k, v in obs_posterior.items()}
+            child.obs_group_posterior = {k: v[action] for k, v in obs_group_posterior.items()}
+        self.children_posteriors = (states_posterior, obs_posterior, obs_group_posterior)
+        return children
+
+    def predict_all_actions(self, states_posterior):
+        """
+        Compute the posteriors over the future states and observations of all actions at once, i.e., the current
+        posteriors are shared across actions and the actions are given as a batch of one hot vectors
+        :param states_posterior: the posterior over the current states, or a batch of posteriors over the states of
+            several temporal slices where the first dimension indexes the temporal slices
+        :return: a tuple containing the batched posteriors over the future states (with the batch of actions), the
+            future observations and the future observations of each group, the first dimension indexes the actions
+            (of each temporal slice, i.e., the i-th element corresponds to the action i % n_actions)
+        """
+        # Create a batch of posteriors, where the i-th element of the batch corresponds to the i-th action.
+        n_slices = 1
+        posteriors = {}
+        for k, v in states_posterior.items():
+            if v.dim() == 1:
+                posteriors[k] = v.expand(self.n_actions, -1)
+            else:
+                n_slices = v.shape[0]
+                posteriors[k] = v.repeat_interleave(self.n_actions, dim=0)
+        actions = torch.eye(self.n_actions).repeat(n_slices, 1)
+        posteriors[self.action_name] = actions
+
+        # Compute the posterior over the future states for all actions.
+        next_states_posterior = {
+            state_name: self.batched_forward_prediction(
+                self.states_transition[state_name], self.states_parents[state_name], posteriors
+            ) for state_name in states_posterior.keys()
+        }
+        next_states_posterior[self.action_name] = actions
+
+        # Compute the posterior over the future observations for all actions.
+        obs_posterior = {
+            obs_name: self.batched_forward_prediction(
+                self.obs_likelihood[obs_name], self.obs_parents[obs_name], next_states_posterior
+            ) for obs_name in self.obs_likelihood.keys()
+        }
+        obs_group_posterior = {
+            group_name: self.batched_forward_prediction(params, parents, next_states_posterior, parents_dim=2)
+            for group_name, (_, params, parents) in self.obs_groups.items()
+        }
+        return next_states_posterior, obs_posterior, obs_group_posterior
+
+    def batched_forward_prediction(self, params, parents, posteriors, parents_dim=1):
+        """
+        Compute the forward prediction of the posterior over a random variable for a batch of posteriors
+        :param params: the parameters of the mapping
+        :param parents: the parents of the random variable
+        :param posteriors: the batch of posteriors over the parents, the first dimension indexes the batch
+        :param parents_dim: the dimension of the parameters corresponding to the first parent
+        :return: the batch of predictive posteriors of the random variable
+        """
+        operands = [(posteriors[parent], [i + parents_dim]) for i, parent in enumerate(parents)]
+        return Contraction.contract_batch(params, operands)
+
+    def forward_prediction(self, params, action, parents, posteriors, parents_dim=1):
         """
         Compute the forward prediction of the posterior over a random variable assuming
         a particular mapping and action
@@ -327,68 +403,167 @@ class TemporalSlice:
         :param action: the action taken
         :param parents: the parents of the random variable  named 'dest_name'
         :param posteriors: the posterior over the parents
+        :param parents_dim: the dimension of the parameters corresponding to the first parent, i.e., 2 for the
+            stacked parameters of an observation group and 1 otherwise
         :return: the predictive posterior of the random variable named 'dest_name'
         """
-        for parent in reversed(parents):
-            posterior = action if parent == self.action_name else posteriors[parent]
-            i = parents.index(parent)
-            params = Operators.average(params, posterior, [i + 1])
-        return params
+        operands = [
+            (action if parent == self.action_name else posteriors[parent], [i + parents_dim])
+            for i, parent in enumerate(parents)
+        ]
+        return Contraction.contract(params, operands)
+
+    def get_obs_posterior(self, rv_name):
+        """
+        Getter.
+        :param rv_name: the name of an observation random variable, which may belong to an observation group.
+        :return: the posterior over the observation.
+        """
+        if rv_name in self.obs_group_index.keys():
+            group_name, i = self.obs_group_index[rv_name]
+            return self.obs_group_posterior[group_name][i]
+        return self.obs_posterior[rv_name]
 
     def efe(self, n_samples=1):
         """
-        Compute the expected free energy of the temporal slice
+        Compute the expected free energy of the temporal slice, the result is memoized so that the posteriors are
+        evaluated (and sampled) only once per number of samples
         :param n_samples: the number of samples to use to compute the risk, -1 if an analytical solution must be used
         :return: the expected free energy
         """
-        return sum(self.compute_risk_terms(n_samples)) + sum(self.compute_ambiguity_terms(n_samples))
+        if n_samples not in self.efe_values.keys():
+            efe = self.compute_risk_terms(n_samples).sum() + self.compute_ambiguity_terms(n_samples).sum()
+            self.efe_values[n_samples] = efe.item()
+        return self.efe_values[n_samples]
 
-    def compute_risk_terms(self, n_samples=-1):
+    def children_efe(self, n_samples=-1, efe=None):
         """
-        Compute all the risk terms of the expected free energy
-        :param n_samples: the number of samples to use to compute the risk, -1 if an analytical solution must be used
-        :return: all the risk terms
+        Compute the expected free energy of all the children created by the last expansion at once, the result of
+        each child is memoized on the child
+        :param n_samples: the number of samples to use to compute the efe, -1 if an analytical solution must be used
+        :param efe: the expected free energy of the children, if it is already known (e.g., from a transposition
+            table), None if it must be computed
+        :return: a tensor containing the expected free energy of each child, indexed by action
         """
-        risk_terms = []
-        processed_modalities = []
+        if self.children_posteriors is None:
+            raise Exception("In TemporalSlice::children_efe, the temporal slice has not been expanded.")
+        if efe is None:
+            efe = self.batched_efe(self.children_posteriors, n_samples)
 
-        # For each modality.
-        for obs_name, (rv_names, prior_pref) in self.obs_prior_pref.items():
+        # Memoize the expected free energy of the children.
+        for child, child_efe in zip(self.children[-self.n_actions:], efe.tolist()):
+            child.efe_values[n_samples] = child_efe
+        return efe
 
-            # Check if the risk term of this modality has already been computed.
-            if obs_name in processed_modalities:
-                continue
+    def model_version(self):
+        """
+        Getter.
+        :return: the versions of the likelihood and transition mappings, which change when the mappings are modified
+            in-place (e.g., by Dirichlet learning).
+        """
+        mappings = list(self.obs_likelihood.values()) + list(self.states_transition.values()) + \
+            [params for _, params, _ in self.obs_groups.values()]
+        return tuple(params._version for params in mappings)
 
-            # Compute the posterior over the subset of observations.
+    def batched_efe(self, posteriors, n_samples=-1):
+        """
+        Compute the expected free energy of a batch of temporal slices
+        :param posteriors: the batched posteriors returned by predict_all_actions
+        :param n_samples: the number of samples to use to compute the efe, -1 if an analytical solution must be used
+        :return: a tensor containing the expected free energy of each element of the batch
+        """
+        states_posterior, obs_posterior, obs_group_posterior = posteriors
+        batch_size = states_posterior[self.action_name].shape[0]
+        efe = torch.zeros(batch_size)
+
+        # Add the risk terms of each modality.
+        for rv_names, prior_pref in self.get_preferences():
+
+            # Compute the batch of posteriors over the subset of observations.
             subset_posterior = None
             for rv_name in rv_names:
+                if rv_name in self.obs_group_index.keys():
+                    group_name, i = self.obs_group_index[rv_name]
+                    rv_posterior = obs_group_posterior[group_name][:, i]
+                else:
+                    rv_posterior = obs_posterior[rv_name]
                 if subset_posterior is None:
-                    subset_posterior = self.obs_posterior[rv_name]
+                    subset_posterior = rv_posterior
                 else:
-                    rv_posterior = self.obs_posterior[rv_name]
-                    subset_posterior = torch.outer(subset_posterior, rv_posterior)
-                    subset_posterior = subset_posterior.view(-1)
+                    subset_posterior = subset_posterior.unsqueeze(dim=2) * rv_posterior.unsqueeze(dim=1)
+                    subset_posterior = subset_posterior.view(batch_size, -1)
 
             # Compute the risk term of the expected free energy.
+            log_prior_pref = prior_pref.log().view(-1)
             if n_samples == -1:
                 # Using an analytical solution
-                risk = subset_posterior * (subset_posterior.log() - prior_pref.log().view(-1))
-                risk = risk.sum()
+                efe += (subset_posterior * (subset_posterior.log() - log_prior_pref)).sum(dim=1)
             else:
                 # Using sampling
-                risk = []
-                for _ in range(n_samples):
-                    i = random.choices(range(len(subset_posterior)), subset_posterior)
-                    risk.append(subset_posterior.log()[i] - prior_pref.log()[i])
-                risk = sum(risk) / len(risk)
+                indices = torch.multinomial(subset_posterior, n_samples, replacement=True)
+                efe += (subset_posterior.log().gather(1, indices) - log_prior_pref[indices]).mean(dim=1)
 
-            # Save risk term.
-            risk_terms.append(risk.item())
+        # Add the ambiguity terms of each modality and each group of modalities.
+        for params, entropies, parents in self.get_modalities():
+            if n_samples == -1:
+                # Using an analytical solution, i.e., average the (cached) entropy of each likelihood over the parents
+                ambiguities = Contraction.contract_batch(entropies, [
+                    (states_posterior[parent], [i + 1]) for i, parent in enumerate(parents)
+                ])
+                efe += ambiguities.sum(dim=1)
+            else:
+                # Using sampling, i.e., the parents values are shared across the modalities of a group
+                indices = [
+                    torch.multinomial(states_posterior[parent], n_samples, replacement=True) for parent in parents
+                ]
+                likelihoods = self.select_parents(params, indices).permute(0, 2, 3, 1)
+                likelihoods = likelihoods.reshape(-1, params.shape[1])
+                obs = torch.multinomial(likelihoods, 1)
+                ambiguities = - likelihoods.gather(1, obs).log().view(params.shape[0], batch_size, n_samples)
+                efe += ambiguities.mean(dim=2).sum(dim=0)
+
+        return efe
 
-            # Add the random variable of the subset to the list of processed modalities.
-            processed_modalities += rv_names
+    @staticmethod
+    def select_parents(params, indices):
+        """
+        Getter.
+        :param params: the stacked likelihood mappings of a group of modalities.
+        :param indices: the sampled values of the parents, one index tensor per parent.
+        :return: the likelihoods of the modalities for the sampled values, the structured noise tensors only
+            materialize the sampled columns.
+        """
+        if isinstance(params, StructuredNoiseTensor):
+            return params.gather_trailing(indices)
+        return params[(slice(None), slice(None), *indices)]
+
+    def compute_risk_terms(self, n_samples=-1):
+        """
+        Compute all the risk terms of the expected free energy
+        :param n_samples: the number of samples to use to compute the risk, -1 if an analytical solution must be used
+        :return: a tensor containing all the risk terms
+        """
+        risk_terms = []
+        for rv_names, prior_pref in self.get_preferences():
+
+            # Compute the posterior over the subset of observations.
+            subset_posterior = self.get_subset_posterior(rv_names)
+            log_posterior = subset_posterior.log()
+            log_prior_pref = prior_pref.log().view(-1)
 
-        return risk_terms
+            # Compute the risk term of the expected free energy.
+            if n_samples == -1:
+                # Using an analytical solution
+                risk = (subset_posterior * (log_posterior - log_prior_pref)).sum()
+            else:
+                # Using sampling, i.e., all the samples are drawn at once
+                indices = torch.multinomial(subset_posterior, n_samples, replacement=True)
+                risk = (log_posterior[indices] - log_prior_pref[indices]).mean()
+
+            # Save risk term.
+            risk_terms.append(risk)
+
+        return torch.stack(risk_terms) if len(risk_terms) != 0 else torch.zeros([0])
 
     def reward(self, n_samples=-1):
         """
@@ -396,111 +571,96 @@ class TemporalSlice:
         :param n_samples: the number of samples to use to compute the risk, -1 if an analytical solution must be used
         :return: the sum of all rewards obtained by the agent
         """
-        rewards = []
-        processed_modalities = []
-
-        # For each modality.
-        for obs_name, (rv_names, prior_pref) in self.obs_prior_pref.items():
-
-            # Check if the reward of this modality has already been computed.
-            if obs_name in processed_modalities:
-                continue
+        reward = torch.zeros([])
+        for rv_names, prior_pref in self.get_preferences():
 
             # Compute the posterior over the subset of observations.
-            subset_posterior = None
-            for rv_name in rv_names:
-                if subset_posterior is None:
-                    subset_posterior = self.obs_posterior[rv_name]
-                else:
-                    rv_posterior = self.obs_posterior[rv_name]
-                    subset_posterior = torch.outer(subset_posterior, rv_posterior)
-                    subset_posterior = subset_posterior.view(-1)
+            subset_posterior = self.get_subset_posterior(rv_names)
+            log_prior_pref = prior_pref.log().view(-1)
 
             # Compute the reward of this modality.
             if n_samples == -1:
                 # Using an analytical solution
-                reward = subset_posterior * (- prior_pref.log().view(-1))
-                reward = reward.sum()
+                reward = reward - (subset_posterior * log_prior_pref).sum()
             else:
-                # Using sampling
-                reward = []
-                for _ in range(n_samples):
-                    i = random.choices(range(len(subset_posterior)), subset_posterior)
-                    reward.append(- prior_pref.log()[i])
-                reward = sum(reward) / len(reward)
+                # Using sampling, i.e., all the samples are drawn at once
+                indices = torch.multinomial(subset_posterior, n_samples, replacement=True)
+                reward = reward - log_prior_pref[indices].mean()
 
-            # Save risk term.
-            rewards.append(reward.item())
+        return reward.item()
 
-            # Add the random variable of the subset to the list of processed modalities.
+    def get_preferences(self):
+        """
+        Getter.
+        :return: a list of pairs (names of the observations, prior preferences), i.e., one pair per subset of
+            observations over which prior preferences are defined.
+        """
+        preferences = []
+        processed_modalities = []
+        for obs_name, (rv_names, prior_pref) in self.obs_prior_pref.items():
+            # Check if this subset of modalities has already been processed.
+            if obs_name in processed_modalities:
+                continue
+            preferences.append((rv_names, prior_pref))
             processed_modalities += rv_names
+        return preferences
 
-        return sum(rewards)
+    def get_subset_posterior(self, rv_names):
+        """
+        Getter.
+        :param rv_names: the names of a subset of observations.
+        :return: the (flattened) posterior over the subset of observations.
+        """
+        subset_posterior = None
+        for rv_name in rv_names:
+            if subset_posterior is None:
+                subset_posterior = self.get_obs_posterior(rv_name)
+            else:
+                rv_posterior = self.get_obs_posterior(rv_name)
+                subset_posterior = torch.outer(subset_posterior, rv_posterior)
+                subset_posterior = subset_posterior.view(-1)
+        return subset_posterior
+
+    def get_modalities(self):
+        """
+        Getter.
+        :return: a list of triples (stacked likelihood mappings, stacked entropies, parents), where the first
+            dimension of the stacked tensors indexes the modalities, i.e., each observation group is a triple and each
+            observation that does not belong to a group is a triple containing a single modality.
+        """
+        return [(
+            self.obs_likelihood[obs_name].unsqueeze(dim=0),
+            self.entropy_cache.get(self.obs_likelihood[obs_name], dim=0).unsqueeze(dim=0),
+            self.obs_parents[obs_name]
+        ) for obs_name in self.obs_likelihood.keys()] + [
+            (params, self.entropy_cache.get(params, dim=1), parents) for _, params, parents in self.obs_groups.values()
+        ]
 
     def compute_ambiguity_terms(self, n_samples=-1):
         """
         Compute the all the ambiguity terms of the expected free energy
         :param n_samples: the number of samples to use to compute the risk, -1 if an analytical solution must be used
-        :return: the sum of all ambiguity terms
+        :return: a tensor containing all the ambiguity terms
         """
         ambiguity_terms = []
-
-        # For each modality.
-        for obs_name in self.obs_likelihood.keys():
-            # Compute the ambiguity.
-            ambiguity = - self.obs_likelihood[obs_name].log()
+        for params, entropies, parents in self.get_modalities():
             if n_samples == -1:
-                # Using an analytical solution
-                ambiguity = Operators.average(
-                    ambiguity, self.obs_likelihood[obs_name],
-                    [i for i in range(ambiguity.dim())],
-                    [i for i in range(1, ambiguity.dim())]
-                )
-                for parent in reversed(self.obs_parents[obs_name]):
-                    i = self.obs_parents[obs_name].index(parent)
-                    ambiguity = Operators.average(ambiguity, self.states_posterior[parent], [i])
+                # Using an analytical solution, i.e., average the (cached) entropy of each likelihood over the parents
+                ambiguities = Contraction.contract(entropies, [
+                    (self.states_posterior[parent], [i + 1]) for i, parent in enumerate(parents)
+                ])
             else:
-                # Using sampling
-                ambiguities = []
-                for _ in range(n_samples):
-                    a = ambiguity
-                    log_a = self.obs_likelihood[obs_name]
-                    length = len(ambiguity.shape)
-                    for j, max_i in enumerate(reversed(ambiguity.shape)):
-                        j_tmp = length - j - 1
-                        i = random.choices(
-                            range(0, max_i),
-                            log_a if j_tmp == 0 else self.states_posterior[self.obs_parents[obs_name][j_tmp - 1]]
-                        )
-                        a = torch.index_select(a, j_tmp, torch.tensor(i))
-                        log_a = torch.index_select(log_a, j_tmp, torch.tensor(i))
-                    ambiguities.append(a)
-                ambiguity = sum(ambiguities) / len(ambiguities)
-
-            # Save the ambiguity term.
-            ambiguity_terms.append(ambiguity.item())
-
-        return ambiguity_terms
-
-    @staticmethod
-    def create_encoder(n_outputs):
-        """
-        Create the encoder network
-        :param n_outputs: the number of output neurons
-        :return: the encoder network
-        """
-        return nn.Sequential(
-            nn.Conv2d(3, 32, (3, 3), stride=(2, 2), padding=1),
-            nn.ReLU(),
-            nn.Conv2d(32, 64, (3, 3), stride=(2, 2), padding=1),
-            nn.ReLU(),
-            nn.Conv2d(64, 64, (3, 3), stride=(2, 2), padding=1),
-            nn.ReLU(),
-            nn.Flatten(start_dim=1),
-            nn.Linear(576, 256),
-            nn.ReLU(),
-            nn.Linear(256, 256),
-            nn.ReLU(),
-            nn.Linear(256, n_outputs),
-            nn.Softmax(),
-        )
+                # Using sampling, i.e., the samples of all modalities are drawn at once, and the parents values are
+                # shared across the modalities
+                indices = [
+                    torch.multinomial(self.states_posterior[parent], n_samples, replacement=True) for parent in parents
+                ]
+                likelihoods = self.select_parents(params, indices).permute(0, 2, 1)
+                likelihoods = likelihoods.reshape(-1, params.shape[1])
+                obs = torch.multinomial(likelihoods, 1)
+                ambiguities = - likelihoods.gather(1, obs).log().view(params.shape[0], n_samples).mean(dim=1)
+
+            # Save the ambiguity terms.
+            ambiguity_terms.append(ambiguities)
+
+        return torch.cat(ambiguity_terms)
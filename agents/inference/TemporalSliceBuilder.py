@@ -1,5 +1,14 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+import torch
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
 from agents.inference.TemporalSlice import TemporalSlice
 from agents.graph.FactorGraph import FactorGraph
+from agents.graph.LoopyBeliefPropagation import LoopyBeliefPropagation
 
 
 class TemporalSliceBuilder:
@@ -8,6 +17,9 @@ class TemporalSliceBuilder:
     actions and observations.
     """
 
+    # The version of the format of the saved models, models saved using another format are not loaded.
+    FORMAT_VERSION = 1
+
     def __init__(self, action_name, n_actions):
         """
         Construct the temporal slice builder.
@@ -30,10 +42,17 @@ class TemporalSliceBuilder:
         self.obs_likelihood = {}
         self.obs_prior_pref = {}
 
+        # The groups of observations sharing the same parents, i.e., a mapping from the group name to the names of
+        # the observations in the group, their stacked likelihood tensors, and their parents.
+        self.obs_groups = {}
+
         # The parents of each state and the corresponding transition tensor.
         self.states_parents = {}
         self.states_transition = {}
 
+        # The hyper-parameters of the loopy belief propagation engine used by the I-step.
+        self.lbp_params = {}
+
     def add_state(self, rv_name, params):
         """
         Add a latent state to the temporal slice.
@@ -62,7 +81,7 @@ class TemporalSliceBuilder:
             raise Exception("An observation must have at least one parent")
         if rv_name[0:2] != "O_":
             raise Exception("Observation name is invalid: name must start with 'O_'.")
-        if rv_name in self.obs_likelihood.keys():
+        if self.observation_exists(rv_name):
             raise Exception("Observation name already exists in the temporal slice.")
         if len(params.shape) != len(parents) + 1:
             raise Exception("Likelihood parameters must be a {}D-tensor.".format(len(parents) + 1))
@@ -70,6 +89,44 @@ class TemporalSliceBuilder:
         self.obs_parents[rv_name] = parents
         return self
 
+    def add_observation_group(self, group_name, rv_names, params, parents):
+        """
+        Add a group of observations sharing the same parents to the temporal slice, the likelihood mappings of
+        these observations are stacked in a single tensor so that they can be processed in one tensor operation.
+        :param group_name: the name of the group.
+        :param rv_names: the names of the observation random variables in the group.
+        :param params: the parameters of the likelihood mappings, the first dimension indexes the observations.
+        :param parents: a list containing the name of the parent variables of all the observations in the group.
+        :return: self.
+        """
+        if len(parents) <= 0:
+            raise Exception("An observation must have at least one parent")
+        if group_name in self.obs_groups.keys():
+            raise Exception("Observation group name already exists in the temporal slice.")
+        for rv_name in rv_names:
+            if rv_name[0:2] != "O_":
+                raise Exception("Observation name is invalid: name must start with 'O_'.")
+            if self.observation_exists(rv_name):
+                raise Exception("Observation name already exists in the temporal slice.")
+        if len(params.shape) != len(parents) + 2:
+            raise Exception("Likelihood parameters must be a {}D-tensor.".format(len(parents) + 2))
+        if params.shape[0] != len(rv_names):
+            raise Exception("The first dimension of the likelihood parameters must have a size of {}.".format(
+                len(rv_names)
+            ))
+        self.obs_groups[group_name] = (list(rv_names), params, parents)
+        return self
+
+    def observation_exists(self, rv_name):
+        """
+        Check whether an observation has already been added to the temporal slice.
+        :param rv_name: the name of the observation random variable.
+        :return: True if the observation exists, False otherwise.
+        """
+        if rv_name in self.obs_likelihood.keys():
+            return True
+        return any(rv_name in rv_names for rv_names, _, _ in self.obs_groups.values())
+
     def add_transition(self, rv_name, params, parents):
         """
         Add a transition mapping to the temporal slice.
@@ -112,6 +169,209 @@ class TemporalSliceBuilder:
             self.obs_prior_pref[rv_name] = (rv_names, prior_pref)
         return self
 
+    def set_loopy_belief_propagation(self, tolerance=1e-4, damping=0.0, max_iterations=50):
+        """
+        Set the hyper-parameters of the loopy belief propagation engine used by the I-step.
+        :param tolerance: the largest change of a message for which the messages are considered converged.
+        :param damping: the weight of the previous message in the damped message, zero means no damping.
+        :param max_iterations: the maximum number of iterations, where an iteration corresponds to as many message
+            updates as there are edges in the factor graph.
+        :return: self.
+        """
+        self.lbp_params = {"tolerance": tolerance, "damping": damping, "max_iterations": max_iterations}
+        return self
+
+    def use_structured_noise(self):
+        """
+        Store the likelihood and transition mappings as structured noise tensors, i.e., a uniform floor plus a single
+        peak per column, so that only the position of the peaks is stored and visited by the forward predictions and
+        expected free energies.
+        :return: self.
+        """
+        for name, params in self.obs_likelihood.items():
+            self.obs_likelihood[name] = StructuredNoiseTensor.from_dense(params, dim=0)
+        for name, (rv_names, params, parents) in self.obs_groups.items():
+            self.obs_groups[name] = (rv_names, StructuredNoiseTensor.from_dense(params, dim=1), parents)
+        for name, params in self.states_transition.items():
+            self.states_transition[name] = StructuredNoiseTensor.from_dense(params, dim=0)
+        return self
+
+    def save(self, directory, generator_parameters=None):
+        """
+        Save the generative model on the file system, i.e., the topology of the model is written in a json file and
+        each tensor is written in its own npy file (so that it can be memory-mapped when the model is loaded). The
+        tensor files are never overwritten, because other processes may have memory-mapped them. Instead, each save
+        writes its tensors into a new directory, which is referenced by the json file.
+        :param directory: the directory in which the model must be saved.
+        :param generator_parameters: the parameters used to generate the model (e.g., the version of the generator and
+            the noise levels), which are stored with the model so that a stale model can be detected.
+        """
+        # Write the tensors into a temporary directory, which is renamed once all the tensors have been written.
+        generator_parameters = {} if generator_parameters is None else generator_parameters
+        generator_hash = self.generator_hash(generator_parameters)
+        tensors_directory = f"tensors-{generator_hash[:12]}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.join(directory, tensors_directory + ".tmp"))
+
+        # Save the tensors of the model, each preference is shared by several observations but saved once.
+        preferences = {}
+        for rv_names, prior_pref in self.obs_prior_pref.values():
+            preferences[rv_names[0]] = (rv_names, prior_pref)
+        model = {
+            "format_version": TemporalSliceBuilder.FORMAT_VERSION,
+            "generator_parameters": generator_parameters,
+            "generator_hash": generator_hash,
+            "action_name": self.action_name,
+            "n_actions": self.n_actions,
+            "states": [
+                {"name": name, "params": self.save_tensor(directory, tensors_directory, f"prior-{name}", params)}
+                for name, params in self.states_prior.items()
+            ],
+            "transitions": [
+                {
+                    "name": name, "parents": self.states_parents[name],
+                    "params": self.save_tensor(directory, tensors_directory, f"transition-{name}", params)
+                } for name, params in self.states_transition.items()
+            ],
+            "observations": [
+                {
+                    "name": name, "parents": self.obs_parents[name],
+                    "params": self.save_tensor(directory, tensors_directory, f"likelihood-{name}", params)
+                } for name, params in self.obs_likelihood.items()
+            ],
+            "observation_groups": [
+                {
+                    "name": name, "rv_names": rv_names, "parents": parents,
+                    "params": self.save_tensor(directory, tensors_directory, f"group-{name}", params)
+                } for name, (rv_names, params, parents) in self.obs_groups.items()
+            ],
+            "preferences": [
+                {
+                    "rv_names": rv_names,
+                    "params": self.save_tensor(directory, tensors_directory, f"preference-{name}", prior_pref)
+                } for name, (rv_names, prior_pref) in preferences.items()
+            ],
+        }
+        os.replace(os.path.join(directory, tensors_directory + ".tmp"), os.path.join(directory, tensors_directory))
+
+        # Write the topology last, the file is replaced atomically so that only complete models can be loaded.
+        model_file = os.path.join(directory, "model.json")
+        temporary_file = model_file + f".{uuid.uuid4().hex[:8]}.tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(model, file, indent=2)
+        os.replace(temporary_file, model_file)
+
+        # Remove the tensors of the models generated with other parameters. The tensors of the models generated with
+        # the same parameters are kept, since they may be referenced by a model saved concurrently by another process.
+        for name in os.listdir(directory):
+            if name.startswith("tensors") and not name.startswith(f"tensors-{generator_hash[:12]}-"):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    @staticmethod
+    def save_tensor(directory, tensors_directory, name, tensor):
+        """
+        Save a tensor in the directory of a model.
+        :param directory: the directory of the model.
+        :param tensors_directory: the directory of the tensors, relative to the directory of the model, the tensor is
+            written in the temporary version of this directory (i.e., with a ".tmp" suffix).
+        :param name: the name of the tensor.
+        :param tensor: the tensor to save, which may be a structured noise tensor.
+        :return: the path of the tensor file, relative to the directory of the model, or the description of a
+            structured noise tensor (i.e., its shape, its floor, the dimension of its distributions, and the files of
+            its peaks).
+        """
+        if isinstance(tensor, StructuredNoiseTensor):
+            return {
+                "shape": list(tensor.shape),
+                "floor": tensor.floor,
+                "dim": tensor.dist_dim,
+                "peaks": TemporalSliceBuilder.save_tensor(directory, tensors_directory, f"{name}-peaks", tensor.peaks),
+                "deltas": TemporalSliceBuilder.save_tensor(
+                    directory, tensors_directory, f"{name}-deltas", tensor.deltas
+                ),
+            }
+        tensor_file = os.path.join(tensors_directory + ".tmp", f"{name}.npy")
+        np.save(os.path.join(directory, tensor_file), tensor.detach().cpu().contiguous().numpy())
+        return os.path.join(tensors_directory, f"{name}.npy")
+
+    @staticmethod
+    def generator_hash(generator_parameters):
+        """
+        Getter.
+        :param generator_parameters: the parameters used to generate a model.
+        :return: the hash of the parameters.
+        """
+        return hashlib.sha1(json.dumps(generator_parameters, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def exists(directory, generator_parameters=None):
+        """
+        Check whether an up-to-date generative model has been saved in a directory.
+        :param directory: the directory of the model.
+        :param generator_parameters: the parameters that must have been used to generate the model, None to accept a
+            model generated with any parameters.
+        :return: True if the model exists, was saved in the current format and was generated with the requested
+            parameters, False otherwise.
+        """
+        model_file = os.path.join(directory, "model.json")
+        if not os.path.exists(model_file):
+            return False
+        with open(model_file) as file:
+            model = json.load(file)
+        if model.get("format_version", None) != TemporalSliceBuilder.FORMAT_VERSION:
+            return False
+        if generator_parameters is None:
+            return True
+        return model.get("generator_hash", None) == TemporalSliceBuilder.generator_hash(generator_parameters)
+
+    @staticmethod
+    def load(directory, mmap=True):
+        """
+        Load a generative model from the file system.
+        :param directory: the directory of the model.
+        :param mmap: whether to memory-map the tensors, the mapping is copy-on-write so the tensors can be modified
+            (e.g., learned) without modifying the files.
+        :return: the builder of the temporal slice.
+        """
+        with open(os.path.join(directory, "model.json")) as file:
+            model = json.load(file)
+
+        # Add the random variables and tensors to the builder.
+        builder = TemporalSliceBuilder(model["action_name"], model["n_actions"])
+        for state in model["states"]:
+            params = TemporalSliceBuilder.load_tensor(directory, state["params"], mmap)
+            builder.add_state(state["name"], params)
+        for transition in model["transitions"]:
+            params = TemporalSliceBuilder.load_tensor(directory, transition["params"], mmap)
+            builder.add_transition(transition["name"], params, transition["parents"])
+        for obs in model["observations"]:
+            params = TemporalSliceBuilder.load_tensor(directory, obs["params"], mmap)
+            builder.add_observation(obs["name"], params, obs["parents"])
+        for group in model["observation_groups"]:
+            params = TemporalSliceBuilder.load_tensor(directory, group["params"], mmap)
+            builder.add_observation_group(group["name"], group["rv_names"], params, group["parents"])
+        for preference in model["preferences"]:
+            params = TemporalSliceBuilder.load_tensor(directory, preference["params"], mmap)
+            builder.add_preference(preference["rv_names"], params)
+        return builder
+
+    @staticmethod
+    def load_tensor(directory, tensor_file, mmap=True):
+        """
+        Load a tensor from the directory of a model.
+        :param directory: the directory of the model.
+        :param tensor_file: the path of the tensor file, relative to the directory of the model, or the description
+            of a structured noise tensor.
+        :param mmap: whether to memory-map the tensor (copy-on-write).
+        :return: the tensor.
+        """
+        if isinstance(tensor_file, dict):
+            peaks = TemporalSliceBuilder.load_tensor(directory, tensor_file["peaks"], mmap)
+            deltas = TemporalSliceBuilder.load_tensor(directory, tensor_file["deltas"], mmap)
+            return StructuredNoiseTensor(
+                tensor_file["shape"], tensor_file["floor"], tensor_file["dim"], peaks, deltas
+            )
+        return torch.from_numpy(np.load(os.path.join(directory, tensor_file), mmap_mode="c" if mmap else None))
+
     def build(self):
         """
         Build the temporal slice.
@@ -126,16 +386,29 @@ class TemporalSliceBuilder:
             fg.add_variable(obs)
             fg.add_factor("f_" + obs, [obs] + self.obs_parents[obs], self.obs_likelihood[obs])
             fg.add_evidence_placeholder(obs)
+        for rv_names, params, parents in self.obs_groups.values():
+            for i, obs in enumerate(rv_names):
+                fg.add_variable(obs)
+                fg.add_factor("f_" + obs, [obs] + parents, params[i])
+                fg.add_evidence_placeholder(obs)
+
+        # Compile the schedule of belief propagation, the schedule is None if the factor graph contains loops.
+        fg.compile_schedule()
 
         # Create the temporal slice.
-        if len(self.obs_likelihood) == 0 or len(self.obs_parents) == 0:
+        if len(self.obs_likelihood) == 0 and len(self.obs_groups) == 0:
             raise Exception("No observation has been added to the temporal slice.")
         if len(self.states_prior) == 0 or len(self.states_parents) == 0:
             raise Exception("No state has been added to the temporal slice.")
         if len(self.states_prior) != len(self.states_transition):
             raise Exception("The number of transitions must equal the number of states.")
-        return TemporalSlice(
+        ts = TemporalSlice(
             fg, self.n_actions, self.action_name, self.obs_prior_pref,
             self.obs_likelihood, self.states_prior, self.states_transition,
-            self.states_parents, self.obs_parents
+            self.states_parents, self.obs_parents, self.obs_groups,
+            lbp=LoopyBeliefPropagation(**self.lbp_params)
         )
+
+        # Pre-compute the entropy of the likelihood mappings, which are shared by all the temporal slices.
+        ts.get_modalities()
+        return ts
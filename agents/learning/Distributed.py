@@ -0,0 +1,98 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_process_group(backend=None):
+    """
+    Initialise the distributed training, if the process was launched with several tasks (e.g., by torchrun or srun).
+    :param backend: the backend to use, by default nccl if a gpu is available and gloo otherwise.
+    :return: True if the training is distributed, False otherwise.
+    """
+    n_processes = world_size()
+    if n_processes <= 1:
+        return False
+
+    # The first node of the allocation must be provided by the launcher when training on several nodes.
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "29500")
+    if backend is None:
+        backend = "nccl" if torch.cuda.is_available() else "gloo"
+    dist.init_process_group(backend, rank=rank(), world_size=n_processes)
+    return True
+
+
+def destroy_process_group():
+    """
+    Terminate the distributed training, if it was initialised.
+    """
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def rank():
+    """
+    Getter.
+    :return: the index of the current process among all processes.
+    """
+    if dist.is_initialized():
+        return dist.get_rank()
+    return int(os.environ.get("RANK", os.environ.get("SLURM_PROCID", 0)))
+
+
+def local_rank():
+    """
+    Getter.
+    :return: the index of the current process among the processes running on the same node.
+    """
+    return int(os.environ.get("LOCAL_RANK", os.environ.get("SLURM_LOCALID", 0)))
+
+
+def world_size():
+    """
+    Getter.
+    :return: the number of processes taking part in the training.
+    """
+    if dist.is_initialized():
+        return dist.get_world_size()
+    return int(os.environ.get("WORLD_SIZE", os.environ.get("SLURM_NTASKS", 1)))
+
+
+def is_main_process():
+    """
+    Check whether the current process is in charge of logging and saving the agent.
+    :return: True if the current process is the main process, False otherwise.
+    """
+    return rank() == 0
+
+
+def broadcast_parameters(modules):
+    """
+    Copy the parameters and buffers of the main process into the modules of all the other processes.
+    :param modules: the modules whose parameters must be broadcast.
+    """
+    if not dist.is_initialized():
+        return
+    for module in modules:
+        for tensor in module.state_dict().values():
+            dist.broadcast(tensor, 0)
+
+
+def all_reduce_gradients(modules):
+    """
+    Average the gradients of the modules across all processes, the gradients are flattened in a single buffer so
+    that only one all-reduce is performed.
+    :param modules: the modules whose gradients must be averaged.
+    """
+    if not dist.is_initialized():
+        return
+    grads = [param.grad for module in modules for param in module.parameters() if param.grad is not None]
+    if len(grads) == 0:
+        return
+    buffer = torch.cat([grad.view(-1) for grad in grads])
+    dist.all_reduce(buffer)
+    buffer /= dist.get_world_size()
+    shift = 0
+    for grad in grads:
+        grad.copy_(buffer[shift:shift + grad.numel()].view_as(grad))
+        shift += grad.numel()
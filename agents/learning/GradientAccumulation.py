@@ -0,0 +1,12 @@
+def micro_batches(batch, micro_batch_size):
+    """
+    Split a batch into micro-batches whose gradients can be accumulated before performing one optimizer step.
+    :param batch: a list of tensors sharing the same first (batch) dimension.
+    :param micro_batch_size: the maximum number of samples in each micro-batch.
+    :return: a generator of (micro-batch, weight) pairs, where the weight is the fraction of the batch contained in the
+        micro-batch, i.e., the factor by which the (mean) loss of the micro-batch must be multiplied.
+    """
+    batch_size = batch[0].shape[0]
+    for start in range(0, batch_size, micro_batch_size):
+        micro_batch = [tensor[start:start + micro_batch_size] for tensor in batch]
+        yield micro_batch, micro_batch[0].shape[0] / batch_size
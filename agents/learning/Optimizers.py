@@ -1,3 +1,4 @@
+import math
 from torch.optim import Adam
 
 
@@ -12,3 +13,19 @@ def get_adam(modules, lr):
     for module in modules:
         params += list(module.parameters())
     return Adam(params, lr=lr)
+
+
+def scale_lr(lr, batch_size, scaling="None", base_batch_size=32):
+    """
+    Scale the learning rate according to the batch size.
+    :param lr: the learning rate tuned for the base batch size.
+    :param batch_size: the batch size actually used for training.
+    :param scaling: the scaling rule, i.e., "None", "Linear" or "Square root".
+    :param base_batch_size: the batch size for which the learning rate was tuned.
+    :return: the scaled learning rate.
+    """
+    if scaling == "Linear":
+        return lr * batch_size / base_batch_size
+    if scaling == "Square root":
+        return lr * math.sqrt(batch_size / base_batch_size)
+    return lr
@@ -1,7 +1,6 @@
 from torch.distributions.multivariate_normal import MultivariateNormal
 from torch import zeros, eye
 import torch
-from hosts.HostInterface import HostInterface
 
 
 def re_parameterize(mean, log_var):
@@ -12,8 +11,7 @@ def re_parameterize(mean, log_var):
     :return: a sample from the Gaussian on which back-propagation can be performed
     """
     nb_states = mean.shape[1]
-    device = HostInterface.get_device()
-    epsilon = MultivariateNormal(zeros(nb_states), eye(nb_states)).sample([mean.shape[0]]).to(device)
+    epsilon = MultivariateNormal(zeros(nb_states), eye(nb_states)).sample([mean.shape[0]]).to(mean.device)
     return epsilon * torch.exp(0.5 * log_var) + mean
 
 
@@ -56,7 +54,7 @@ def kl_div_categorical(q_probs=None, p_probs=None, q_weights=None, p_weights=Non
     return (log_q_probs - log_p_probs).inner(q_probs)
 
 
-def compute_info_gain(g_value, mean_hat, log_var_hat, mean, log_var):
+def compute_info_gain(g_value, mean_hat, log_var_hat, mean, log_var, sum_dims=None):
     """
     Compute the efe.
     :param g_value: the definition of the efe to use, i.e., reward, efe_0, efe_1,
@@ -65,11 +63,12 @@ def compute_info_gain(g_value, mean_hat, log_var_hat, mean, log_var):
     :param log_var_hat: the log variance from the encoder.
     :param mean: the mean from the transition.
     :param log_var: the log variance from the transition.
+    :param sum_dims: the dimensions along which to sum over before to return, by default the batch average is returned
     :return: the efe.
     """
-    efe = torch.zeros([1]).to(HostInterface.get_device())
+    efe = torch.zeros([1]).to(mean.device)
     if g_value == "Expected Free Energy":
-        efe = kl_div_gaussian(mean, log_var, mean_hat, log_var_hat)
+        efe = kl_div_gaussian(mean, log_var, mean_hat, log_var_hat, sum_dims=sum_dims)
     return efe
 
 
@@ -1,6 +1,6 @@
 import collections
 import numpy as np
-from torch import cat, FloatTensor, BoolTensor, IntTensor, unsqueeze
+from torch import stack, as_tensor, FloatTensor, BoolTensor, IntTensor
 from hosts.HostInterface import HostInterface
 
 
@@ -15,12 +15,14 @@ Experience = collections.namedtuple('Experience', field_names=['obs', 'action',
 #
 class ReplayBuffer:
 
-    def __init__(self, capacity=10000, batch_size=32):
+    def __init__(self, capacity=10000, batch_size=32, device=None):
         """
         Constructor
         :param capacity: the number of experience the buffer can store
+        :param batch_size: the default size of the sampled batches
+        :param device: the device on which the batches are returned, None to use the device of the process
         """
-        self.__device = HostInterface.get_device()
+        self.__device = HostInterface.get_device() if device is None else device
         self.__buffer = collections.deque(maxlen=capacity)
         self.batch_size = batch_size
 
@@ -42,11 +44,11 @@ class ReplayBuffer:
     @staticmethod
     def list_to_tensor(tensor_list):
         """
-        Transform a list of n dimensional tensors into a tensor with n+1 dimensions
+        Transform a list of n dimensional tensors (or arrays) into a tensor with n+1 dimensions
         :param tensor_list: the list of tensors
         :return: the output tensor
         """
-        return cat([unsqueeze(tensor, 0) for tensor in tensor_list])
+        return stack([as_tensor(tensor) for tensor in tensor_list])
 
     def sample(self, batch_size=None):
         """
@@ -0,0 +1,440 @@
+import math
+import time
+import numpy
+import torch
+from agents.planning.MCTS import MCTS
+
+
+class ArrayMCTS(MCTS):
+    """
+    Class implementing the Monte-Carlo tree search algorithm, where the tree is stored in preallocated arrays instead
+    of a tree of temporal slices. A node is an index in the arrays, and the children of a node are stored contiguously
+    (one per action) so that the UCT criterion of all the children is computed in one array operation. The structure,
+    visits and costs of the tree are stored in numpy arrays, which are much cheaper than tensors to read and update
+    one node at a time during the selection and the backup, while the posteriors over states are stored in tensors.
+
+    The arrays are managed as an arena of blocks, where each block stores the children of one node. When the subtree
+    of the selected action is reused across steps, the blocks of the discarded nodes are recycled by later expansions.
+
+    Several leaves can be expanded in parallel (leaf parallelism), the leaves are selected one after the other using a
+    virtual loss so that they differ, and then expanded and evaluated in a single batch. The batch only amortizes the
+    Python overhead of each planning iteration, the cost of the contraction of the likelihood of the observations is
+    linear in the number of leaves. Thus, the speedup is close to linear on small grids (where the overhead dominates,
+    e.g., about 8x with 8 leaves on a 5x5 MiniSprites grid), but is limited to about 2x on large grids (where the
+    contraction dominates, e.g., 20x20) unless the contraction itself runs on several cores.
+
+    When a transposition table is used, only the leaves whose posteriors are not in the table are expanded and
+    evaluated by the batch, the children of the other leaves are copied from the table.
+    """
+
+    def __init__(
+        self, exp_const, n_samples=-1, capacity=1024, reuse_subtree=False, n_leaves=1, table_size=0,
+        reuse_tolerance=0.5, table_precision=0.01
+    ):
+        """
+        Construct the MCTS algorithm
+        :param exp_const: the exploration constant of the MCTS algorithm
+        :param n_samples: the number of samples
+        :param capacity: the initial number of nodes that can be stored in the tree, the arrays grow when it is reached
+        :param reuse_subtree: whether to keep the subtree of the selected action as the tree of the next step
+        :param n_leaves: the number of leaves expanded in parallel at each planning iteration
+        :param table_size: the number of entries of the transposition table, zero if no table must be used
+        :param reuse_tolerance: the largest total variation distance between the posteriors of the temporal slice and
+            the posteriors predicted for the root of the next step, for which the subtree is reused
+        :param table_precision: the quantization step of the posteriors used as keys by the transposition table
+        """
+        super().__init__(exp_const, n_samples, table_size, table_precision)
+        self.capacity = capacity
+        self.reuse_subtree = reuse_subtree
+        self.n_leaves = n_leaves
+        self.reuse_tolerance = reuse_tolerance
+
+        # The virtual loss, i.e., the highest expected free energy of the tree, added to the cost of the nodes along
+        # the paths of the leaves that are already selected.
+        self.virtual_loss = 0
+
+        # The temporal slice providing the generative model, the root of the tree, and the root of the next step.
+        self.ts = None
+        self.root = 0
+        self.next_root = None
+
+        # The number of planning iterations inherited from the previous steps, and the number of steps where the
+        # subtree was discarded because the posteriors of its root diverged.
+        self.n_reused_iterations = 0
+        self.n_discarded_subtrees = 0
+
+        # The number of blocks that have been allocated, and the blocks that can be recycled.
+        self.n_blocks = 0
+        self.free_blocks = []
+
+        # The arrays storing the tree.
+        self.parents = None
+        self.actions = None
+        self.first_child = None
+        self.visits = None
+        self.costs = None
+        self.efe = None
+        self.states_posterior = None
+
+        # The path of the last selected node, the paths of the last selected leaves, and the posteriors of the last
+        # expanded nodes that are not in the transposition table.
+        self.path = None
+        self.paths = []
+        self.children_posteriors = None
+
+        # The keys and entries of the last expanded nodes in the transposition table, the positions of the nodes that
+        # are not in the table, and the posteriors of the last expanded nodes.
+        self.keys = []
+        self.entries = []
+        self.missed = []
+        self.leaves_posterior = None
+
+    def reset(self, ts):
+        """
+        Reset the tree so that it only contains a root node whose posteriors are the ones of the temporal slice
+        :param ts: the temporal slice whose posteriors over states have been computed by the I-step
+        """
+        self.ts = ts
+        if self.parents is None:
+            # Allocate the arrays, the first time the tree is used.
+            self.parents = numpy.full([self.capacity], -1, dtype=numpy.int64)
+            self.actions = numpy.full([self.capacity], -1, dtype=numpy.int64)
+            self.first_child = numpy.full([self.capacity], -1, dtype=numpy.int64)
+            self.visits = numpy.ones([self.capacity])
+            self.costs = numpy.zeros([self.capacity])
+            self.efe = numpy.zeros([self.capacity])
+            self.states_posterior = {
+                k: torch.zeros([self.capacity, v.shape[0]]) for k, v in ts.states_posterior.items()
+            }
+        else:
+            # Recycle the arrays of the previous tree.
+            self.parents.fill(-1)
+            self.first_child.fill(-1)
+            self.visits.fill(1)
+            self.costs.fill(0)
+        for k, v in ts.states_posterior.items():
+            self.states_posterior[k][0] = v.detach()
+
+        # The root is the only node of the first block.
+        self.root = 0
+        self.n_blocks = 1
+        self.free_blocks = []
+        self.virtual_loss = 0
+
+    def reuse(self, ts, root):
+        """
+        Make a node of the tree the new root, keep its subtree and recycle the blocks of all the other nodes. The
+        posteriors over states of the subtree are corrected, i.e., they are predicted from the posteriors of the
+        temporal slice, and the expected free energy and costs of the subtree are recomputed from the corrected
+        posteriors, only the structure of the subtree and the number of visits of its nodes are kept
+        :param ts: the temporal slice whose posteriors over states have been computed by the I-step
+        :param root: the index of the new root
+        :return: True if the subtree has been reused, False if the posteriors of the temporal slice diverge from the
+            posteriors predicted for the new root (e.g., after the environment was reset), in which case the tree is
+            reset instead
+        """
+        # Reset the tree, if the posteriors of the temporal slice are too far from the posteriors of the new root.
+        if self.divergence(ts, root) > self.reuse_tolerance:
+            self.reset(ts)
+            return False
+        self.ts = ts
+        n_actions = ts.n_actions
+
+        # Collect the levels of the subtree (i.e., the expanded nodes of each level and their children), and the
+        # blocks it uses.
+        kept_blocks = numpy.zeros([self.n_blocks], dtype=bool)
+        kept_blocks[root // n_actions] = True
+        levels = []
+        level = numpy.array([root])
+        while len(level) != 0:
+            expanded = level[self.first_child[level] >= 0]
+            first_children = self.first_child[expanded]
+            kept_blocks[first_children // n_actions] = True
+            level = (first_children[:, None] + numpy.arange(n_actions)).reshape(-1)
+            if len(level) != 0:
+                levels.append((expanded, level))
+
+        # Recycle the blocks that are not used by the subtree.
+        self.free_blocks = numpy.flatnonzero(~kept_blocks).tolist()
+        self.parents[root] = -1
+        self.root = root
+
+        # Correct the posteriors and the expected free energy of the subtree, one level at a time starting from the
+        # new root.
+        for k, v in ts.states_posterior.items():
+            self.states_posterior[k][root] = v.detach()
+        self.virtual_loss = 0
+        for expanded, level in levels:
+            posteriors = ts.predict_all_actions({
+                k: v[torch.from_numpy(expanded)] for k, v in self.states_posterior.items()
+            })
+            for k, v in self.states_posterior.items():
+                v[torch.from_numpy(level)] = posteriors[0][k]
+            self.efe[level] = ts.batched_efe(posteriors, self.n_samples).numpy()
+            self.costs[level] = self.efe[level]
+            self.virtual_loss = max(self.virtual_loss, float(self.efe[level].max()))
+
+        # Recompute the costs of the expanded nodes, one level at a time starting from the deepest level. The cost of
+        # a node is its expected free energy plus the cost of the best child of each node expanded in its subtree.
+        for expanded, level in reversed(levels):
+            children = level.reshape(-1, n_actions)
+            backups = self.efe[children].min(axis=1) + (self.costs[children] - self.efe[children]).sum(axis=1)
+            self.costs[expanded] = self.efe[expanded] + backups
+        return True
+
+    def divergence(self, ts, root):
+        """
+        Getter.
+        :param ts: the temporal slice whose posteriors over states have been computed by the I-step
+        :param root: the index of a node of the tree
+        :return: the largest total variation distance between the posteriors over a state of the temporal slice and
+            the posteriors predicted for the node
+        """
+        return max(
+            0.5 * (v.detach() - self.states_posterior[k][root]).abs().sum().item()
+            for k, v in ts.states_posterior.items()
+        )
+
+    def allocate_blocks(self, n_blocks):
+        """
+        Allocate several blocks of nodes, the free blocks are recycled first and the arrays grow at most once
+        :param n_blocks: the number of blocks to allocate
+        :return: the indices of the first node of each block
+        """
+        n_recycled = min(n_blocks, len(self.free_blocks))
+        blocks = self.free_blocks[len(self.free_blocks) - n_recycled:]
+        del self.free_blocks[len(self.free_blocks) - n_recycled:]
+        n_new_blocks = n_blocks - n_recycled
+        blocks = numpy.concatenate([
+            numpy.array(blocks, dtype=numpy.int64),
+            numpy.arange(self.n_blocks, self.n_blocks + n_new_blocks, dtype=numpy.int64)
+        ])
+        self.n_blocks += n_new_blocks
+        self.grow(self.n_blocks * self.ts.n_actions)
+        return blocks * self.ts.n_actions
+
+    def grow(self, n_nodes):
+        """
+        Increase the capacity of the tree, if it cannot store the requested number of nodes
+        :param n_nodes: the number of nodes to store
+        """
+        if n_nodes <= self.capacity:
+            return
+        size = max(n_nodes, 2 * self.capacity) - self.capacity
+        self.parents = numpy.concatenate([self.parents, numpy.full([size], -1, dtype=numpy.int64)])
+        self.actions = numpy.concatenate([self.actions, numpy.full([size], -1, dtype=numpy.int64)])
+        self.first_child = numpy.concatenate([self.first_child, numpy.full([size], -1, dtype=numpy.int64)])
+        self.visits = numpy.concatenate([self.visits, numpy.ones([size])])
+        self.costs = numpy.concatenate([self.costs, numpy.zeros([size])])
+        self.efe = numpy.concatenate([self.efe, numpy.zeros([size])])
+        self.states_posterior = {
+            k: torch.cat([v, torch.zeros([size, v.shape[1]])]) for k, v in self.states_posterior.items()
+        }
+        self.capacity += size
+
+    def plan(self, ts, n_iterations):
+        """
+        Perform the planning from the posteriors of the temporal slice
+        :param ts: the temporal slice whose posteriors over states have been computed by the I-step
+        :param n_iterations: the number of planning iterations
+        :return: the most visited child of the root
+        """
+        with torch.no_grad():
+            if self.reuse_subtree and self.next_root is not None:
+                if self.reuse(ts, self.next_root):
+                    self.n_reused_iterations += int(self.visits[self.root]) - 1
+                else:
+                    self.n_discarded_subtrees += 1
+            else:
+                self.reset(ts)
+            i = 0
+            while i < n_iterations:
+                nodes = self.select_nodes(min(self.n_leaves, n_iterations - i))
+                children = self.expansion(nodes)
+                self.evaluation(children)
+                self.propagation(children)
+                i += len(nodes)
+        self.next_root = self.best_child()
+        return self.next_root
+
+    def children(self, node):
+        """
+        Getter.
+        :param node: the index of a node that has been expanded.
+        :return: the indices of the node's children.
+        """
+        first_child = int(self.first_child[node])
+        return numpy.arange(first_child, first_child + self.ts.n_actions)
+
+    def select_node(self, root=None):
+        """
+        Select the node to be expanded.
+        :param root: the index of the root of the tree, None for the current root.
+        :return: the index of the selected node.
+        """
+        start_time = time.perf_counter()
+        n_actions = self.ts.n_actions
+        current = self.root if root is None else root
+        path = [current]
+        first_child = int(self.first_child[current])
+        while first_child >= 0:
+            # The children of a node are contiguous, so their visits and costs are views of the arrays.
+            visits = self.visits[first_child:first_child + n_actions]
+            uct = - self.costs[first_child:first_child + n_actions] / visits + \
+                self.exp_const * numpy.sqrt(math.log(self.visits[current]) / visits)
+            current = first_child + int(uct.argmax())
+            path.append(current)
+            first_child = int(self.first_child[current])
+        self.path = path
+        self.timers["select"] += time.perf_counter() - start_time
+        self.n_iterations += 1
+        return current
+
+    def select_nodes(self, n_leaves):
+        """
+        Select the leaves to be expanded in parallel, a virtual loss is added along the path of each selected leaf so
+        that the next selection is drawn towards other leaves
+        :param n_leaves: the maximum number of leaves to select
+        :return: the indices of the selected leaves, which may be fewer than requested if a leaf is selected twice
+        """
+        nodes = []
+        self.paths = []
+        for _ in range(n_leaves):
+            # Select a leaf, and stop if it has already been selected.
+            node = self.select_node()
+            if node in nodes:
+                self.n_iterations -= 1
+                break
+            nodes.append(node)
+            self.paths.append(self.path)
+
+            # Add the virtual loss along the path of the leaf.
+            self.visits[self.path] += 1
+            self.costs[self.path] += self.virtual_loss
+
+        # Remove the virtual losses.
+        for path in self.paths:
+            self.visits[path] -= 1
+            self.costs[path] -= self.virtual_loss
+        return nodes
+
+    def expansion(self, nodes):
+        """
+        Expand the nodes passed as parameters, the children of all actions (and all nodes) are created at once
+        :param nodes: the indices of the nodes to be expanded
+        :return: the indices of the expanded nodes, the i-th row contains the children of the i-th node
+        """
+        start_time = time.perf_counter()
+
+        # Look for the posteriors of the children in the transposition table.
+        nodes = [nodes] if isinstance(nodes, int) else nodes
+        posteriors = {k: v[nodes] for k, v in self.states_posterior.items()}
+        self.entries = [None] * len(nodes)
+        if self.table is not None:
+            self.table.validate(self.ts.model_version())
+            self.keys = self.table.keys(posteriors)
+            self.entries = [self.table.get(key) for key in self.keys]
+        self.missed = [i for i, entry in enumerate(self.entries) if entry is None]
+        self.leaves_posterior = posteriors
+
+        # Compute the posteriors of all the children that are not in the table.
+        self.children_posteriors = None
+        if len(self.missed) != 0:
+            posteriors = {k: v[self.missed] for k, v in posteriors.items()}
+            self.children_posteriors = self.ts.predict_all_actions(posteriors)
+
+        # Store the children of each node in a new block of the arrays, the posteriors over each state of all the
+        # children are written at once.
+        n_actions = self.ts.n_actions
+        first_children = self.allocate_blocks(len(nodes))
+        children = first_children[:, None] + numpy.arange(n_actions)
+        indices = torch.from_numpy(children.reshape(-1))
+        hits = [i for i, entry in enumerate(self.entries) if entry is not None]
+        for k, v in self.states_posterior.items():
+            if len(hits) == 0:
+                v[indices] = self.children_posteriors[0][k]
+                continue
+            values = v.new_empty([len(nodes), n_actions, v.shape[1]])
+            if self.children_posteriors is not None:
+                values[self.missed] = self.children_posteriors[0][k].view(len(self.missed), n_actions, -1)
+            values[hits] = torch.stack([self.entries[i][0][k] for i in hits])
+            v[indices] = values.view(-1, v.shape[1])
+        self.parents[children] = numpy.array(nodes)[:, None]
+        self.actions[children] = numpy.arange(n_actions)
+        self.first_child[children] = -1
+        self.visits[children] = 1
+        self.first_child[nodes] = first_children
+
+        self.timers["expand"] += time.perf_counter() - start_time
+        return children
+
+    def evaluation(self, nodes):
+        """
+        Evaluate the input nodes, which must be the children created by the last expansion
+        :param nodes: the indices of the nodes to be evaluated
+        """
+        start_time = time.perf_counter()
+
+        # Evaluate the children that are not in the transposition table, and add them to the table.
+        if self.children_posteriors is not None:
+            efe = self.ts.batched_efe(self.children_posteriors, self.n_samples).view(len(self.missed), -1).numpy()
+            self.efe[nodes[self.missed]] = efe
+            if self.table is not None:
+                states_posterior = {
+                    k: self.children_posteriors[0][k].view(len(self.missed), efe.shape[1], -1)
+                    for k in self.states_posterior.keys()
+                }
+                for j, i in enumerate(self.missed):
+                    self.table.put(self.keys[i], (
+                        {k: v[j] for k, v in states_posterior.items()}, efe[j],
+                        {k: v[i] for k, v in self.leaves_posterior.items()}
+                    ))
+
+        # Copy the expected free energy of the other children from the table.
+        for i, entry in enumerate(self.entries):
+            if entry is not None:
+                self.efe[nodes[i]] = entry[1]
+        nodes = nodes.reshape(-1)
+        self.costs[nodes] = self.efe[nodes]
+        self.virtual_loss = max(self.virtual_loss, float(self.efe[nodes].max()))
+        self.timers["evaluate"] += time.perf_counter() - start_time
+
+    def propagation(self, nodes):
+        """
+        Propagate the cost of the best child of each expanded node along the path of the node, and update the
+        number of visits.
+        :param nodes: the indices of the nodes that have been expanded, the i-th row contains the children of the
+            i-th selected leaf.
+        """
+        start_time = time.perf_counter()
+        costs = self.efe[nodes].min(axis=1)
+        for path, cost in zip(self.paths, costs):
+            self.costs[path] += cost
+            self.visits[path] += 1
+        self.timers["backup"] += time.perf_counter() - start_time
+
+    def best_child(self, root=None):
+        """
+        Getter.
+        :param root: the index of the root of the tree, None for the current root.
+        :return: the index of the most visited child of the root.
+        """
+        children = self.children(self.root if root is None else root)
+        return int(children[self.visits[children].argmax()])
+
+    def get_states_posterior(self, node):
+        """
+        Getter.
+        :param node: the index of a node.
+        :return: the posteriors over the states of the node.
+        """
+        return {k: v[node].clone() for k, v in self.states_posterior.items()}
+
+    @staticmethod
+    def children_states_posterior(entry):
+        """
+        Getter.
+        :param entry: an entry of the transposition table.
+        :return: the posteriors over the states of the children stored in the entry.
+        """
+        return entry[0]
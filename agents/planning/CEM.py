@@ -0,0 +1,101 @@
+import torch
+from torch.nn.functional import one_hot
+import agents.math.functions as math_fc
+
+
+class CEM:
+    """
+    Class implementing the cross-entropy method, planning in the latent space of a world model.
+    """
+
+    def __init__(
+            self, n_actions, horizon, n_candidates, n_elites, n_iterations, discount_factor, g_value, smoothing=0.1
+    ):
+        """
+        Construct the cross-entropy method
+        :param n_actions: the number of actions
+        :param horizon: the length of the action sequences
+        :param n_candidates: the number of action sequences evaluated at each iteration
+        :param n_elites: the number of best action sequences used to refit the distribution over action sequences
+        :param n_iterations: the number of refitting iterations
+        :param discount_factor: the discount factor
+        :param g_value: the objective of the critic, i.e., "Reward" or "Expected Free Energy"
+        :param smoothing: the probability mass spread uniformly across actions after each refitting
+        """
+        self.n_actions = n_actions
+        self.horizon = horizon
+        self.n_candidates = n_candidates
+        self.n_elites = min(n_elites, n_candidates)
+        self.n_iterations = n_iterations
+        self.discount_factor = discount_factor
+        self.g_value = g_value
+        self.smoothing = smoothing
+
+    def plan(self, mean, log_var, encoder, decoder, transition, reward, critic):
+        """
+        Compute the quality of each action by searching for the best action sequences in the latent space
+        :param mean: the mean of the Gaussian over the current state, i.e., a tensor of shape [1, n_states]
+        :param log_var: the log variance of the Gaussian over the current state, i.e., a tensor of shape [1, n_states]
+        :param encoder: the encoder network
+        :param decoder: the decoder network
+        :param transition: the transition network
+        :param reward: the reward network
+        :param critic: the critic network
+        :return: the quality of each action, i.e., the best score of the sequences starting with this action
+        """
+        with torch.no_grad():
+            # Start from a uniform distribution over the actions at each depth.
+            probs = torch.full([self.horizon, self.n_actions], 1 / self.n_actions, device=mean.device)
+
+            actions, scores = None, None
+            for _ in range(self.n_iterations):
+                # Sample the candidate action sequences, and evaluate them.
+                actions = torch.multinomial(probs, self.n_candidates, replacement=True).t()
+                scores = self.evaluate(actions, mean, log_var, encoder, decoder, transition, reward, critic)
+
+                # Refit the distribution over actions at each depth to the elite sequences.
+                elites = actions[scores.topk(self.n_elites).indices]
+                counts = one_hot(elites, self.n_actions).sum(dim=0)
+                probs = (1 - self.smoothing) * counts / self.n_elites + self.smoothing / self.n_actions
+
+            # Compute the quality of each action, the actions that were never sampled receive the worst score.
+            first_actions = one_hot(actions[:, 0], self.n_actions).bool()
+            quality = torch.where(first_actions, scores.unsqueeze(dim=1), scores.min()).max(dim=0)[0]
+            return quality.unsqueeze(dim=0)
+
+    def evaluate(self, actions, mean, log_var, encoder, decoder, transition, reward, critic):
+        """
+        Evaluate action sequences by rolling out the transition network, all sequences being processed in one
+        batched forward pass per depth, each sequence starts from a state sampled from the Gaussian over the current
+        state. Each action is scored by its predicted reward minus the information gain of the predicted transition,
+        and the critic provides the value of the state reached at the end of the sequence
+        :param actions: the action sequences, i.e., a tensor of shape [n_candidates, horizon]
+        :param mean: the mean of the Gaussian over the current state
+        :param log_var: the log variance of the Gaussian over the current state
+        :param encoder: the encoder network
+        :param decoder: the decoder network
+        :param transition: the transition network
+        :param reward: the reward network
+        :param critic: the critic network
+        :return: the score of each action sequence
+        """
+        # Sample the initial state of each candidate, so that the uncertainty over the current state enters the score.
+        n_candidates = actions.shape[0]
+        states = math_fc.re_parameterize(mean.repeat(n_candidates, 1), log_var.repeat(n_candidates, 1))
+        scores = torch.zeros(n_candidates, device=mean.device)
+        for depth in range(self.horizon):
+            # Predict the reward of the action performed at this depth, and the next states of all the candidates.
+            g_values = reward(states).gather(dim=1, index=actions[:, depth:depth + 1]).squeeze(dim=1)
+            mean, log_var = transition(states, actions[:, depth])
+
+            # Subtract the information gain of the transitions, which is only non-zero when the critic is trained
+            # using the expected free energy.
+            if self.g_value == "Expected Free Energy":
+                mean_hat, log_var_hat = encoder(torch.sigmoid(decoder(mean)))
+                g_values -= math_fc.compute_info_gain(self.g_value, mean_hat, log_var_hat, mean, log_var, sum_dims=1)
+            scores += self.discount_factor ** depth * g_values
+            states = mean
+
+        # The critic provides the value of the states reached at the end of the sequences.
+        values = critic(states)[:, :self.n_actions].max(dim=1)[0]
+        return scores + self.discount_factor ** self.horizon * values
@@ -1,55 +1,142 @@
+import time
+from agents.planning.TranspositionTable import TranspositionTable
+
+
 class MCTS:
     """
     Class implementing the Monte-Carlo tree search algorithm.
     """
 
-    def __init__(self, exp_const, n_samples=-1):
+    def __init__(self, exp_const, n_samples=-1, table_size=0, table_precision=0.01):
         """
         Construct the MCTS algorithm
         :param exp_const: the exploration constant of the MCTS algorithm
         :param n_samples: the number of samples
+        :param table_size: the number of entries of the transposition table, zero if no table must be used
+        :param table_precision: the quantization step of the posteriors used as keys by the transposition table
         """
         self.exp_const = exp_const
         self.n_samples = n_samples
 
+        # The transposition table sharing the expansion and evaluation of nodes with the same posteriors, and the
+        # key and entry of the last expanded node.
+        self.table = TranspositionTable(table_size, table_precision) if table_size > 0 else None
+        self.key = None
+        self.entry = None
+
+        # The time spent in each phase of the algorithm (in seconds), and the number of planning iterations.
+        self.timers = {"select": 0.0, "expand": 0.0, "evaluate": 0.0, "backup": 0.0}
+        self.n_iterations = 0
+
     def select_node(self, root):
         """
         Select the node to be expanded.
         :param root: the root of the tree.
         """
+        start_time = time.perf_counter()
         current = root
         while len(current.children) != 0:
             current = max(current.children, key=lambda x: x.uct(self.exp_const))
+        self.timers["select"] += time.perf_counter() - start_time
+        self.n_iterations += 1
         return current
 
-    @staticmethod
-    def expansion(node):
+    def expansion(self, node):
         """
-        Expand the node passed as parameters
+        Expand the node passed as parameters, the children of all actions are created at once
         :param node: the node to be expanded
+        :return: the expanded nodes
         """
-        nodes = []
-        for action in range(0, node.n_actions):
-            nodes.append(node.p_step(action))
+        start_time = time.perf_counter()
+
+        # Look for the posteriors of the children in the transposition table.
+        self.entry = None
+        if self.table is not None:
+            self.table.validate(node.model_version())
+            self.key = self.table.keys(node.states_posterior)
+            self.entry = self.table.get(self.key)
+
+        # Create the children, their posteriors are only computed if they are not in the table.
+        nodes = node.expand(None if self.entry is None else self.entry[0])
+        self.timers["expand"] += time.perf_counter() - start_time
         return nodes
 
     def evaluation(self, nodes):
         """
-        Evaluate the input nodes
+        Evaluate the input nodes, which must be the children of the same node created by the last expansion
         :param nodes: the nodes to be evaluated
         """
+        if len(nodes) == 0:
+            return
+        start_time = time.perf_counter()
+
+        # Evaluate the children, unless their expected free energy is in the transposition table.
+        parent = nodes[0].parent
+        efe = parent.children_efe(self.n_samples, None if self.entry is None else self.entry[1])
+        if self.table is not None and self.entry is None:
+            self.table.put(self.key, (parent.children_posteriors, efe, dict(parent.states_posterior)))
         for node in nodes:
             node.cost = node.efe(self.n_samples)
+        self.timers["evaluate"] += time.perf_counter() - start_time
 
     def propagation(self, nodes):
         """
         Propagate the cost in the tree and update the number of visits.
         :param nodes: the nodes that have been expanded.
         """
+        start_time = time.perf_counter()
         best_child = min(nodes, key=lambda x: x.efe(self.n_samples))
-        cost = best_child.cost
+        cost = best_child.efe(self.n_samples)
         current = best_child.parent
         while current is not None:
             current.cost += cost
             current.visits += 1
             current = current.parent
+        self.timers["backup"] += time.perf_counter() - start_time
+
+    def reset_timers(self):
+        """
+        Reset the time spent in each phase of the algorithm, and the number of hits and misses of the transposition
+        table.
+        """
+        self.timers = {phase: 0.0 for phase in self.timers.keys()}
+        self.n_iterations = 0
+        if self.table is not None:
+            self.table.reset_stats()
+
+    def get_timers(self):
+        """
+        Getter.
+        :return: the average time spent in each phase of the algorithm per planning iteration (in milliseconds).
+        """
+        n_iterations = max(self.n_iterations, 1)
+        return {phase: 1000 * timer / n_iterations for phase, timer in self.timers.items()}
+
+    def invalidate(self, affected, model_version):
+        """
+        Remove the entries of the transposition table affected by a modification of the generative model.
+        :param affected: a function taking the posteriors over the states of a node and of its children, and returning
+            whether the modification changed the expansion or evaluation of the node.
+        :param model_version: the version of the generative model after the modification.
+        """
+        if self.table is None:
+            return
+        self.table.invalidate(lambda entry: affected(entry[2], self.children_states_posterior(entry)), model_version)
+
+    @staticmethod
+    def children_states_posterior(entry):
+        """
+        Getter.
+        :param entry: an entry of the transposition table.
+        :return: the posteriors over the states of the children stored in the entry.
+        """
+        return entry[0][0]
+
+    def get_table_stats(self):
+        """
+        Getter.
+        :return: the number of hits and misses of the transposition table, its hit rate and its number of entries.
+        """
+        if self.table is None:
+            return {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+        return self.table.get_stats()
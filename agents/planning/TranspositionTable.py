@@ -0,0 +1,103 @@
+import collections
+import torch
+
+
+class TranspositionTable:
+    """
+    A transposition table storing the expansion and evaluation of the nodes of a planning tree, i.e., the posteriors
+    and expected free energy of their children. The entries are keyed on a quantized fingerprint of the posteriors over
+    the states, so that the branches of the tree reaching the same posteriors (e.g., after an idle action or a wall
+    bump) share their expansion and evaluation. The number of entries is bounded, and the least recently used entries
+    are discarded first.
+    """
+
+    def __init__(self, capacity=10000, precision=0.01):
+        """
+        Construct the transposition table.
+        :param capacity: the maximum number of entries in the table.
+        :param precision: the quantization step of the posteriors, i.e., posteriors whose probabilities differ by less
+            than the precision (after rounding) share the same entry. The noise of the transition mappings moves the
+            posteriors by about 1e-4 per action, so a finer step almost never finds the same posteriors twice.
+        """
+        self.capacity = capacity
+        self.precision = precision
+        self.entries = collections.OrderedDict()
+
+        # The version of the generative model used to compute the entries, and the number of hits and misses.
+        self.model_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, states_posterior):
+        """
+        Getter.
+        :param states_posterior: the posteriors over the states of a node, or a batch of posteriors where the first
+            dimension indexes the nodes.
+        :return: the key of the node, or the list of keys of the nodes.
+        """
+        posteriors = torch.cat([states_posterior[name] for name in sorted(states_posterior.keys())], dim=-1)
+        quantized = torch.round(posteriors / self.precision).to(torch.int64).cpu()
+        if quantized.dim() == 1:
+            return quantized.numpy().tobytes()
+        return [row.numpy().tobytes() for row in quantized]
+
+    def get(self, key):
+        """
+        Getter.
+        :param key: the key of a node.
+        :return: the entry of the node, or None if the node is not in the table.
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """
+        Add an entry to the table, the least recently used entry is discarded if the table is full.
+        :param key: the key of the node.
+        :param entry: the entry of the node.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def validate(self, model_version):
+        """
+        Remove all the entries of the table, if they were computed using another version of the generative model
+        (e.g., before the mappings were learned).
+        :param model_version: the version of the generative model.
+        """
+        if model_version != self.model_version:
+            self.entries.clear()
+            self.model_version = model_version
+
+    def invalidate(self, affected, model_version):
+        """
+        Remove the entries of the table affected by a modification of the generative model, all the other entries are
+        kept and considered computed using the new version of the generative model.
+        :param affected: a function taking an entry and returning whether the modification changed it.
+        :param model_version: the version of the generative model after the modification.
+        """
+        for key in [key for key, entry in self.entries.items() if affected(entry)]:
+            del self.entries[key]
+        self.model_version = model_version
+
+    def reset_stats(self):
+        """
+        Reset the number of hits and misses.
+        """
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """
+        Getter.
+        :return: the number of hits and misses, the hit rate and the number of entries.
+        """
+        n_lookups = max(self.hits + self.misses, 1)
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / n_lookups, "size": len(self.entries)}
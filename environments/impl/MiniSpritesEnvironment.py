@@ -14,6 +14,9 @@ import pygame
 #
 class MiniSpritesEnvironment(gym.Env):
 
+    # The displacement along the x-axis and y-axis caused by each action, i.e., down, up, left, right and idle.
+    moves = np.array([[0, 1], [0, -1], [-1, 0], [1, 0], [0, 0]])
+
     def __init__(self, json):
         """
         Constructor (compatible with OpenAI gym environment)
@@ -23,11 +26,16 @@ class MiniSpritesEnvironment(gym.Env):
         super(MiniSpritesEnvironment, self).__init__()
         self.np_precision = np.float64
         self.action_space = spaces.Discrete(5)
-        self.observation_space = spaces.Box(low=0, high=255, shape=(64, 64, 1), dtype=self.np_precision)
 
         # Initialize fields
         self.width = int(json["width"])
         self.height = int(json["height"])
+        self.structured_observations = json.get("structured_observations", "False") == "True"
+        if self.structured_observations:
+            shape = (self.width * self.height, 3)
+            self.observation_space = spaces.Box(low=0, high=1, shape=shape, dtype=self.np_precision)
+        else:
+            self.observation_space = spaces.Box(low=0, high=255, shape=(64, 64, 1), dtype=self.np_precision)
         self.max_trial_length = int(json["max_trial_length"])
         self.w2 = self.width / 2
         self.w21 = (self.width / 2) - 1
@@ -73,7 +81,16 @@ class MiniSpritesEnvironment(gym.Env):
         self.reward_on_the_right = bool(random.getrandbits(1))
         self.x = random.randint(0, self.width - 1)
         self.y = random.randint(0, self.height - 1)
-        return self.current_frame()
+        return self.observation()
+
+    def transitions(self, axis):
+        """
+        Compute the position reached along an axis when performing each action from each position of this axis
+        :param axis: the index of the axis, i.e., 0 for the x-axis and 1 for the y-axis
+        :return: an array whose element (i, j) is the position reached when performing the j-th action from position i
+        """
+        positions = np.arange(self.s_sizes[axis])
+        return np.clip(positions[:, None] + self.moves[None, :, axis], 0, self.s_sizes[axis] - 1)
 
     @staticmethod
     def get_keys_to_action():
@@ -92,12 +109,31 @@ class MiniSpritesEnvironment(gym.Env):
         self.x = int(self.x)
         self.y = int(self.y)
         image = np.zeros([self.height, self.width, 3])
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.x == x and self.y == y:
-                    image[y][x][0 if self.reward_on_the_right else 1] = 255
+        image[self.y, self.x, 0 if self.reward_on_the_right else 1] = 255
         return image
 
+    def current_evidence(self):
+        """
+        Return the current structured observation, i.e., the categorical evidence of each cell
+        :return: an array whose rows are the one-hot evidence of the cells (ordered x-major), where the values
+            0 and 1 are the colors of the shape, and the value 2 corresponds to an empty cell
+        """
+        self.ensure_position_is_valid()
+        self.x = int(self.x)
+        self.y = int(self.y)
+        evidence = np.zeros([self.width, self.height, 3])
+        evidence[:, :, 2] = 1
+        evidence[self.x, self.y, 2] = 0
+        evidence[self.x, self.y, 0 if self.reward_on_the_right else 1] = 1
+        return evidence.reshape(-1, 3)
+
+    def observation(self):
+        """
+        Return the current observation, in the format requested by the user
+        :return: the current frame, or the current structured observation
+        """
+        return self.current_evidence() if self.structured_observations else self.current_frame()
+
     def step(self, action):
         """
         Execute one time step within the environment
@@ -115,13 +151,13 @@ class MiniSpritesEnvironment(gym.Env):
             exit('Invalid action.')
         done = actions_fn[action]()
         if done:
-            return self.current_frame(), self.last_r, True, {}
+            return self.observation(), self.last_r, True, {}
 
         # Make sure the environment is reset if the maximum number of steps in the trial has been reached.
         if self.frame_id >= self.max_trial_length:
-            return self.current_frame(), -1.0, True, {}
+            return self.observation(), -1.0, True, {}
         else:
-            return self.current_frame(), self.last_r, False, {}
+            return self.observation(), self.last_r, False, {}
 
     #
     # Actions
@@ -18,6 +18,7 @@ class AnalysisConfig:
         self.root_directory = data_directory + "../"
         self.data_directory = data_directory
         self.datasets_directory = data_directory + "datasets/"
+        self.models_directory = data_directory + "models/"
         self.config_directory = data_directory + "config/"
         self.projects_directory = data_directory + "projects/"
         self.assets_directory = data_directory + "assets/"
@@ -31,6 +31,24 @@ class FormBTAI_3MF(tk.Frame):
                 "exp_const": "2.4" if agent is None else agent["exp_const"],
                 "max_planning_steps": "150" if agent is None else agent["max_planning_steps"],
                 "n_samples": "-1" if agent is None else agent["n_samples"],
+                "mcts_tree": "Temporal slices" if agent is None else agent.get("mcts_tree", "Temporal slices"),
+                "reuse_subtree": "False" if agent is None else agent.get("reuse_subtree", "False"),
+                "reuse_tolerance": "0.5" if agent is None else agent.get("reuse_tolerance", "0.5"),
+                "n_parallel_leaves": "1" if agent is None else agent.get("n_parallel_leaves", "1"),
+                "structured_noise": "False" if agent is None else agent.get("structured_noise", "False"),
+                "transposition_table_size": "0" if agent is None else agent.get("transposition_table_size", "0"),
+                "transposition_table_precision":
+                    "0.01" if agent is None else agent.get("transposition_table_precision", "0.01"),
+                "inference_type":
+                    "Backpropagation" if agent is None else agent.get("inference_type", "Backpropagation"),
+                "lbp_tolerance": "0.0001" if agent is None else agent.get("lbp_tolerance", "0.0001"),
+                "lbp_damping": "0" if agent is None else agent.get("lbp_damping", "0"),
+                "lbp_max_iterations": "50" if agent is None else agent.get("lbp_max_iterations", "50"),
+                "batch_size": "32" if agent is None else agent.get("batch_size", "32"),
+                "vfe_lr": "0.001" if agent is None else agent.get("vfe_lr", "0.001"),
+                "learn_mappings": "False" if agent is None else agent.get("learn_mappings", "False"),
+                "dirichlet_concentration": "100" if agent is None else agent.get("dirichlet_concentration", "100"),
+                "flush_interval": "10" if agent is None else agent.get("flush_interval", "10"),
             }
         )
         self.hyper_parameters.grid(row=2, column=0, pady=15, sticky="nsew")
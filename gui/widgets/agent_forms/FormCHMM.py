@@ -30,7 +30,8 @@ class FormCHMM(tk.Frame):
             "encoder": "Conv64",
             "decoder": "Conv64",
             "transition": "LinearRelu3x100",
-            "critic": "LinearRelu4x100"
+            "critic": "LinearRelu4x100",
+            "reward": "LinearRelu4x100"
         })
         self.networks.grid(row=0, column=0, padx=5, pady=15, sticky="nsew")
 
@@ -51,7 +52,17 @@ class FormCHMM(tk.Frame):
                 "vfe_lr": "0.0001",
                 "critic_lr": "0.0001",
                 "critic_objective": "Reward",
-                "n_states": "10"
+                "n_states": "10",
+                "batch_size": "32",
+                "micro_batch_size": "32",
+                "lr_scaling": "None",
+                "n_threads": "0",
+                "n_interop_threads": "0",
+                "planning": "None",
+                "planning_horizon": "5",
+                "n_candidates": "256",
+                "n_elites": "32",
+                "n_planning_iterations": "3"
             }
         )
         self.hyper_parameters.grid(row=2, column=0, padx=5, pady=15, sticky="nsew")
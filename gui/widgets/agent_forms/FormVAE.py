@@ -47,7 +47,12 @@ class FormVAE(tk.Frame):
                 "beta": "1.0" if agent is None else agent["beta"],
                 "queue_capacity": "50000" if agent is None else agent["queue_capacity"],
                 "vfe_lr": "0.0001" if agent is None else agent["vfe_lr"],
-                "n_states": "10" if agent is None else agent["n_states"]
+                "n_states": "10" if agent is None else agent["n_states"],
+                "batch_size": "32" if agent is None else agent.get("batch_size", "32"),
+                "micro_batch_size": "32" if agent is None else agent.get("micro_batch_size", "32"),
+                "lr_scaling": "None" if agent is None else agent.get("lr_scaling", "None"),
+                "n_threads": "0" if agent is None else agent.get("n_threads", "0"),
+                "n_interop_threads": "0" if agent is None else agent.get("n_interop_threads", "0")
             }
         )
         self.hyper_parameters.grid(row=2, column=0, pady=15, sticky="nsew")
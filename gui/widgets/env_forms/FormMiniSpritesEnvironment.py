@@ -3,9 +3,11 @@ import tkinter as tk
 from gui.AnalysisConfig import AnalysisConfig
 from gui.widgets.frames.EnvironmentFrame import EnvironmentFrame
 from gui.widgets.modern.ButtonFactory import ButtonFactory
+from gui.widgets.modern.Combobox import Combobox
 from gui.widgets.modern.Entry import Entry
 from gui.widgets.modern.LabelFactory import LabelFactory
 from gui.widgets.modern.LabelFrameFactory import LabelFrameFactory
+from gui.widgets.modern.ToolTip import ToolTip
 
 
 class FormMiniSpritesEnvironment(tk.Frame):
@@ -61,6 +63,21 @@ class FormMiniSpritesEnvironment(tk.Frame):
         self.max_trial_length_entry = Entry(self.characteristics, valid_input="int", help_message=default_val)
         self.max_trial_length_entry.grid(row=2, column=1, pady=5, padx=5, sticky="nsew")
 
+        self.structured_observations_label = LabelFactory.create(
+            self.characteristics, text="Structured observations:", theme="dark"
+        )
+        self.structured_observations_tooltip = ToolTip(
+            self.structured_observations_label,
+            text="The observations are the categorical evidence of each cell instead of images"
+        )
+        self.structured_observations_label.grid(row=3, column=0, pady=(5, 15), padx=5, sticky="nse")
+
+        default_val = "False" if env is None else env.get("structured_observations", "False")
+        self.structured_observations_combobox = Combobox(
+            self.characteristics, values=["False", "True"], default_value=default_val
+        )
+        self.structured_observations_combobox.grid(row=3, column=1, pady=(5, 15), padx=5, sticky="nsew")
+
         # Create the create/update button
         text = "Create" if env is None else "Update"
         self.create_button = ButtonFactory.create(
@@ -115,6 +132,7 @@ class FormMiniSpritesEnvironment(tk.Frame):
             "width": self.width_entry.get(),
             "height": self.height_entry.get(),
             "max_trial_length": self.max_trial_length_entry.get(),
+            "structured_observations": self.structured_observations_combobox.get(),
         }
         json.dump(env_dic, file, indent=2)
 
@@ -293,7 +293,9 @@ class EnvironmentFrame(tk.Frame):
         # Let the user play the environment
         max_size = min(self.canvas.winfo_width(), self.canvas.winfo_height()) - 200
         while not self.stop_env:
-            # Display environment state
+            # Display environment state, structured observations are replaced by the rendering of the environment
+            if obs.ndim != 3:
+                obs = env.unwrapped.render(mode="rgb_array")
             obs = obs.astype(np.uint8)
             w, h, _ = obs.shape
             ratio = max_size / max(w, h)
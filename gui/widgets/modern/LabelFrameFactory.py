@@ -78,6 +78,30 @@ class LabelFrameFactory:
             "Exploration constant": ("entry", "exp_const", "float"),
             "Maximum number of planning iterations": ("entry", "max_planning_steps", "int"),
             "Number of samples for EFE estimation": ("entry", "n_samples", "int"),
+            "MCTS tree:": ("combobox", "mcts_tree", ["Temporal slices", "Arrays"]),
+            "Reuse subtree:": ("combobox", "reuse_subtree", ["False", "True"]),
+            "Reuse tolerance:": ("entry", "reuse_tolerance", "float"),
+            "Number of leaves expanded in parallel:": ("entry", "n_parallel_leaves", "int"),
+            "Structured noise mappings:": ("combobox", "structured_noise", ["False", "True"]),
+            "Transposition table size:": ("entry", "transposition_table_size", "int"),
+            "Transposition table precision:": ("entry", "transposition_table_precision", "float"),
+            "Inference algorithm:": ("combobox", "inference_type", ["Backpropagation", "Loopy belief propagation"]),
+            "Loopy belief propagation tolerance:": ("entry", "lbp_tolerance", "float"),
+            "Loopy belief propagation damping:": ("entry", "lbp_damping", "float"),
+            "Loopy belief propagation iterations:": ("entry", "lbp_max_iterations", "int"),
+            "Batch size:": ("entry", "batch_size", "int"),
+            "Learn the mappings:": ("combobox", "learn_mappings", ["False", "True"]),
+            "Dirichlet concentration:": ("entry", "dirichlet_concentration", "float"),
+            "Count updates interval:": ("entry", "flush_interval", "int"),
+            "Micro-batch size:": ("entry", "micro_batch_size", "int"),
+            "Learning rate scaling:": ("combobox", "lr_scaling", ["None", "Linear", "Square root"]),
+            "Number of threads:": ("entry", "n_threads", "int"),
+            "Number of inter-op threads:": ("entry", "n_interop_threads", "int"),
+            "Planning:": ("combobox", "planning", ["None", "CEM"]),
+            "Planning horizon:": ("entry", "planning_horizon", "int"),
+            "Number of candidate action sequences:": ("entry", "n_candidates", "int"),
+            "Number of elite action sequences:": ("entry", "n_elites", "int"),
+            "Number of planning iterations:": ("entry", "n_planning_iterations", "int"),
         }
 
         # Create networks label frame
@@ -111,6 +135,40 @@ class LabelFrameFactory:
             # Add tooltips
             if key == "n_steps_between_synchro":
                 ToolTip(label, "The synchronization is between the weights of the target and Q-network")
+            if key == "micro_batch_size":
+                ToolTip(label, "The gradients of the micro-batches are accumulated before each update of the weights")
+            if key in ["n_threads", "n_interop_threads"]:
+                ToolTip(label, "Zero keeps the default number of threads used by PyTorch")
+            if key == "planning":
+                ToolTip(label, "CEM plans in the latent space using the transition and critic networks")
+            if key == "mcts_tree":
+                ToolTip(label, "Arrays store the tree in preallocated tensors, which is faster than temporal slices")
+            if key == "reuse_subtree":
+                ToolTip(label, "Keep the subtree of the selected action across steps, only with an MCTS tree in arrays")
+            if key == "reuse_tolerance":
+                ToolTip(label, "Discard the subtree when the posteriors of its root move further than this")
+            if key == "n_parallel_leaves":
+                ToolTip(label, "The leaves are expanded in a single batch, only with an MCTS tree in arrays")
+            if key == "structured_noise":
+                ToolTip(label, "Store the mappings as a uniform noise plus one peak per column, faster on large grids")
+            if key == "transposition_table_size":
+                ToolTip(label, "Share the expansion and evaluation of nodes with the same posteriors, zero disables it")
+            if key == "transposition_table_precision":
+                ToolTip(label, "Posteriors whose probabilities differ by less than this share the same table entry")
+            if key == "inference_type":
+                ToolTip(label, "The algorithm computing the posteriors over the states during the I-step")
+            if key == "lbp_tolerance":
+                ToolTip(label, "The largest change of a message for which loopy belief propagation has converged")
+            if key == "lbp_damping":
+                ToolTip(label, "The weight of the previous message, damping only helps on graphs with loops")
+            if key == "lbp_max_iterations":
+                ToolTip(label, "The maximum number of sweeps, in which each message is recomputed at most once")
+            if key == "learn_mappings":
+                ToolTip(label, "Learn the likelihood and transition mappings using Dirichlet count updates")
+            if key == "dirichlet_concentration":
+                ToolTip(label, "The number of pseudo-counts of the initial mappings, i.e., the strength of the prior")
+            if key == "flush_interval":
+                ToolTip(label, "The number of training iterations between two updates of the counts and mappings")
 
             row_index += 1
 
@@ -134,6 +192,7 @@ class LabelFrameFactory:
             "Decoder:": ("decoder", LabelFrameFactory.decoders),
             "Transition:": ("transition", LabelFrameFactory.transitions),
             "Critic:": ("critic", LabelFrameFactory.critics),
+            "Reward:": ("reward", LabelFrameFactory.critics),
             "Q-network:": ("policy", LabelFrameFactory.policies)
         }
 
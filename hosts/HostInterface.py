@@ -7,6 +7,8 @@ class HostInterface(abc.ABC):
     An abstract interface that all hosts must implement
     """
 
+    device = None
+
     @abc.abstractmethod
     def train(self, agent, env, project_name):
         """
@@ -31,14 +33,42 @@ class HostInterface(abc.ABC):
         Getter
         :return: the device on which computation should be performed
         """
+        if HostInterface.device is not None:
+            return HostInterface.device
         return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     @staticmethod
-    def to_device(models):
+    def set_device(device):
+        """
+        Setter
+        :param device: the device on which computation should be performed, None to use a gpu if one is available
+        """
+        HostInterface.device = None if device is None else torch.device(device)
+
+    @staticmethod
+    def to_device(models, device=None):
         """
         Send the models to the device, i.e. gpu if available or cpu otherwise.
         :param models: the list of model to send to the device.
+        :param device: the device to send the models to, None to use the device of the process.
         :return: nothinh
         """
+        device = HostInterface.get_device() if device is None else device
         for model in models:
-            model.to(HostInterface.get_device())
+            model.to(device)
+
+    @staticmethod
+    def set_n_threads(n_threads=0, n_interop_threads=0):
+        """
+        Set the number of threads used by torch for intra-op and inter-op parallelism.
+        :param n_threads: the number of intra-op threads, zero to keep torch's default.
+        :param n_interop_threads: the number of inter-op threads, zero to keep torch's default.
+        """
+        if n_threads > 0:
+            torch.set_num_threads(n_threads)
+        if n_interop_threads > 0 and torch.get_num_interop_threads() != n_interop_threads:
+            try:
+                torch.set_num_interop_threads(n_interop_threads)
+            except RuntimeError as e:
+                # Torch only allows the number of inter-op threads to be set before any inter-op parallel work.
+                print(f"[WARNING] The number of inter-op threads could not be set: {e}")
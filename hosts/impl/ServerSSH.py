@@ -14,13 +14,15 @@ class ServerSSH(HostInterface):
     A class representing an ssh server (with slurm installed)
     """
 
-    def __init__(self, server_name, username, hostname, repository_path, **kwargs):
+    def __init__(self, server_name, username, hostname, repository_path, n_nodes=1, n_gpus=1, **kwargs):
         """
         Constructor
         :param server_name: the server name
         :param username: the username to use when login to the ssh server
         :param hostname: the hostname of the ssh server
         :param repository_path: the path to the repository on the server
+        :param n_nodes: the number of nodes on which each agent is trained
+        :param n_gpus: the number of gpus used on each node, one training process is started per gpu
         :param kwargs: the remaining arguments
         """
         self.conf = DataStorage.get("conf")
@@ -29,6 +31,8 @@ class ServerSSH(HostInterface):
         self.username = username
         self.hostname = hostname
         self.repository_path = repository_path
+        self.n_nodes = int(n_nodes)
+        self.n_gpus = int(n_gpus)
         if self.repository_path[-1] != "/":
             self.repository_path += "/"
         self.mutex = Lock()
@@ -129,10 +133,11 @@ class ServerSSH(HostInterface):
         agent = project_dir + f"agents/{agent}"
         env = project_dir + f"environments/{env}"
         training_script = f"{self.repository_path}train_agent.sh {self.repository_path}"
+        resources = f"--nodes={self.n_nodes} --ntasks-per-node={self.n_gpus} --gres=gpu:{self.n_gpus}"
         values = self.execute(
             client, f"cd {self.repository_path} &&"
             f"source '{self.repository_path}/venv/bin/activate' &&"
-            f"sbatch -p gpu --mem=10G --gres-flags=disable-binding --gres=gpu {training_script} \"{agent}\" \"{env}\"",
+            f"sbatch -p gpu --mem=10G --gres-flags=disable-binding {resources} {training_script} \"{agent}\" \"{env}\"",
             return_stdout=True
         )
         job_id = values["stdout"][0].split(" ")[-1]
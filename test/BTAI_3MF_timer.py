@@ -37,7 +37,10 @@ if __name__ == '__main__':
     AnalysisConfig.get(data_directory=data_dir)
 
     # Compute execution time for MiniSprites environments of different size
-    print("Size, Execution time")
+    print(
+        "Size, Construction time, Execution time, Select (ms), Expand (ms), Evaluate (ms), Backup (ms), "
+        "Table hit rate, LBP iterations, LBP time (ms)"
+    )
     for size in range(2, 21):
         # Create the environment
         env = EnvironmentFactory.create({
@@ -49,24 +52,36 @@ if __name__ == '__main__':
             "max_trial_length": "50"
         })
 
-        # Create the agent
+        # Create the agent (keep track of the construction time)
+        start_time = time.time()
         agent = AgentFactory.create({
             "name": "BTAI_3MF",
             "module": "agents.impl.BTAI_3MF",
             "class": "BTAI_3MF",
             "exp_const": "2.4",
             "n_samples": "1",
-            "max_planning_steps": "150"
+            "max_planning_steps": "150",
+            "transposition_table_size": "10000",
+            "inference_type": "Loopy belief propagation"
         }, env.action_space.n, env)
+        construction_time = time.time() - start_time
 
         # Apply required wrappers to the environment
         env = DefaultWrappers.apply("BTAI_3MF", env, image_shape=(1, 64, 64))
 
-        # Keep track of the starting time
+        # Keep track of the starting time, and of the time spent in each phase of the planning
         start_time = time.time()
+        agent.mcts.reset_timers()
 
         # Run the trials simulation
         loop(agent, env)
 
         # Keep track of the ending time
-        print(f"{size}, {time.time() - start_time}")
+        timers = agent.mcts.get_timers()
+        table_stats = agent.mcts.get_table_stats()
+        lbp_stats = agent.ts.lbp.stats
+        print(
+            f"{size}, {construction_time}, {time.time() - start_time}, "
+            f"{timers['select']}, {timers['expand']}, {timers['evaluate']}, {timers['backup']}, "
+            f"{table_stats['hit_rate']:.2f}, {lbp_stats['iterations']:.2f}, {1000 * lbp_stats['time']:.2f}"
+        )
@@ -0,0 +1,47 @@
+import os
+import torch
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Create the environment and an agent performing amortized inference
+    env = EnvironmentFactory.create({
+        "name": "MiniSprites",
+        "module": "environments.impl.MiniSpritesEnvironment",
+        "class": "MiniSpritesEnvironment",
+        "width": "5",
+        "height": "5",
+        "max_trial_length": "50"
+    })
+    agent = AgentFactory.create({
+        "name": "BTAI_3MF",
+        "module": "agents.impl.BTAI_3MF",
+        "class": "BTAI_3MF",
+        "exp_const": "2.4",
+        "n_samples": "-1",
+        "max_planning_steps": "10",
+        "inference_type": "Backpropagation"
+    }, env.action_space.n, env)
+
+    # Check that the priors stored with each observation are the empirical priors installed by the previous step
+    obs = env.reset()
+    initial_priors = agent.ts.states_priors()
+    for i in range(5):
+        priors = {k: v.clone() for k, v in agent.ts.states_priors().items()}
+        obs, _, done, _ = env.step(agent.step(obs, i))
+        stored_priors = agent.ts.amortized_inference.buffer[-1][1]
+        for state_name, prior in priors.items():
+            if not torch.equal(stored_priors[state_name], prior):
+                raise Exception(f"The prior over {state_name} stored at step {i} is not the installed prior.")
+        if i != 0 and all(torch.equal(stored_priors[k], v) for k, v in initial_priors.items()):
+            raise Exception(f"The prior stored at step {i} is the initial prior, not the empirical prior.")
+        if done:
+            obs = env.reset()
+    env.close()
+    print("The encoder is regularised towards the empirical priors over the states.")
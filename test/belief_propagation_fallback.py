@@ -0,0 +1,49 @@
+import contextlib
+import io
+import os
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Create an agent using belief propagation, and run a few action-perception cycles while capturing its output
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        env = EnvironmentFactory.create({
+            "name": "MiniSprites",
+            "module": "environments.impl.MiniSpritesEnvironment",
+            "class": "MiniSpritesEnvironment",
+            "width": "5",
+            "height": "5",
+            "max_trial_length": "50"
+        })
+        agent = AgentFactory.create({
+            "name": "BTAI_3MF",
+            "module": "agents.impl.BTAI_3MF",
+            "class": "BTAI_3MF",
+            "exp_const": "2.4",
+            "n_samples": "-1",
+            "max_planning_steps": "10",
+            "inference_type": "Belief propagation"
+        }, env.action_space.n, env)
+        obs = env.reset()
+        for i in range(5):
+            obs, _, done, _ = env.step(agent.step(obs, i))
+            if done:
+                obs = env.reset()
+        env.close()
+
+    # The generative model of BTAI_3MF contains loops, which must be reported once when the agent is created
+    if agent.ts.fg.schedule is not None:
+        raise Exception("The factor graph of BTAI_3MF should contain loops.")
+    lines = output.getvalue().splitlines()
+    if len([line for line in lines if line.startswith("[WARNING]")]) != 1:
+        raise Exception("The loops of the factor graph should be reported exactly once.")
+    if any(line.startswith("[ERROR]") for line in lines):
+        raise Exception("The fallback to loopy belief propagation should not be reported as an error.")
+    print("Belief propagation falls back to loopy belief propagation with a single warning.")
@@ -0,0 +1,84 @@
+import itertools
+import torch
+from torch.nn.functional import one_hot
+from agents.planning.CEM import CEM
+
+
+if __name__ == '__main__':
+    # Create a small deterministic environment, whose states are one-hot vectors and whose rewards are mostly random
+    torch.manual_seed(0)
+    n_states, n_actions, horizon, discount_factor = 6, 3, 4, 0.9
+    next_states = torch.randint(n_states, [n_states, n_actions])
+    rewards = torch.randn(n_states, n_actions)
+
+    # In the first state, the first action gives the largest immediate reward but leads to an absorbing state without
+    # reward, while the second action leads to an absorbing state with a reward at each time step
+    next_states[:3] = torch.tensor([[1, 2, 3], [1, 1, 1], [2, 2, 2]])
+    rewards[:3] = torch.tensor([[1., 0., -1.], [0., 0., 0.], [1., 1., 1.]])
+
+    # The critic is myopic, i.e., its Q-values are the immediate rewards, as at the beginning of training
+    q_values = rewards.clone()
+
+    def transition(states, actions):
+        """
+        Predict the next states
+        :param states: the one-hot states
+        :param actions: the actions performed in these states
+        :return: the mean and log variance of the next states
+        """
+        states = next_states[states.argmax(dim=1), actions]
+        return one_hot(states, n_states).float(), torch.zeros([states.shape[0], n_states])
+
+    def encoder(obs):
+        """
+        Predict the states from the observations, the prediction is always centered on zero
+        :param obs: the observations
+        :return: the mean and log variance of the states
+        """
+        return torch.zeros_like(obs), torch.zeros_like(obs)
+
+    # Evaluate all the action sequences from the first state
+    cem = CEM(n_actions, horizon, n_candidates=n_actions ** horizon, n_elites=8, n_iterations=3,
+              discount_factor=discount_factor, g_value="Reward")
+    actions = torch.tensor(list(itertools.product(range(n_actions), repeat=horizon)))
+    mean = one_hot(torch.tensor([0]), n_states).float()
+    log_var = torch.full([1, n_states], -100.)
+    scores = cem.evaluate(
+        actions, mean, log_var, encoder, lambda states: states, transition, lambda states: states @ rewards,
+        lambda states: states @ q_values
+    )
+
+    # Check that the score of each sequence is the discounted sum of its rewards, plus the value of the last state
+    for sequence, score in zip(actions, scores):
+        state, expected_score = 0, 0
+        for depth, action in enumerate(sequence.tolist()):
+            expected_score += discount_factor ** depth * rewards[state, action]
+            state = next_states[state, action]
+        expected_score += discount_factor ** horizon * q_values[state].max()
+        if abs(score - expected_score) > 1e-4:
+            raise Exception(f"The sequence {sequence.tolist()} has a score of {score} instead of {expected_score}.")
+
+    # Check that the information gain of each transition is subtracted, the encoder predicts a standard Gaussian and the
+    # transition predicts a one-hot mean with unit variance, so kl_div_gaussian (which omits the constant term) is equal
+    # to 0.5 * (n_states + 1)
+    cem.g_value = "Expected Free Energy"
+    efe_scores = cem.evaluate(
+        actions, mean, log_var, encoder, lambda states: states, transition, lambda states: states @ rewards,
+        lambda states: states @ q_values
+    )
+    info_gain = sum(0.5 * (n_states + 1) * discount_factor ** depth for depth in range(horizon))
+    if not torch.allclose(scores - efe_scores, torch.full_like(scores, info_gain), atol=1e-4):
+        raise Exception("The information gain of the transitions is not subtracted from the scores.")
+    cem.g_value = "Reward"
+
+    # Check that the planner finds the first action of the best sequence, while the critic alone selects another action
+    best_action = actions[scores.argmax(), 0]
+    quality = cem.plan(
+        mean, log_var, encoder, lambda states: states, transition, lambda states: states @ rewards,
+        lambda states: states @ q_values
+    )
+    if best_action == q_values[0].argmax():
+        raise Exception("The environment should make the critic alone select a sub-optimal action.")
+    if quality.argmax() != best_action:
+        raise Exception(f"The planner selects the action {quality.argmax()} instead of {best_action}.")
+    print("The cross-entropy method scores each action sequence with the rewards of all its actions.")
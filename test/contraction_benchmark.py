@@ -0,0 +1,86 @@
+import time
+import torch
+from agents.inference.Contraction import Contraction
+from agents.inference.Operators import Operators
+
+
+def legacy_average(x1, x2, ml):
+    """
+    Perform an average of the first tensor with the weights of the second tensor, by expanding and permuting the
+    second tensor before the element-wise multiplication, i.e., the implementation replaced by the contraction engine
+    :param x1: the first tensor.
+    :param x2: the second tensor.
+    :param ml: the matching list describing how the dimensions of the second tensor are matched to the first tensor.
+    :return: the result of the average.
+    """
+    # Sequence of expansions
+    not_ml = [i for i in range(x1.dim()) if i not in ml]
+    x2_tmp = x2
+    for i in not_ml:
+        x2_tmp = Operators.expansion(x2_tmp, x1.shape[i], x2_tmp.dim())
+
+    # Permutation and element-wise multiplication
+    pl = [ml.index(i) if i in ml else len(ml) + not_ml.index(i) for i in range(x1.ndim)]
+    result = x2_tmp.permute(pl) * x1
+
+    # Reduction of the tensor along the matched dimensions
+    for i in sorted(ml, reverse=True):
+        result = result.sum(i)
+    return result
+
+
+def legacy_forward_prediction(params, posteriors):
+    """
+    Compute a forward prediction by averaging one parent at a time
+    :param params: the parameters of the mapping
+    :param posteriors: the posterior over each parent
+    :return: the predictive posterior
+    """
+    for i in reversed(range(len(posteriors))):
+        params = legacy_average(params, posteriors[i], [i + 1])
+    return params
+
+
+def forward_prediction(params, posteriors):
+    """
+    Compute a forward prediction using the contraction engine
+    :param params: the parameters of the mapping
+    :param posteriors: the posterior over each parent
+    :return: the predictive posterior
+    """
+    return Contraction.contract(params, [(posterior, [i + 1]) for i, posterior in enumerate(posteriors)])
+
+
+def timer(function, params, posteriors, n_runs):
+    """
+    Compute the average execution time of a forward prediction
+    :param function: the function computing the forward prediction
+    :param params: the parameters of the mapping
+    :param posteriors: the posterior over each parent
+    :param n_runs: the number of executions
+    :return: the average execution time in milliseconds
+    """
+    start_time = time.time()
+    for _ in range(n_runs):
+        function(params, posteriors)
+    return 1000 * (time.time() - start_time) / n_runs
+
+
+if __name__ == '__main__':
+    # Compare the contraction engine with the legacy operators on the likelihood of MiniSprites pixels
+    print("Size, Legacy operators (ms), Contraction engine (ms), Speed up")
+    for size in [2, 5, 10, 15, 20]:
+        # Create a likelihood mapping and the posteriors over its parents
+        params = torch.softmax(torch.rand([3, size, size, 2]), dim=0)
+        posteriors = [torch.softmax(torch.rand([n]), dim=0) for n in params.shape[1:]]
+
+        # Check that both implementations agree
+        same_results = torch.allclose(
+            legacy_forward_prediction(params, posteriors), forward_prediction(params, posteriors)
+        )
+        assert same_results, "The contraction engine and the legacy operators disagree."
+
+        # Compare the execution times
+        legacy_time = timer(legacy_forward_prediction, params, posteriors, 1000)
+        engine_time = timer(forward_prediction, params, posteriors, 1000)
+        print(f"{size}, {legacy_time:.4f}, {engine_time:.4f}, {legacy_time / engine_time:.2f}")
@@ -0,0 +1,109 @@
+import io
+import os
+import tempfile
+import torch
+from agents.AgentFactory import AgentFactory
+from agents.memory.ReplayBuffer import ReplayBuffer, Experience
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+from hosts.HostInterface import HostInterface
+
+
+def check_devices(agent, device):
+    """
+    Check that all the networks of the agent are stored on the device
+    :param agent: the agent
+    :param device: the device on which the agent was loaded
+    """
+    for name, value in vars(agent).items():
+        if not hasattr(value, "parameters"):
+            continue
+        for parameter in value.state_dict().values():
+            if parameter.device.type != device:
+                raise Exception(f"The {name} network is stored on {parameter.device} instead of {device}.")
+
+
+def check_weights(agent, loaded_agent):
+    """
+    Check that the loaded agent has the weights of the agent, i.e., the weights of its networks and its mappings
+    :param agent: the agent that was saved
+    :param loaded_agent: the agent loaded from the checkpoint
+    """
+    for name, value in vars(agent).items():
+        if not hasattr(value, "parameters"):
+            continue
+        loaded_state_dict = getattr(loaded_agent, name).state_dict()
+        for key, parameter in value.state_dict().items():
+            if not torch.equal(parameter.cpu(), loaded_state_dict[key]):
+                raise Exception(f"The parameter {key} of the {name} network differs after loading.")
+    for name, mapping in agent.dirichlet_learning.state_dicts()[0].items():
+        if not torch.equal(mapping.cpu(), loaded_agent.dirichlet_learning.state_dicts()[0][name].cpu()):
+            raise Exception(f"The mapping {name} differs after loading.")
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Create the environment and a small agent learning its encoder and its mappings
+    env = EnvironmentFactory.create({
+        "name": "MiniSprites",
+        "module": "environments.impl.MiniSpritesEnvironment",
+        "class": "MiniSpritesEnvironment",
+        "width": "5",
+        "height": "5",
+        "max_trial_length": "50"
+    })
+    agent = AgentFactory.create({
+        "name": "BTAI_3MF",
+        "module": "agents.impl.BTAI_3MF",
+        "class": "BTAI_3MF",
+        "exp_const": "2.4",
+        "n_samples": "-1",
+        "max_planning_steps": "10",
+        "inference_type": "Backpropagation",
+        "learn_mappings": "True",
+        "flush_interval": "1"
+    }, env.action_space.n, env)
+
+    # Train the agent for a few steps, so that its weights differ from the weights of a new agent
+    buffer = ReplayBuffer(capacity=1000, batch_size=agent.batch_size)
+    model_version = agent.ts.model_version()
+    obs = env.reset()
+    for i in range(2 * agent.batch_size):
+        action = agent.step(obs, i)
+        next_obs, reward, done, _ = env.step(action)
+        buffer.append(Experience(obs, action, reward, done, next_obs))
+        obs = env.reset() if done else next_obs
+        if len(buffer) >= agent.batch_size:
+            agent.learn(io.StringIO(), buffer, i)
+    if agent.ts.model_version() == model_version:
+        raise Exception("The mappings of the agent were not learned.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        agent.save(directory, 0, env)
+        checkpoint_file = os.path.join(directory, "checkpoint-0.json")
+
+        # Load the agent lazily on the cpu, its weights are only read when first used
+        loaded_agent = AgentFactory.load(checkpoint_file, env, map_location="cpu")
+        parameter = next(loaded_agent.encoder.parameters())
+        if torch.equal(parameter, next(agent.encoder.parameters()).cpu()):
+            raise Exception("The weights of the encoder should only be loaded when the encoder is first used.")
+        check_weights(agent, loaded_agent)
+        check_devices(loaded_agent, "cpu")
+
+        # Load the agent eagerly on the cpu, while the process keeps using a gpu if one is available
+        loaded_agent = AgentFactory.load(checkpoint_file, env, map_location="cpu", lazy=False)
+        print(f"Process device: {HostInterface.get_device()}, agent device: {loaded_agent.device}")
+        check_weights(agent, loaded_agent)
+        check_devices(loaded_agent, "cpu")
+
+        # Run a few action-perception cycles with the loaded agent
+        obs = env.reset()
+        for i in range(10):
+            obs, _, done, _ = env.step(loaded_agent.step(obs, i))
+            if done:
+                obs = env.reset()
+    env.close()
+    print("The agent loaded on the cpu has the weights of the saved agent, and performed 10 steps.")
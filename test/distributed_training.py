@@ -0,0 +1,54 @@
+import os
+import torch
+import torch.multiprocessing as mp
+from torch import nn
+from agents.learning import Distributed, Optimizers
+
+
+def train(rank, n_processes, n_steps, results):
+    """
+    Train a small network with one replay shard per process, and store the final weights
+    :param rank: the index of the process
+    :param n_processes: the number of processes
+    :param n_steps: the number of training iterations
+    :param results: a dictionary shared by all processes, in which the final weights are stored
+    """
+    # Initialise the distributed training using the gloo backend
+    os.environ["RANK"] = str(rank)
+    os.environ["WORLD_SIZE"] = str(n_processes)
+    Distributed.init_process_group("gloo")
+
+    # Create a network whose initial weights differ across processes, and synchronise them
+    torch.manual_seed(rank)
+    network = nn.Sequential(nn.Linear(8, 32), nn.ReLU(), nn.Linear(32, 1))
+    Distributed.broadcast_parameters([network])
+    optimizer = Optimizers.get_adam([network], 0.001)
+
+    # Train the network on data that is only available to the current process
+    for _ in range(n_steps):
+        x = torch.randn(64, 8)
+        loss = (network(x) - x.sum(dim=1, keepdim=True)).pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        Distributed.all_reduce_gradients([network])
+        optimizer.step()
+
+    # Store the final weights
+    results[rank] = torch.cat([param.detach().view(-1) for param in network.parameters()]).tolist()
+    Distributed.destroy_process_group()
+
+
+if __name__ == '__main__':
+    # Train the same network in several processes on a cpu-only machine
+    n_processes = 4
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = "29501"
+    manager = mp.Manager()
+    weights = manager.dict()
+    mp.spawn(train, args=(n_processes, 100, weights), nprocs=n_processes, join=True)
+
+    # Check that all processes ended up with the same weights
+    for i in range(1, n_processes):
+        same_weights = torch.allclose(torch.tensor(weights[0]), torch.tensor(weights[i]))
+        assert same_weights, f"The weights of process {i} differ from those of process 0."
+    print(f"Distributed training: OK ({n_processes} processes).")
@@ -1,108 +1,27 @@
+import os
 from torch import nn
 import copy
 from torch.distributions import Categorical
-from agents.inference.TemporalSliceBuilder import TemporalSliceBuilder
+from agents.impl.BTAI_3MF import BTAI_3MF
 from agents.learning import Optimizers
 from agents.planning.MCTS import MCTS
 import torch
 from environments.impl.MiniSpritesEnvironment import MiniSpritesEnvironment
+from gui.AnalysisConfig import AnalysisConfig
 
 
 #
 # BTAI_3MF agent definition
 #
-def a_matrix(env, noise=0.01):
-    likelihoods = {}
-    for x in range(env.width):
-        for y in range(env.height):
-            likelihood = torch.full([3, env.width, env.height, 2], noise / 2)
-            for c in range(2):
-                for xi in range(env.width):
-                    for yi in range(env.height):
-                        for ci in range(2):
-                            if xi == x and yi == y and ci == c:
-                                likelihood[ci][xi][yi][c] = 1 - noise
-                            if xi != x or yi != y:
-                                likelihood[2][xi][yi][c] = 1 - noise
-            likelihoods[f"O_{x}_{y}"] = likelihood
-    return likelihoods
-
-
-def b_matrix(env, n_actions, noise=0.01):
-    transitions = {}
-    # Generate the transition matrix of S_color for which action has no effect.
-    transition = torch.full([env.s_sizes[2], env.s_sizes[2]], noise / (env.s_sizes[2] - 1))
-    for j in range(env.s_sizes[2]):
-        transition[j][j] = 1 - noise
-    transitions[env.state_names[2]] = transition
-    # Generate transitions for which action has an effect.
-    for i in range(2):
-        transition = torch.full([env.s_sizes[i], env.s_sizes[i], n_actions], noise / (env.s_sizes[i] - 1))
-        for j in range(env.s_sizes[i]):
-            cur_state = torch.zeros([len(env.s_sizes)])
-            cur_state[i] = j
-            for k in range(n_actions):
-                env.x, env.y, env.reward_on_the_right = cur_state[0], cur_state[1], bool(cur_state[2])
-                env.step(k)
-                dest_state = torch.tensor([env.x, env.y, int(env.reward_on_the_right)])
-                dest_id = int(dest_state[i].item())
-                transition[dest_id][j][k] = 1 - noise
-        transitions[env.state_names[i]] = transition
-    return transitions
-
-
-def c_matrix(noise=0.01):
-    preferences = {"O_bottom_left": torch.full([3], noise / 3), "O_bottom_right": torch.full([3], noise / 3)}
-    # Create preferences for the bottom right and left corners.
-    preferences["O_bottom_left"][0] = 1 - noise
-    preferences["O_bottom_right"][1] = 1 - noise
-    return preferences
-
-
-def d_matrix(env, uniform=False, noise=0.01):
-    state = env.get_state()
-    prior_states = {}
-    for i in range(0, len(env.s_sizes)):
-        # Create the prior
-        if uniform:
-            prior = torch.full([env.s_sizes[i]], 1 / env.s_sizes[i])
-        else:
-            prior = torch.full([env.s_sizes[i]], noise / (env.s_sizes[i] - 1))
-            prior[int(state[i])] = 1 - noise
-        # Store the prior
-        prior_states[env.state_names[i]] = prior
-    return prior_states
-
-
 def create_temporal_slice(env, n_actions):
-    env = env.unwrapped
-    a = a_matrix(env)
-    b = b_matrix(env, n_actions)
-    c = c_matrix()
-    d = d_matrix(env, uniform=True)
-    ts_builder = TemporalSliceBuilder("A_0", n_actions) \
-        .add_state("S_x", d["S_x"]) \
-        .add_state("S_y", d["S_y"]) \
-        .add_state("S_color", d["S_color"]) \
-        .add_transition("S_x", b["S_x"], ["S_x", "A_0"]) \
-        .add_transition("S_y", b["S_y"], ["S_y", "A_0"]) \
-        .add_transition("S_color", b["S_color"], ["S_color"])
-    for i in range(env.width):
-        for j in range(env.height):
-            ts_builder.add_observation(f"O_{i}_{j}", a[f"O_{i}_{j}"], ["S_x", "S_y", "S_color"])
-    ts_builder.add_preference([f"O_{0}_{env.height - 1}"], c["O_bottom_left"])
-    ts_builder.add_preference([f"O_{env.width - 1}_{env.height - 1}"], c["O_bottom_right"])
-    return ts_builder.build()
+    # The generative model of the BTAI_3MF agent, which is loaded from the cache of models if possible
+    agent = BTAI_3MF({"max_planning_steps": "50", "exp_const": "2.4", "n_samples": "-1"}, n_actions, env)
+    return agent.ts
 
 
 def pre_process(obs):
-    res = {}
-    for y in range(obs.shape[0]):
-        for x in range(obs.shape[1]):
-            res[f"O_{x}_{y}"] = obs[y][x] / 255
-            if obs[y][x].max() == 0:
-                res[f"O_{x}_{y}"][2] = 1
-    return res
+    # The environment produces structured observations, i.e., the evidence of all the pixels ordered x-major
+    return {"O_pixels": torch.as_tensor(obs, dtype=torch.float32)}
 
 
 #
@@ -220,10 +139,16 @@ if __name__ == '__main__':
     # Define the type of cost to use
     efe_cost = False
 
+    # Create the configuration, so that the generative model is cached in the data directory
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
     # Create the environment
     width = "5"
     height = "5"
-    env = MiniSpritesEnvironment({"width": width, "height": height, "max_trial_length": "50"})
+    env = MiniSpritesEnvironment({
+        "width": width, "height": height, "max_trial_length": "50", "structured_observations": "True"
+    })
     n_actions = env.action_space.n
 
     # Create the agent related structures, i.e., temporal slice, mcts algorithm, critic and optimiser
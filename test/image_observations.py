@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import numpy
+import torch
+from agents.AgentFactory import AgentFactory
+from agents.checkpoints.CheckpointStore import CheckpointStore
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Load the settings of the "Effect of sampling" project, the environment produces images by default
+    project_dir = data_dir + "projects/Effect of sampling/"
+    with open(project_dir + "environments/MiniSprites.json") as file:
+        env_json = json.load(file)
+    with open(project_dir + "agents/BTAI_3MF_10_samples.json") as file:
+        agent_json = json.load(file)
+    agent_json["max_planning_steps"] = "10"
+
+    # Create the environment and the agent
+    env = EnvironmentFactory.create(env_json)
+    agent = AgentFactory.create(agent_json, env.action_space.n, env)
+    if env.unwrapped.structured_observations:
+        raise Exception("The default environment should produce images.")
+
+    # Collect a few observations
+    obs = env.reset()
+    observations = [obs]
+    for i in range(5):
+        obs, _, done, _ = env.step(i % agent.n_actions)
+        observations.append(obs)
+
+    # Check that the pre-processing of a stack of images matches the pre-processing of each image
+    evidence = agent.pre_process_batch(observations)["O_pixels"]
+    for i, obs in enumerate(observations):
+        if not torch.equal(evidence[i], agent.pre_process(obs)["O_pixels"]):
+            raise Exception(f"The pre-processing of the image {i} differs when the images are stacked.")
+    if not torch.all(evidence.sum(dim=-1) == 1):
+        raise Exception("The evidence of each pixel should be a one-hot vector.")
+
+    # Check the reconstruction of the images
+    env.reset()
+    reconstructed_images = agent.create_reconstructed_images(observations)
+    expected_shape = (len(observations), env.unwrapped.height, env.unwrapped.width, 3)
+    if reconstructed_images.shape != expected_shape:
+        raise Exception(f"The reconstructed images have shape {reconstructed_images.shape} instead of {expected_shape}.")
+
+    # Check that the agent can be saved
+    with tempfile.TemporaryDirectory() as directory:
+        agent.save(directory, 0, env)
+        for file_name in ["checkpoint-0.json", "0/obs-0.png", "0/reconstructed-obs-0.png"]:
+            if not os.path.exists(os.path.join(directory, file_name)):
+                raise Exception(f"The file {file_name} was not saved.")
+
+        # Check that the tensors of a replaced checkpoint are removed from the store
+        with torch.no_grad():
+            for parameter in agent.encoder.parameters():
+                parameter.add_(1)
+        agent.save(directory, 0, env)
+        checkpoint = CheckpointStore.load(os.path.join(directory, "checkpoint-0.json"))
+        keys = set(key for entry, value in checkpoint.items() if entry.endswith("_state_dict") for key in value.values())
+        tensor_files = set(os.listdir(os.path.join(directory, "tensors")))
+        if tensor_files != set(f"{key}.npy" for key in keys):
+            raise Exception(f"The store contains {len(tensor_files)} tensors instead of {len(keys)}.")
+    env.close()
+    print("The image observations are pre-processed, reconstructed and saved.")
@@ -0,0 +1,68 @@
+import math
+import os
+import time
+import torch
+from agents.AgentFactory import AgentFactory
+from agents.inference.enum.InferenceAlgorithms import InferenceAlgorithms as InfAlgo
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Check the posteriors computed by loopy belief propagation, with and without damping
+    n_observations = 10
+    print("Damping, Time per I-step (s), Iterations, Message updates")
+    for damping in ["0", "0.5"]:
+        env = EnvironmentFactory.create({
+            "name": "MiniSprites",
+            "module": "environments.impl.MiniSpritesEnvironment",
+            "class": "MiniSpritesEnvironment",
+            "width": "5",
+            "height": "5",
+            "max_trial_length": "50"
+        })
+        agent = AgentFactory.create({
+            "name": "BTAI_3MF",
+            "module": "agents.impl.BTAI_3MF",
+            "class": "BTAI_3MF",
+            "exp_const": "2.4",
+            "n_samples": "-1",
+            "max_planning_steps": "150",
+            "inference_type": "Loopy belief propagation",
+            "lbp_damping": damping
+        }, env.action_space.n, env)
+
+        # The most likely states must be the states of the environment (the color of the shape is 0 when the reward is
+        # on the right), since the observations are near-deterministic
+        i_step_time = 0
+        for i in range(n_observations):
+            obs = agent.pre_process(env.reset())
+            start_time = time.time()
+            agent.ts.reset()
+            agent.ts.i_step(obs, InfAlgo.LOOPY_BELIEF_PROPAGATION)
+            i_step_time += time.time() - start_time
+            if not agent.ts.lbp.stats["converged"]:
+                raise Exception(f"Loopy belief propagation did not converge with a damping of {damping}.")
+            unwrapped_env = env.unwrapped
+            state = [unwrapped_env.x, unwrapped_env.y, 0 if unwrapped_env.reward_on_the_right else 1]
+            for j, state_name in enumerate(unwrapped_env.state_names):
+                if int(agent.ts.states_posterior[state_name].argmax()) != state[j]:
+                    raise Exception(f"The posterior over {state_name} does not match the environment.")
+        stats = agent.ts.lbp.stats
+        print(f"{damping}, {i_step_time / n_observations:.3f}, {stats['iterations']}, {stats['n_updates']}")
+
+        # A NaN message must reset the posteriors to the priors, and be counted as a failure
+        obs = {name: torch.full_like(evidence, math.nan) for name, evidence in obs.items()}
+        agent.ts.reset()
+        agent.ts.i_step(obs, InfAlgo.LOOPY_BELIEF_PROPAGATION)
+        if agent.ts.lbp.stats["n_failures"] != 1:
+            raise Exception("The NaN message was not counted as a failure of loopy belief propagation.")
+        for state_name, prior in agent.ts.states_priors().items():
+            if not torch.equal(agent.ts.states_posterior[state_name], prior):
+                raise Exception(f"The posterior over {state_name} was not reset to its prior after a NaN message.")
+        env.close()
+    print("Loopy belief propagation recovers the states of the environment.")
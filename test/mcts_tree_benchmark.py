@@ -0,0 +1,55 @@
+import os
+import time
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from environments.wrappers.DefaultWrappers import DefaultWrappers
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Compare the planning speed of the tree of temporal slices and of the tree stored in arrays
+    n_steps = 5
+    print("Size, MCTS tree, Iterations per second, Select (s), Expand (s), Evaluate (s), Backup (s)")
+    for size in [5, 10, 20]:
+        for mcts_tree in ["Temporal slices", "Arrays"]:
+            # Create the environment and the agent
+            env = EnvironmentFactory.create({
+                "name": "MiniSprites",
+                "module": "environments.impl.MiniSpritesEnvironment",
+                "class": "MiniSpritesEnvironment",
+                "width": str(size),
+                "height": str(size),
+                "max_trial_length": "50"
+            })
+            agent = AgentFactory.create({
+                "name": "BTAI_3MF",
+                "module": "agents.impl.BTAI_3MF",
+                "class": "BTAI_3MF",
+                "exp_const": "2.4",
+                "n_samples": "-1",
+                "max_planning_steps": "150",
+                "mcts_tree": mcts_tree
+            }, env.action_space.n, env)
+            env = DefaultWrappers.apply("BTAI_3MF", env, image_shape=(1, 64, 64))
+
+            # Run a few action-perception cycles, and keep track of the time spent in each phase of the planning
+            obs = env.reset()
+            agent.mcts.reset_timers()
+            planning_time = 0
+            for i in range(n_steps):
+                start_time = time.time()
+                action = agent.step(obs, i)
+                planning_time += time.time() - start_time
+                obs, _, done, _ = env.step(action)
+                if done:
+                    obs = env.reset()
+            timers = agent.mcts.timers
+            print(
+                f"{size}, {mcts_tree}, {n_steps * agent.max_planning_steps / planning_time:.0f}, "
+                f"{timers['select']:.3f}, {timers['expand']:.3f}, {timers['evaluate']:.3f}, {timers['backup']:.3f}"
+            )
+            env.close()
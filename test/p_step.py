@@ -0,0 +1,42 @@
+import json
+import os
+import torch
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Load the settings of the "Effect of sampling" project
+    project_dir = data_dir + "projects/Effect of sampling/"
+    with open(project_dir + "environments/MiniSprites.json") as file:
+        env_json = json.load(file)
+    with open(project_dir + "agents/BTAI_3MF_analytic.json") as file:
+        agent_json = json.load(file)
+
+    # Create the environment and the agent, and perform the I-step
+    env = EnvironmentFactory.create(env_json)
+    agent = AgentFactory.create(agent_json, env.action_space.n, env)
+    ts = agent.ts
+    obs = agent.pre_process(env.reset())
+    ts.reset()
+    ts.i_step(obs, agent.inference_type)
+
+    # Check that the P-step of each action matches the batched expansion of all the actions
+    children = [ts.p_step(action) for action in range(agent.n_actions)]
+    ts.reset()
+    ts.i_step(obs, agent.inference_type)
+    expanded_children = ts.expand()
+    for action, (child, expanded_child) in enumerate(zip(children, expanded_children)):
+        for state_name, posterior in child.states_posterior.items():
+            if not torch.allclose(posterior, expanded_child.states_posterior[state_name], atol=1e-6):
+                raise Exception(f"The P-step of action {action} predicts a different posterior over {state_name}.")
+        if abs(child.efe(-1) - expanded_child.efe(-1)) > 1e-4:
+            raise Exception(f"The P-step of action {action} gives an EFE of {child.efe(-1)} instead of "
+                            f"{expanded_child.efe(-1)}.")
+    env.close()
+    print("The P-step matches the batched expansion of the temporal slice.")
@@ -0,0 +1,52 @@
+import os
+import time
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from environments.wrappers.DefaultWrappers import DefaultWrappers
+from gui.AnalysisConfig import AnalysisConfig
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Compute the planning time of one action for different numbers of leaves expanded in parallel
+    n_steps = 5
+    print("Size, Number of parallel leaves, Planning time per step (s), Speed up")
+    for size in [5, 10, 20]:
+        sequential_time = None
+        for n_parallel_leaves in [1, 2, 4, 8, 16]:
+            # Create the environment and the agent
+            env = EnvironmentFactory.create({
+                "name": "MiniSprites",
+                "module": "environments.impl.MiniSpritesEnvironment",
+                "class": "MiniSpritesEnvironment",
+                "width": str(size),
+                "height": str(size),
+                "max_trial_length": "50"
+            })
+            agent = AgentFactory.create({
+                "name": "BTAI_3MF",
+                "module": "agents.impl.BTAI_3MF",
+                "class": "BTAI_3MF",
+                "exp_const": "2.4",
+                "n_samples": "-1",
+                "max_planning_steps": "150",
+                "mcts_tree": "Arrays",
+                "n_parallel_leaves": str(n_parallel_leaves)
+            }, env.action_space.n, env)
+            env = DefaultWrappers.apply("BTAI_3MF", env, image_shape=(1, 64, 64))
+
+            # Run a few action-perception cycles
+            obs = env.reset()
+            start_time = time.time()
+            for i in range(n_steps):
+                obs, _, done, _ = env.step(agent.step(obs, i))
+                if done:
+                    obs = env.reset()
+            step_time = (time.time() - start_time) / n_steps
+            if sequential_time is None:
+                sequential_time = step_time
+            print(f"{size}, {n_parallel_leaves}, {step_time}, {sequential_time / step_time:.2f}")
+            env.close()
@@ -0,0 +1,77 @@
+import os
+import time
+import torch
+from agents.impl.BTAI_3MF import BTAI_3MF
+from agents.inference.StructuredNoiseTensor import StructuredNoiseTensor
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+def mappings_size(ts):
+    """
+    Compute the memory used by the likelihood and transition mappings of a temporal slice
+    :param ts: the temporal slice
+    :return: the number of bytes used by the mappings
+    """
+    mappings = list(ts.states_transition.values()) + [params for _, params, _ in ts.obs_groups.values()]
+    return sum([
+        params.nbytes() if isinstance(params, StructuredNoiseTensor) else params.numel() * params.element_size()
+        for params in mappings
+    ])
+
+
+def evaluate(ts, n_repeats):
+    """
+    Expand and evaluate the children of the root of a planning tree several times
+    :param ts: the temporal slice
+    :param n_repeats: the number of expansions and evaluations
+    :return: the time of one expansion and evaluation, and the expected free energy of the children
+    """
+    ts.states_posterior = {k: v.clone() for k, v in ts.states_prior.items()}
+    start_time = time.perf_counter()
+    efe = None
+    for _ in range(n_repeats):
+        efe = ts.batched_efe(ts.predict_all_actions(ts.states_posterior))
+    return (time.perf_counter() - start_time) / n_repeats, efe
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Compare the dense and structured noise mappings, as the size of the grid grows
+    n_repeats = 10
+    print(
+        "Size, Dense memory (MB), Structured memory (MB), Dense build (s), Structured build (s), Dense time (ms), "
+        "Structured time (ms), Max EFE error"
+    )
+    for size in [5, 10, 20, 40]:
+        env = EnvironmentFactory.create({
+            "name": "MiniSprites",
+            "module": "environments.impl.MiniSpritesEnvironment",
+            "class": "MiniSpritesEnvironment",
+            "width": str(size),
+            "height": str(size),
+            "max_trial_length": "50"
+        })
+        results = []
+        for structured_noise in ["False", "True"]:
+            start_time = time.perf_counter()
+            agent = BTAI_3MF({
+                "max_planning_steps": "150", "exp_const": "2.4", "n_samples": "-1",
+                "structured_noise": structured_noise
+            }, env.action_space.n, env)
+            build_time = time.perf_counter() - start_time
+            with torch.no_grad():
+                results.append((mappings_size(agent.ts), build_time, *evaluate(agent.ts, n_repeats)))
+        (dense_size, dense_build, dense_time, dense_efe), (sparse_size, sparse_build, sparse_time, sparse_efe) = results
+        print(
+            f"{size}, {dense_size / 2 ** 20:.2f}, {sparse_size / 2 ** 20:.2f}, {dense_build:.2f}, {sparse_build:.2f}, "
+            f"{dense_time * 1000:.2f}, {sparse_time * 1000:.2f}, {(dense_efe - sparse_efe).abs().max().item():.2e}"
+        )
+        env.close()
+
+        # Check that the structured noise mappings give the same expected free energy as the dense mappings
+        if (dense_efe - sparse_efe).abs().max().item() > 1e-3:
+            raise Exception(f"The structured noise mappings give a different expected free energy on {size}x{size}.")
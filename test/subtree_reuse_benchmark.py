@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+import time
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from environments.wrappers.DefaultWrappers import DefaultWrappers
+from gui.AnalysisConfig import AnalysisConfig
+
+
+def run(agent, env, n_steps):
+    """
+    Run the agent in the environment
+    :param agent: the agent
+    :param env: the environment
+    :param n_steps: the number of action-perception cycles
+    :return: the total reward
+    """
+    total_reward = 0
+    obs = env.reset()
+    for i in range(n_steps):
+        action = agent.step(obs, i)
+        obs, reward, done, _ = env.step(action)
+        total_reward += reward
+        if done:
+            obs = env.reset()
+    return total_reward
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Load the settings of the "Effect of sampling" project, the agents are sorted by number of samples so that the
+    # cheapest agents (i.e., the analytic agent first) are benchmarked first
+    project_dir = data_dir + "projects/Effect of sampling/"
+    with open(project_dir + "environments/MiniSprites.json") as file:
+        env_json = json.load(file)
+    agent_jsons = []
+    for agent_file in os.listdir(project_dir + "agents/"):
+        with open(project_dir + "agents/" + agent_file) as file:
+            agent_jsons.append(json.load(file))
+    agent_jsons.sort(key=lambda agent_json: int(agent_json["n_samples"]))
+
+    # Compare planning from scratch with the reuse of the selected subtree, for each agent of the project, the number
+    # of action-perception cycles can be passed as argument
+    n_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("Agent, Reuse subtree, Time per step (s), Total reward, Tree capacity, Reused iterations per step, "
+          "Discarded subtrees", flush=True)
+    for agent_json in agent_jsons:
+        for reuse_subtree in ["False", "True"]:
+            # Create the environment and the agent
+            env = EnvironmentFactory.create(env_json)
+            agent = AgentFactory.create(
+                {**agent_json, "mcts_tree": "Arrays", "reuse_subtree": reuse_subtree}, env.action_space.n, env
+            )
+            env = DefaultWrappers.apply("BTAI_3MF", env, image_shape=(1, 64, 64))
+
+            # Run the agent and display the results
+            start_time = time.time()
+            reward = run(agent, env, n_steps)
+            step_time = (time.time() - start_time) / n_steps
+            reused_iterations = agent.mcts.n_reused_iterations / n_steps
+            print(
+                f"{agent_json['name']}, {reuse_subtree}, {step_time}, {reward}, {agent.mcts.capacity}, "
+                f"{reused_iterations}, {agent.mcts.n_discarded_subtrees}", flush=True
+            )
+            env.close()
@@ -0,0 +1,59 @@
+import json
+import os
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+def check_transition(transitions, state_name, position, action, expected):
+    """
+    Check the most likely position reached by performing an action
+    :param transitions: the transition mappings of the agent
+    :param state_name: the name of the state whose transition is checked
+    :param position: the position from which the action is performed
+    :param action: the action performed
+    :param expected: the position that should be reached
+    """
+    reached = int(transitions[state_name][:, position, action].argmax())
+    if reached != expected:
+        raise Exception(f"Action {action} from {state_name}={position} reaches {reached} instead of {expected}.")
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # Load the settings of the "Effect of sampling" project
+    project_dir = data_dir + "projects/Effect of sampling/"
+    with open(project_dir + "environments/MiniSprites.json") as file:
+        env_json = json.load(file)
+    agent_file = sorted(os.listdir(project_dir + "agents/"))[0]
+    with open(project_dir + "agents/" + agent_file) as file:
+        agent_json = json.load(file)
+
+    # Create the environment and the agent
+    env = EnvironmentFactory.create(env_json)
+    agent = AgentFactory.create(agent_json, env.action_space.n, env)
+    transitions = agent.b()
+    env = env.unwrapped
+
+    # Check a few transitions, the actions are: down, up, left, right and idle
+    check_transition(transitions, "S_x", 1, 3, 2)
+    check_transition(transitions, "S_x", 1, 2, 0)
+    check_transition(transitions, "S_x", 0, 2, 0)
+    check_transition(transitions, "S_x", env.width - 1, 3, env.width - 1)
+    check_transition(transitions, "S_y", 1, 1, 0)
+    check_transition(transitions, "S_y", 1, 0, 2)
+    check_transition(transitions, "S_y", 1, 4, 1)
+
+    # Check all the transitions against the environment, each action is performed from a fresh position
+    for i, state_name in enumerate(env.state_names[:2]):
+        for position in range(env.s_sizes[i]):
+            for action in range(agent.n_actions):
+                env.reset()
+                env.x, env.y = (position, 0) if i == 0 else (0, position)
+                env.step(action)
+                check_transition(transitions, state_name, position, action, [env.x, env.y][i])
+    env.close()
+    print("The transition mappings match the environment.")
@@ -0,0 +1,67 @@
+import os
+import time
+from agents.AgentFactory import AgentFactory
+from environments.EnvironmentFactory import EnvironmentFactory
+from gui.AnalysisConfig import AnalysisConfig
+
+
+def run(agent, env, n_steps):
+    """
+    Run a few action-perception cycles
+    :param agent: the agent
+    :param env: the environment
+    :param n_steps: the number of action-perception cycles
+    :return: the number of planning iterations per second
+    """
+    obs = env.reset()
+    start_time = time.time()
+    for i in range(n_steps):
+        obs, _, done, _ = env.step(agent.step(obs, i))
+        if done:
+            obs = env.reset()
+    return n_steps * agent.max_planning_steps / (time.time() - start_time)
+
+
+if __name__ == '__main__':
+    # Create the configuration
+    data_dir = os.path.dirname(os.path.abspath(__file__)) + "/../data/"
+    AnalysisConfig.get(data_directory=data_dir)
+
+    # The smallest hit rate expected with the default precision of the transposition table
+    min_hit_rate = 0.05
+
+    # Measure the hit rate of the transposition table for each precision and each type of MCTS tree
+    print("Tree, Precision, Hit rate, Iterations per second")
+    for mcts_tree in ["Temporal slices", "Arrays"]:
+        for precision in ["0.0001", "0.001", "0.01", None]:
+            env = EnvironmentFactory.create({
+                "name": "MiniSprites",
+                "module": "environments.impl.MiniSpritesEnvironment",
+                "class": "MiniSpritesEnvironment",
+                "width": "5",
+                "height": "5",
+                "max_trial_length": "50"
+            })
+            agent_json = {
+                "name": "BTAI_3MF",
+                "module": "agents.impl.BTAI_3MF",
+                "class": "BTAI_3MF",
+                "exp_const": "2.4",
+                "n_samples": "-1",
+                "max_planning_steps": "150",
+                "mcts_tree": mcts_tree,
+                "transposition_table_size": "10000",
+            }
+            if precision is not None:
+                agent_json["transposition_table_precision"] = precision
+            agent = AgentFactory.create(agent_json, env.action_space.n, env)
+            agent.mcts.reset_timers()
+            iterations_per_second = run(agent, env, 5)
+            hit_rate = agent.mcts.get_table_stats()["hit_rate"]
+            env.close()
+            print(f"{mcts_tree}, {precision or 'default'}, {hit_rate:.3f}, {iterations_per_second:.0f}")
+
+            # Check that the transposition table is useful with its default precision
+            if precision is None and hit_rate < min_hit_rate:
+                raise Exception(f"The hit rate of the transposition table is {hit_rate:.3f} with the {mcts_tree} tree.")
+    print("The transposition table is hit with its default precision.")
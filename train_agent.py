@@ -1,6 +1,7 @@
 import json
 import os
 from agents.AgentFactory import AgentFactory
+from agents.learning import Distributed
 from agents.memory.ReplayBuffer import ReplayBuffer, Experience
 from environments.EnvironmentFactory import EnvironmentFactory
 import numpy as np
@@ -8,7 +9,9 @@ import random
 import argparse
 from environments.wrappers.DefaultWrappers import DefaultWrappers
 from gui.AnalysisConfig import AnalysisConfig
+from hosts.HostInterface import HostInterface
 import datetime
+import time
 import torch
 
 
@@ -19,12 +22,14 @@ def training_loop(agent, env, logging_file):
     :param env: the environment to train
     :param logging_file: the file in which to log the agent performance
     """
-    # Create the replay buffer
+    # Create the replay buffer, when the training is distributed each process only stores its own experiences
     buffer = ReplayBuffer()
 
     # Retrieve the initial observation from the environment
     obs = env.reset()
     total_rewards = 0
+    training_time = 0
+    n_training_samples = 0
     i = 0
     while i < 1000000:
         # Select an action
@@ -38,12 +43,18 @@ def training_loop(agent, env, logging_file):
         buffer.append(Experience(old_obs, action, reward, done, obs))
 
         # Perform one iteration of training (if needed)
-        if len(buffer) >= 1000:
+        if len(buffer) >= max(1000, agent.batch_size):
+            start_time = time.time()
             agent.learn(logging_file, buffer, i)
+            training_time += time.time() - start_time
+            n_training_samples += agent.batch_size
 
-        # Save the agent (if needed)
-        if i % 10000 == 0:
+        # Save the agent and report the training throughput (if needed)
+        if i % 10000 == 0 and Distributed.is_main_process():
             agent.save(os.path.dirname(logging_file.name), i, env)
+            if training_time != 0:
+                throughput = n_training_samples * Distributed.world_size() / training_time
+                print(f"Training throughput: {throughput:.1f} samples per second", flush=True)
 
         # Monitor total rewards
         total_rewards += reward
@@ -66,8 +77,14 @@ def train(agent_filename, env_filename):
     :param agent_filename: the path to the agent file
     :param env_filename: the path to the environment file
     """
-    # Set the project seed
-    seed = 0
+    # Initialise the distributed training (if needed), each process uses its own gpu
+    distributed = Distributed.init_process_group()
+    if distributed and torch.cuda.is_available():
+        HostInterface.set_device(f"cuda:{Distributed.local_rank()}")
+        torch.cuda.set_device(HostInterface.get_device())
+
+    # Set the project seed, each process uses a different seed to collect different experiences
+    seed = Distributed.rank()
     np.random.seed(seed)
     random.seed(seed)
     torch.manual_seed(seed)
@@ -85,10 +102,17 @@ def train(agent_filename, env_filename):
     agent_file = open(agent_filename, "r")
     agent_json = json.load(agent_file)
     agent = AgentFactory.create(agent_json, env.action_space.n, env)
+    Distributed.broadcast_parameters([module for module in vars(agent).values() if isinstance(module, torch.nn.Module)])
 
     # Apply required wrappers to the environment
     env = DefaultWrappers.apply(agent_json["class"], env, image_shape=(1, 64, 64))
 
+    # Train the agent without logging, if the process is not the main process
+    if not Distributed.is_main_process():
+        training_loop(agent, env, open(os.devnull, "w"))
+        Distributed.destroy_process_group()
+        return
+
     # Create the logging file
     logging_dir = data_dir + f"logging/{env_json['name']}/{agent_json['name']}/"
     if not os.path.exists(logging_dir):
@@ -105,6 +129,8 @@ def train(agent_filename, env_filename):
 
     # Keep track of hardware
     hardware = f"gpu[{torch.cuda.get_device_name()}," if torch.cuda.is_available() else "cpu,"
+    if distributed:
+        hardware = f"{Distributed.world_size()}x{hardware}"
     job_file.write(hardware)
     job_file.flush()
 
@@ -116,6 +142,7 @@ def train(agent_filename, env_filename):
 
     # Keep track of the ending time
     job_file.write(f"{datetime.datetime.now()}\n")
+    Distributed.destroy_process_group()
 
 
 if __name__ == '__main__':
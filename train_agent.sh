@@ -2,4 +2,8 @@
 
 source "$1/venv/bin/activate"
 
-python3 "$1/train_agent.py" "$2" "$3"
+# The first node of the allocation coordinates the distributed training, if several tasks are requested
+export MASTER_ADDR=$(scontrol show hostnames "$SLURM_JOB_NODELIST" | head -n 1)
+export MASTER_PORT=29500
+
+srun python3 "$1/train_agent.py" "$2" "$3"